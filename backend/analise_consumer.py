@@ -3,18 +3,24 @@ import redis
 import json
 import sys
 import time
+import signal
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 # Adiciona a pasta raiz do backend ao path para import
 sys.path.append('.')
 
 from config import (
-    CLOUD_AMQP_URL, UPSTASH_REDIS_URL, RABBITMQ_QUEUE_NAME, 
-    REDIS_RISK_KEY, REDIS_LATEST_DATA_KEY
+    CLOUD_AMQP_URL, UPSTASH_REDIS_URL, RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE,
+    RABBITMQ_CONSUMER_QUEUES, ANALISE_WORKERS
 )
 from analysis_logic import calcular_risco, formatar_resultado_cache
+from estado_dispositivos import ultimas_por_device, enfileirar_estados
+from wire_format import decodificar_leituras, WireFormatError
 
 r_cache = None
-QUEUE_NAME = RABBITMQ_QUEUE_NAME
+QUEUE_NAME = RABBITMQ_CONSUMER_QUEUES['analise']
 
 def connect_redis():
     """Conecta ao Upstash Redis usando a URL de configuração. Sai em caso de falha."""
@@ -28,99 +34,275 @@ def connect_redis():
         print(f" ERRO FATAL: Falha ao conectar ao Upstash Redis: {e}")
         sys.exit(1)
 
+def analisar_mensagem(body, content_type=None):
+    """
+    Decodifica a leitura, calcula o risco e publica o resultado no Redis.
+    Levanta json.JSONDecodeError/WireFormatError para "poison messages" e Exception para falhas no processamento.
+    Retorna: nível geral de risco (da leitura mais recente)
+    """
+    # 1. Decodificar a mensagem (JSON ou binário, conforme o content_type)
+    # Em um lote, só a leitura mais recente de cada dispositivo interessa ao cache
+    leituras = ultimas_por_device(decodificar_leituras(body, content_type))
+    
+    # 2. Processar a lógica de negócio (formatar_resultado_cache retorna um dicionário)
+    resultados = [
+        formatar_resultado_cache(dados_brutos, calcular_risco(dados_brutos))
+        for dados_brutos in leituras
+    ]
+    
+    # 3. Um pipeline para o estado por dispositivo, o ranking de risco e as chaves globais
+    with r_cache.pipeline() as pipe:
+        enfileirar_estados(pipe, resultados)
+        pipe.execute()
+    
+    return resultados[-1]['nivel_geral']
+
 def callback(ch, method, properties, body):
     """Função chamada ao receber uma mensagem do RabbitMQ."""
     
     try:
-        # 1. Tentar decodificar o JSON
-        dados_brutos = json.loads(body.decode('utf-8'))
-        
-    except json.JSONDecodeError as e:
-        # 2. Se falhar, é uma "poison message". Rejeitar permanentemente.
-        print(f" ERRO DE DECODIFICAÇÃO JSON: {e}. Mensagem: {body}. Rejeitando (nack, requeue=False)...")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        return
-        
-    try:
-        # 3. Processar a lógica de negócio
-        riscos = calcular_risco(dados_brutos)
-        
-        # formatar_resultado_cache retorna um dicionário
-        resultado_final_dict = formatar_resultado_cache(dados_brutos, riscos)
-        
-        # 4. Preparar dados para o cache
-        # Serializar o dicionário completo para o cache principal
-        resultado_final_json = json.dumps(resultado_final_dict)
-        # Extrair o nível de risco para a chave separada
-        nivel_geral = resultado_final_dict['nivel_geral']
-        
-        # 5. Usar um pipeline para executar múltiplos comandos SET de forma eficiente
-        with r_cache.pipeline() as pipe:
-            pipe.set(REDIS_LATEST_DATA_KEY, resultado_final_json)
-            pipe.set(REDIS_RISK_KEY, nivel_geral)
-            pipe.execute()
-
+        nivel_geral = analisar_mensagem(body, properties.content_type)
         print(f" ANÁLISE/CACHE: Nível de Risco: {nivel_geral} | Publicado no Upstash Redis.")
         
-        # 6. Confirmar sucesso ao RabbitMQ
+        # Confirmar sucesso ao RabbitMQ
         ch.basic_ack(delivery_tag=method.delivery_tag)
+        
+    except (json.JSONDecodeError, WireFormatError) as e:
+        # Se falhar, é uma "poison message". Rejeitar permanentemente.
+        print(f" ERRO DE DECODIFICAÇÃO: {e}. Mensagem: {body}. Rejeitando (nack, requeue=False)...")
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
     except Exception as e:
-        # 7. Se o processamento (passo 3-5) falhar, rejeitar a mensagem
+        # Se o processamento falhar, rejeitar a mensagem
         print(f" ERRO NO PROCESSAMENTO DA ANÁLISE: {e}. Rejeitando (nack, requeue=False)...")
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
 
+def _declarar_fila(channel):
+    """Fila própria ligada ao exchange fanout (não disputa mensagens com a persistência)"""
+    channel.exchange_declare(exchange=RABBITMQ_EXCHANGE_NAME, exchange_type=RABBITMQ_EXCHANGE_TYPE, durable=True)
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.queue_bind(queue=QUEUE_NAME, exchange=RABBITMQ_EXCHANGE_NAME)
+
 def start_consumer():
-    """Inicia o loop principal de escuta do RabbitMQ."""
-    connection = None
-    try:
+    """Inicia o loop principal de escuta do RabbitMQ (reconecta em loop se o broker cair)."""
+    while True:
+        connection = None
+        try:
+            params = pika.URLParameters(CLOUD_AMQP_URL)
+            connection = pika.BlockingConnection(params)
+            channel = connection.channel()
+            _declarar_fila(channel)
+            print(" Conexão com CloudAMQP estabelecida.")
+            
+        except pika.exceptions.AMQPConnectionError as e:
+            # Tenta reconectar em loop se a conexão falhar (sem recursão: a pilha não cresce)
+            print(f" ERRO: CloudAMQP não disponível. Tentando reconectar em 5s... ({e})")
+            time.sleep(5)
+            continue
+        except Exception as e:
+            print(f" ERRO FATAL: Falha inesperada ao conectar ao CloudAMQP: {e}")
+            sys.exit(1)
+            
+        # Garante que o consumidor só processa uma mensagem por vez
+        channel.basic_qos(prefetch_count=1)
+            
+        channel.basic_consume(
+            queue=QUEUE_NAME,
+            on_message_callback=callback,
+            auto_ack=False # Confirmação manual é necessária (basic_ack/nack)
+        )
+
+        print(' Aguardando mensagens. Para sair, pressione CTRL+C')
+        try:
+            channel.start_consuming()
+            return
+        except KeyboardInterrupt:
+            print('Interrupção detectada. Fechando conexão.')
+            return
+        except pika.exceptions.ConnectionClosedByBroker:
+            print(" Conexão fechada pelo broker. Tentando reconectar...")
+        except Exception as e:
+            print(f"Erro inesperado durante o consumo: {e}")
+            return
+        finally:
+            if connection and connection.is_open:
+                try:
+                    connection.close()
+                    print(" Conexão com RabbitMQ fechada.")
+                except Exception as e:
+                    print(f" Erro ao fechar conexão RabbitMQ: {e}")
+
+
+class AnaliseWorker:
+    """
+    Worker de análise: a thread principal só faz I/O com o RabbitMQ e o
+    processamento (cálculo + Redis) roda em um pool de threads.
+    Os ACKs voltam para a thread de I/O via add_callback_threadsafe,
+    já que a conexão do pika não é thread-safe.
+    """
+    
+    def __init__(self, worker_id, threads, prefetch_count, report_interval):
+        self.worker_id = worker_id
+        self.threads = threads
+        self.prefetch_count = prefetch_count
+        self.report_interval = report_interval
+        
+        self.connection = None
+        self.channel = None
+        self._drenando = False
+        
+        # Métricas de vazão
+        self.processadas = 0
+        self.erros = 0
+        self._processadas_no_ultimo_relatorio = 0
+        self._inicio = time.time()
+    
+    def run(self):
+        """Consome até receber SIGTERM/SIGINT; reconecta (iterativamente) se o broker cair."""
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        
+        while not self._drenando:
+            try:
+                self._consumir()
+            except pika.exceptions.AMQPConnectionError as e:
+                if self._drenando:
+                    break
+                print(f" WORKER {self.worker_id}: CloudAMQP indisponível. Reconectando em 5s... ({e})")
+                time.sleep(5)
+        
+        duracao = max(time.time() - self._inicio, 1e-9)
+        print(f" WORKER {self.worker_id}: encerrado. {self.processadas} mensagens "
+              f"({self.processadas / duracao:.1f} msg/s em média, {self.erros} erros).")
+    
+    def _consumir(self):
         params = pika.URLParameters(CLOUD_AMQP_URL)
-        connection = pika.BlockingConnection(params)
-        channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME, durable=True)
-        print(" Conexão com CloudAMQP estabelecida.")
+        self.connection = pika.BlockingConnection(params)
+        self.channel = self.connection.channel()
+        _declarar_fila(self.channel)
         
-    except pika.exceptions.AMQPConnectionError as e:
-        # Tenta reconectar em loop se a conexão falhar (comportamento do script original)
-        print(f" ERRO: CloudAMQP não disponível. Tentando reconectar em 5s... ({e})")
-        time.sleep(5)
-        start_consumer() # Recomeça o processo de conexão
-        return # Sai desta tentativa falha
-    except Exception as e:
-        print(f" ERRO FATAL: Falha inesperada ao conectar ao CloudAMQP: {e}")
-        sys.exit(1)
+        # Prefetch maior que 1 mantém o pool de threads ocupado enquanto o Redis responde
+        self.channel.basic_qos(prefetch_count=self.prefetch_count)
+        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=self._on_message)
         
-    # Garante que o consumidor só processa uma mensagem por vez
-    channel.basic_qos(prefetch_count=1)
+        executor = ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix=f'analise-{self.worker_id}'
+        )
+        self._executor = executor
+        self.connection.call_later(self.report_interval, self._relatorio)
+        print(f" WORKER {self.worker_id}: consumindo (prefetch={self.prefetch_count}, threads={self.threads}).")
+        
+        try:
+            self.channel.start_consuming()
+        finally:
+            # Drenagem: espera as mensagens em andamento e envia os ACKs pendentes
+            executor.shutdown(wait=True)
+            if self.connection.is_open:
+                self.connection.process_data_events(time_limit=1)
+                self.connection.close()
+    
+    def _on_message(self, ch, method, properties, body):
+        """Thread de I/O: só repassa a mensagem para o pool"""
+        self._executor.submit(self._processar, ch, method.delivery_tag, body, properties.content_type)
+    
+    def _processar(self, ch, delivery_tag, body, content_type=None):
+        """Thread do pool: análise + Redis, sem tocar no canal diretamente"""
+        try:
+            analisar_mensagem(body, content_type)
+            sucesso = True
+        except (json.JSONDecodeError, WireFormatError) as e:
+            print(f" WORKER {self.worker_id}: ERRO DE DECODIFICAÇÃO: {e}. Rejeitando (nack, requeue=False)...")
+            sucesso = False
+        except Exception as e:
+            print(f" WORKER {self.worker_id}: ERRO NO PROCESSAMENTO DA ANÁLISE: {e}. Rejeitando (nack, requeue=False)...")
+            sucesso = False
+        
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self._confirmar, ch, delivery_tag, sucesso)
+            )
+        except pika.exceptions.AMQPError:
+            # Conexão caiu: a mensagem não confirmada volta para a fila sozinha
+            pass
+    
+    def _confirmar(self, ch, delivery_tag, sucesso):
+        """Thread de I/O: ACK/NACK da mensagem processada"""
+        if not ch.is_open:
+            return
+        
+        if sucesso:
+            ch.basic_ack(delivery_tag=delivery_tag)
+            self.processadas += 1
+        else:
+            ch.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            self.erros += 1
+    
+    def _relatorio(self):
+        """Imprime a vazão (msg/s) do worker e reagenda o próximo relatório"""
+        novas = self.processadas - self._processadas_no_ultimo_relatorio
+        self._processadas_no_ultimo_relatorio = self.processadas
+        print(f" WORKER {self.worker_id}: {novas / self.report_interval:.1f} msg/s "
+              f"({self.processadas} processadas, {self.erros} erros)")
+        
+        if not self._drenando and self.connection.is_open:
+            self.connection.call_later(self.report_interval, self._relatorio)
+    
+    def _on_signal(self, signum, frame):
+        """SIGTERM/SIGINT: para de receber novas mensagens e drena as que estão em andamento"""
+        if self._drenando:
+            return
+        self._drenando = True
+        print(f" WORKER {self.worker_id}: sinal {signum} recebido. Drenando mensagens em andamento...")
         
-    channel.basic_consume(
-        queue=QUEUE_NAME,
-        on_message_callback=callback,
-        auto_ack=False # Confirmação manual é necessária (basic_ack/nack)
-    )
+        if self.connection and self.connection.is_open:
+            self.connection.add_callback_threadsafe(self.channel.stop_consuming)
 
-    print(' Aguardando mensagens. Para sair, pressione CTRL+C')
-    try:
-        channel.start_consuming()
-    except KeyboardInterrupt:
-        print('Interrupção detectada. Fechando conexão.')
-    except pika.exceptions.ConnectionClosedByBroker:
-        print(" Conexão fechada pelo broker. Tentando reconectar...")
-        start_consumer() # Tenta reconectar
-    except Exception as e:
-        print(f"Erro inesperado durante o consumo: {e}")
-    finally:
-        if connection and connection.is_open:
-            try:
-                connection.close()
-                print(" Conexão com RabbitMQ fechada.")
-            except Exception as e:
-                print(f" Erro ao fechar conexão RabbitMQ: {e}")
+
+def _executar_worker(worker_id):
+    """Ponto de entrada de cada processo worker (conexões próprias de Redis e RabbitMQ)."""
+    connect_redis()
+    AnaliseWorker(
+        worker_id,
+        threads=ANALISE_WORKERS['threads_per_process'],
+        prefetch_count=ANALISE_WORKERS['prefetch_count'],
+        report_interval=ANALISE_WORKERS['report_interval']
+    ).run()
+
+
+def start_worker_pool(processes):
+    """Sobe 'processes' workers e repassa SIGTERM/SIGINT para drenagem graciosa."""
+    if processes <= 1:
+        _executar_worker(0)
+        return
+    
+    workers = [
+        multiprocessing.Process(target=_executar_worker, args=(worker_id,), name=f'analise-{worker_id}')
+        for worker_id in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    print(f" {processes} workers de análise iniciados.")
+    
+    def _repassar_sinal(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate() # Envia SIGTERM -> o worker drena antes de sair
+    
+    signal.signal(signal.SIGTERM, _repassar_sinal)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # CTRL+C já chega a todo o grupo de processos
+    
+    for worker in workers:
+        worker.join()
+    print(" Todos os workers de análise encerrados.")
 
 
 if __name__ == '__main__':
-    connect_redis()
-    # A conexão Redis é fatal (sai se falhar),
-    # então não é preciso checar 'if r_cache'
-    start_consumer()
\ No newline at end of file
+    if ANALISE_WORKERS['enabled']:
+        # Cada processo conecta ao Redis por conta própria
+        start_worker_pool(ANALISE_WORKERS['processes'])
+    else:
+        connect_redis()
+        # A conexão Redis é fatal (sai se falhar),
+        # então não é preciso checar 'if r_cache'
+        start_consumer()
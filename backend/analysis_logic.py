@@ -55,7 +55,8 @@
 # codigo novo
 # ======================================================
 
-import json
+import numpy as np
+from risk_engine import RiskEngine, nivel_geral
 
 # Regras de risco de pragas
 PRAGAS_SOJA_REGRAS = {
@@ -73,43 +74,35 @@ _SENSOR_RULE_MAP = {
     "luz": "luminosidade"
 }
 
+# Regras compiladas uma única vez em matrizes NumPy
+RISK_ENGINE = RiskEngine(PRAGAS_SOJA_REGRAS, _SENSOR_RULE_MAP)
+
 def calcular_risco(dados, regras=PRAGAS_SOJA_REGRAS):
     """
     Calcula o percentual de risco para cada praga baseado nos dados dos sensores.
     Retorna: dict {'praga': risco_percentual}
     """
-    riscos = {}
+    # Regras padrão usam o motor já compilado; regras customizadas são compiladas na hora
+    engine = RISK_ENGINE if regras is PRAGAS_SOJA_REGRAS else RiskEngine(regras, _SENSOR_RULE_MAP)
+    
+    # Sensor ausente usa o default 0 (mesmo comportamento do original)
+    leitura = engine.to_array([dados], default=0)
     
-    # Itera sobre cada praga e suas condições
-    for nome_praga, condicoes in regras.items():
-        pontos = 0
-        total_condicoes = len(condicoes)
+    return engine.to_dicts(engine.score_binary(leitura))[0]
 
-        if total_condicoes == 0:
-            riscos[nome_praga] = 0.0
-            continue
-        
-        # Itera sobre as regras específicas (temp, umidade, etc.)
-        for regra_key, (min_val, max_val) in condicoes.items():
-            
-            # Encontra a chave do sensor correspondente (ex: 'temp' -> 'temperatura')
-            sensor_key = _SENSOR_RULE_MAP.get(regra_key)
-            
-            # Se a regra não tiver um mapeamento de sensor, pula
-            if not sensor_key:
-                continue
-                
-            # Obtém o valor do sensor, usando o default 0 (mesmo comportamento do original)
-            valor_sensor = dados.get(sensor_key, 0)
-            
-            # Verifica se o valor está dentro do intervalo da regra
-            if min_val <= valor_sensor <= max_val:
-                pontos += 1
-        
-        # Risco % baseado no total de condicoes (remove o 'magic number' 4)
-        riscos[nome_praga] = (pontos / total_condicoes) * 100
-        
-    return riscos
+def calcular_risco_lote(leituras):
+    """
+    Versão em lote de calcular_risco para históricos (ex: meses de leituras).
+    leituras: array N x 4 (ordem de SENSOR_FIELDS) ou lista de dicts
+    Retorna: array N x pragas com o risco percentual (colunas em RISK_ENGINE.pragas)
+    """
+    if not isinstance(leituras, np.ndarray):
+        leituras = RISK_ENGINE.to_array(leituras, default=0)
+    return RISK_ENGINE.score_binary(leituras)
+
+def determinar_niveis_lote(scores):
+    """Nível geral de cada linha de calcular_risco_lote (mesmos limites de formatar_resultado_cache)"""
+    return nivel_geral(scores, 75, 50)
 
 def formatar_resultado_cache(dados_brutos, riscos):
     """
@@ -129,9 +122,14 @@ def formatar_resultado_cache(dados_brutos, riscos):
 
     cache_data = {
         "timestamp": dados_brutos['timestamp'],
-        "dados_brutos": {k: float(v) for k, v in dados_brutos.items() if k != 'timestamp'}, # Garante float para o JSON
+        "device_id": dados_brutos.get('device_id'),
+        "dados_brutos": {
+            k: float(v) for k, v in dados_brutos.items() if k not in ('timestamp', 'device_id')
+        }, # Garante float para o JSON
         "riscos_detalhados": riscos,
+        "risco_maximo": risco_maximo,
         "nivel_geral": nivel_geral
     }
     
-    return json.dumps(cache_data)
\ No newline at end of file
+    # O consumidor serializa (json.dumps) ao gravar no Redis
+    return cache_data
\ No newline at end of file
@@ -4,18 +4,23 @@ import sys
 from flask import Flask, jsonify
 from flask_cors import CORS
 sys.path.append('.') 
-from extensions import db, redis_client 
+from extensions import db, redis_client, cache_respostas
+from cache_respostas import iniciar_invalidacao
+from compressao import registrar_compressao
 
 from routes.frontend_routes import frontend_bp
 from routes.analysis_routes import analysis_bp 
+from routes.sensor_routes import sensor_bp
 
-from config import API, DATA_LIMITS
+from config import API, DATA_LIMITS, CACHE_LOCAL
 
 app = Flask(__name__)
 CORS(app)
+registrar_compressao(app) # gzip/brotli negociado pelo Accept-Encoding
 
 app.register_blueprint(frontend_bp, url_prefix='/api')
 app.register_blueprint(analysis_bp, url_prefix='/api/analysis')
+app.register_blueprint(sensor_bp) # /dados, /dados/batch (ingestão HTTP do Pi) e /health
 
 @app.errorhandler(404)
 def not_found(error):
@@ -33,8 +38,12 @@ def cleanup_task():
     while True:
         try:
             _log_task("Iniciando limpeza de dados antigos...")
-            deleted = db.cleanup_old_data()
-            _log_task(f"Limpeza concluída: {deleted} registros removidos")
+            relatorio = db.cleanup_old_data()
+            _log_task(
+                f"Limpeza concluída: {relatorio['removidas']} registros removidos, "
+                f"{relatorio['paginas_liberadas']} páginas liberadas em {relatorio['blocos']} blocos "
+                f"(lock máx {relatorio['lock_max_ms']}ms, total {relatorio['lock_total_ms']}ms)"
+            )
         except Exception as e:
             _log_task(f"Erro na limpeza: {e}")
         
@@ -44,6 +53,10 @@ def start_background_tasks():
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
     _log_task("Task de limpeza automática iniciada")
+    
+    if CACHE_LOCAL['enabled'] and CACHE_LOCAL['invalidacao_pubsub'] and redis_client:
+        iniciar_invalidacao(redis_client, cache_respostas, CACHE_LOCAL['canal'])
+        _log_task("Invalidação do cache local via pub/sub iniciada")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+
+import aio_pika
+import redis.asyncio as aioredis
+
+# Adiciona a pasta raiz do backend ao path para import
+sys.path.append('.')
+
+from config import (
+    CLOUD_AMQP_URL, UPSTASH_REDIS_URL, RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE,
+    RABBITMQ_CONSUMER_QUEUES, PERSISTENCIA_BATCH, ASYNC_CONSUMERS
+)
+from analysis_logic import calcular_risco, formatar_resultado_cache
+from estado_dispositivos import ultimas_por_device, enfileirar_estados
+from database import db as database_instance
+from persistencia_consumer import _leituras_validas, ids_persistidos
+from wire_format import decodificar_leituras, WireFormatError
+
+
+class Metricas:
+    """
+    Contadores de vazão com relatório periódico. Mensagens (entregas do broker)
+    e leituras são contadas separadamente: com lotes, uma mensagem traz várias leituras.
+    'msg/s' é comparável com o relatório dos workers síncronos (AnaliseWorker).
+    """
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.mensagens = 0
+        self.leituras = 0
+        self.erros = 0
+        self._inicio = time.monotonic()
+
+    def registrar(self, mensagens, leituras):
+        self.mensagens += mensagens
+        self.leituras += leituras
+
+    async def relatorio_periodico(self, intervalo):
+        ultimas_mensagens, ultimas_leituras = 0, 0
+        while True:
+            await asyncio.sleep(intervalo)
+            mensagens, ultimas_mensagens = self.mensagens - ultimas_mensagens, self.mensagens
+            leituras, ultimas_leituras = self.leituras - ultimas_leituras, self.leituras
+            print(f" ASYNC {self.nome}: {mensagens / intervalo:.1f} msg/s, "
+                  f"{leituras / intervalo:.1f} leituras/s "
+                  f"({self.mensagens} mensagens, {self.leituras} leituras, {self.erros} erros)")
+
+    def resumo(self):
+        duracao = max(time.monotonic() - self._inicio, 1e-9)
+        return (f" ASYNC {self.nome}: {self.mensagens} mensagens, {self.leituras} leituras "
+                f"({self.mensagens / duracao:.1f} msg/s e {self.leituras / duracao:.1f} leituras/s "
+                f"em média, {self.erros} erros).")
+
+
+async def _declarar_fila(channel, grupo):
+    """Exchange fanout + fila durável do grupo de consumidores (mesma topologia dos consumidores síncronos)"""
+    exchange = await channel.declare_exchange(
+        RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE, durable=True
+    )
+    queue = await channel.declare_queue(RABBITMQ_CONSUMER_QUEUES[grupo], durable=True)
+    await queue.bind(exchange)
+    return queue
+
+
+# ==========================================================
+# Análise: várias mensagens em andamento, Redis assíncrono
+# ==========================================================
+
+async def _sessao_analise(connection, parar, metricas, r_cache):
+    channel = await connection.channel()
+    await channel.set_qos(prefetch_count=ASYNC_CONSUMERS['prefetch_count'])
+    queue = await _declarar_fila(channel, 'analise')
+
+    async def on_message(message):
+        try:
+            recebidas = decodificar_leituras(message.body, message.content_type)
+            # Em um lote, só a leitura mais recente de cada dispositivo interessa ao cache
+            leituras = ultimas_por_device(recebidas)
+        except (json.JSONDecodeError, WireFormatError) as e:
+            print(f" ERRO DE DECODIFICAÇÃO: {e}. Rejeitando (nack, requeue=False)...")
+            metricas.erros += 1
+            await message.nack(requeue=False)
+            return
+
+        try:
+            resultados = [
+                formatar_resultado_cache(dados_brutos, calcular_risco(dados_brutos))
+                for dados_brutos in leituras
+            ]
+
+            # Pipeline assíncrono: o loop segue atendendo outras mensagens durante o round trip
+            async with r_cache.pipeline(transaction=False) as pipe:
+                enfileirar_estados(pipe, resultados)
+                await pipe.execute()
+
+            await message.ack()
+            metricas.registrar(1, len(recebidas))
+
+        except Exception as e:
+            print(f" ERRO NO PROCESSAMENTO DA ANÁLISE: {e}. Rejeitando (nack, requeue=False)...")
+            metricas.erros += 1
+            await message.nack(requeue=False)
+
+    # O aio-pika despacha cada entrega como uma task: até 'prefetch_count' em paralelo
+    consumer_tag = await queue.consume(on_message)
+    print(f" ASYNC analise: consumindo (prefetch={ASYNC_CONSUMERS['prefetch_count']}).")
+
+    await _aguardar_fim(connection, parar)
+    if not channel.is_closed:
+        await queue.cancel(consumer_tag)
+
+
+# ==========================================================
+# Persistência: lotes gravados no SQLite fora do event loop
+# ==========================================================
+
+async def _coletar_lote(fila, max_messages, max_wait_s):
+    """
+    Espera a primeira mensagem e junta as seguintes até encher ou estourar o tempo.
+    Um None na fila marca o fim (o lote termina nele).
+    """
+    loop = asyncio.get_running_loop()
+    lote = [await fila.get()]
+    prazo = loop.time() + max_wait_s
+
+    while len(lote) < max_messages and lote[-1] is not None:
+        restante = prazo - loop.time()
+        if restante <= 0:
+            break
+        try:
+            lote.append(await asyncio.wait_for(fila.get(), restante))
+        except asyncio.TimeoutError:
+            break
+    return lote
+
+
+async def _persistir_individual(message, metricas):
+    """Mesmo tratamento do callback síncrono, para isolar mensagens de um lote com falha."""
+    try:
+        validas = _leituras_validas(message.body, message)
+        if validas:
+            await asyncio.to_thread(
+                database_instance.insert_readings_bulk, [leitura for _, leitura in validas]
+            )
+            ids_persistidos.registrar([message_id for message_id, _ in validas])
+        await message.ack()
+        metricas.registrar(1, len(validas))
+    except (json.JSONDecodeError, ValueError, TypeError) as e:
+        print(f"VALIDAÇÃO FALHOU (Não Persistido): {e}")
+        metricas.erros += 1
+        await message.ack()
+    except Exception as e:
+        print(f"ERRO NO PROCESSAMENTO: {e}. Rejeitando a mensagem (requeue)...")
+        metricas.erros += 1
+        await message.reject(requeue=True)
+
+
+async def _gravar_lote(lote, metricas):
+    validas = [] # Lista de (message, [(id, leitura), ...])
+    for message in lote:
+        try:
+            leituras = _leituras_validas(message.body, message)
+        except (json.JSONDecodeError, WireFormatError) as e:
+            print(f" ERRO DE DECODIFICAÇÃO: {e}. Descartando (ACK).")
+            metricas.erros += 1
+            await message.ack()
+            continue
+
+        if leituras:
+            validas.append((message, leituras))
+        else:
+            # Só duplicadas (reenvio da outbox) ou inválidas
+            await message.ack()
+            metricas.registrar(1, 0)
+
+    if not validas:
+        return
+
+    try:
+        # O SQLite é bloqueante: roda em uma thread para não travar o event loop
+        await asyncio.to_thread(
+            database_instance.insert_readings_bulk,
+            [leitura for _, leituras in validas for _, leitura in leituras]
+        )
+    except Exception as e:
+        print(f"ERRO NO LOTE ({len(validas)} mensagens): {e}. Processando individualmente...")
+        for message, _ in validas:
+            await _persistir_individual(message, metricas)
+        return
+
+    ids_persistidos.registrar([message_id for _, leituras in validas for message_id, _ in leituras])
+
+    # ACK múltiplo até a última mensagem válida (as inválidas já foram confirmadas)
+    await validas[-1][0].ack(multiple=True)
+    metricas.registrar(len(validas), sum(len(leituras) for _, leituras in validas))
+
+
+async def _sessao_persistencia(connection, parar, metricas):
+    channel = await connection.channel()
+    max_messages = PERSISTENCIA_BATCH['max_messages']
+    await channel.set_qos(prefetch_count=max(ASYNC_CONSUMERS['prefetch_count'], max_messages))
+    queue = await _declarar_fila(channel, 'persistencia')
+
+    fila = asyncio.Queue()
+
+    async def on_message(message):
+        await fila.put(message)
+
+    async def gravador():
+        while True:
+            lote = await _coletar_lote(fila, max_messages, PERSISTENCIA_BATCH['max_wait_ms'] / 1000.0)
+            fim = lote[-1] is None
+            if fim:
+                lote.pop()
+            if lote:
+                await _gravar_lote(lote, metricas)
+            if fim:
+                return
+
+    consumer_tag = await queue.consume(on_message)
+    tarefa_gravador = asyncio.create_task(gravador())
+    print(f" ASYNC persistencia: consumindo (lotes de até {max_messages} mensagens).")
+
+    try:
+        await _aguardar_fim(connection, parar)
+    finally:
+        if channel.is_closed:
+            # Sem canal não há como confirmar: o broker reentrega o que ficou pendente
+            tarefa_gravador.cancel()
+        else:
+            # Para de receber e deixa o gravador terminar o que já chegou
+            await queue.cancel(consumer_tag)
+            await fila.put(None)
+            await tarefa_gravador
+
+
+# ==========================================================
+# Runtime: reconexão iterativa com backoff exponencial
+# ==========================================================
+
+async def _aguardar_fim(connection, parar):
+    """Retorna quando pedirem para parar ou quando a conexão cair."""
+    fechada = asyncio.ensure_future(connection.closed())
+    pedido = asyncio.ensure_future(parar.wait())
+    await asyncio.wait({fechada, pedido}, return_when=asyncio.FIRST_COMPLETED)
+    pedido.cancel()
+    if fechada.done() and not parar.is_set():
+        raise ConnectionError("Conexão com o CloudAMQP perdida")
+
+
+async def _executar(grupo, sessao, *args):
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, parar.set)
+
+    metricas = Metricas(grupo)
+    relatorio = asyncio.create_task(metricas.relatorio_periodico(ASYNC_CONSUMERS['report_interval']))
+    backoff = ASYNC_CONSUMERS['backoff_initial']
+
+    while not parar.is_set():
+        try:
+            connection = await aio_pika.connect(CLOUD_AMQP_URL)
+            print(" Conexão com CloudAMQP estabelecida.")
+            backoff = ASYNC_CONSUMERS['backoff_initial']
+
+            async with connection:
+                await sessao(connection, parar, metricas, *args)
+
+        except (aio_pika.exceptions.AMQPError, ConnectionError, OSError) as e:
+            print(f" ERRO: CloudAMQP indisponível ({e}). Reconectando em {backoff}s...")
+            try:
+                await asyncio.wait_for(parar.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, ASYNC_CONSUMERS['backoff_max'])
+
+    relatorio.cancel()
+    print(metricas.resumo())
+    return metricas
+
+
+async def run_analise():
+    r_cache = aioredis.from_url(UPSTASH_REDIS_URL, decode_responses=True)
+    try:
+        await r_cache.ping()
+        print(" Conexão com Upstash Redis estabelecida.")
+        await _executar('analise', _sessao_analise, r_cache)
+    finally:
+        await r_cache.aclose()
+
+
+async def run_persistencia():
+    await _executar('persistencia', _sessao_persistencia)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Consumidores assíncronos (asyncio + aio-pika)')
+    parser.add_argument('consumidor', choices=['analise', 'persistencia'])
+    args = parser.parse_args()
+
+    asyncio.run(run_analise() if args.consumidor == 'analise' else run_persistencia())
@@ -0,0 +1,35 @@
+import argparse
+import sys
+import time
+
+# Adiciona a pasta raiz do backend ao path para import
+sys.path.append('.')
+from database import db as database_instance
+
+
+def main():
+    """Calcula e grava o risco de todas as leituras antigas, em blocos."""
+    parser = argparse.ArgumentParser(description='Backfill do histórico de risco no SQLite')
+    parser.add_argument('--chunk', type=int, default=5000, help='Leituras por transação (padrão: 5000)')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🌾 BACKFILL DO HISTÓRICO DE RISCO")
+    print("=" * 60)
+
+    inicio = time.time()
+    total = 0
+
+    try:
+        for processadas in database_instance.backfill_risks(chunk_size=args.chunk):
+            total += processadas
+            print(f"   📈 {total} leituras processadas ({time.time() - inicio:.1f}s)")
+    except KeyboardInterrupt:
+        # Cada bloco é commitado separadamente: rodar de novo continua de onde parou
+        print("\nInterrompido. Execute novamente para continuar.")
+
+    print(f"✅ Concluído: {total} leituras em {time.time() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import functools
+import hashlib
+import math
+import threading
+import time
+
+from flask import Response, make_response, request
+
+from compressao import escolher_codificacao, comprimir, aplicar_codificacao, etag_sem_codificacao
+
+
+class CacheRespostas:
+    """
+    Cache em memória (por processo) das respostas dos endpoints de tempo real.
+    Guarda o corpo já serializado, então um acerto não toca no Redis nem refaz JSON/cálculos.
+
+    A chave é o caminho + query string (ex: '/api/latest?device_id=x') junto com a
+    versão do cache: invalidar() só incrementa a versão, e as entradas antigas
+    deixam de valer sem precisar varrer o dicionário.
+
+    Requisições simultâneas da mesma chave com o cache vencido esperam uma
+    única recarga (as outras threads reaproveitam o resultado).
+
+    O ETag (hash do corpo) é calculado uma vez por recarga; um If-None-Match
+    igual recebe 304 sem corpo. As versões comprimidas (gzip/br) também ficam
+    na entrada: o mesmo corpo é comprimido uma vez por TTL, não a cada requisição.
+    """
+
+    def __init__(self, ttl, enabled=True, max_entradas=1024, max_age=None):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.max_entradas = max_entradas
+        self.max_age = max_age
+        self.versao = 0
+
+        self._entradas = {}  # chave -> (expira_em, versao, corpo, status, mimetype, etag, {codificação: corpo})
+        self._travas = {}    # chave -> Lock da recarga
+        self._lock = threading.Lock()
+
+        # Contadores para diagnóstico
+        self.acertos = 0
+        self.recargas = 0
+
+    def _valida(self, chave):
+        entrada = self._entradas.get(chave)
+        if entrada and entrada[0] > time.monotonic() and entrada[1] == self.versao:
+            return entrada
+        return None
+
+    def obter(self, chave, carregar):
+        """
+        Retorna (corpo, status, mimetype, etag, comprimidos) do cache ou de carregar().
+        carregar() -> (corpo, status, mimetype). Respostas 5xx não são guardadas.
+        """
+        entrada = self._valida(chave)
+        if entrada:
+            self.acertos += 1
+            return entrada[2:]
+
+        with self._lock:
+            trava = self._travas.setdefault(chave, threading.Lock())
+
+        with trava:
+            # Outra thread pode ter recarregado enquanto esta esperava
+            entrada = self._valida(chave)
+            if entrada:
+                self.acertos += 1
+                return entrada[2:]
+
+            versao = self.versao
+            corpo, status, mimetype = carregar()
+            etag = etag_do_corpo(corpo)
+            comprimidos = {}
+            self.recargas += 1
+            if status < 500:
+                if len(self._entradas) >= self.max_entradas:
+                    # Query strings arbitrárias não fazem o cache crescer sem limite
+                    with self._lock:
+                        self._entradas.clear()
+                        self._travas.clear()
+                self._entradas[chave] = (
+                    time.monotonic() + self.ttl, versao, corpo, status, mimetype, etag, comprimidos
+                )
+            return corpo, status, mimetype, etag, comprimidos
+
+    def invalidar(self):
+        """Descarta todas as entradas (ex: o consumidor de análise gravou um estado novo)"""
+        with self._lock:
+            self.versao += 1
+
+    def stats(self):
+        total = self.acertos + self.recargas
+        return {
+            'ttl_s': self.ttl,
+            'entradas': len(self._entradas),
+            'versao': self.versao,
+            'hit_rate': round(self.acertos / total, 3) if total else 0.0
+        }
+
+    def em_cache(self, view):
+        """Decorator para rotas Flask: a resposta é servida do cache por até 'ttl' segundos"""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            def carregar():
+                resposta = make_response(view(*args, **kwargs))
+                return resposta.get_data(), resposta.status_code, resposta.mimetype
+
+            if self.enabled:
+                corpo, status, mimetype, etag, comprimidos = self.obter(request.full_path, carregar)
+            else:
+                corpo, status, mimetype = carregar()
+                etag, comprimidos = etag_do_corpo(corpo), {}
+
+            if status != 200:
+                return Response(corpo, status=status, mimetype=mimetype)
+
+            if if_none_match_confere(etag):
+                resposta = Response(status=304)
+                resposta.set_etag(etag)
+            else:
+                resposta = Response(corpo, status=status, mimetype=mimetype)
+                resposta.set_etag(etag)
+                codificacao = escolher_codificacao(len(corpo))
+                if codificacao:
+                    if codificacao not in comprimidos:
+                        comprimidos[codificacao] = comprimir(corpo, codificacao)
+                    aplicar_codificacao(resposta, comprimidos[codificacao], codificacao)
+
+            resposta.vary.add('Accept-Encoding')
+            definir_cache_control(resposta, self.max_age)
+            return resposta
+        return wrapper
+
+
+def etag_do_corpo(corpo):
+    return hashlib.blake2b(corpo, digest_size=12).hexdigest()
+
+
+def if_none_match_confere(etag):
+    """O If-None-Match da requisição contém 'etag' (em qualquer codificação)?"""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return any(etag_sem_codificacao(tag) == etag for tag in if_none_match.as_set())
+
+
+def definir_cache_control(resposta, max_age):
+    """Cache-Control para dados que mudam: cacheável por 'max_age' e depois revalidado"""
+    if max_age is None:
+        resposta.cache_control.no_cache = True
+        return
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = max_age
+    resposta.cache_control.must_revalidate = True
+
+
+def condicional_por_versao(versao, max_age=None):
+    """
+    Decorator para rotas cujo conteúdo é determinado pela URL + uma versão barata
+    dos dados (ex: Database.get_data_version). O ETag sai da versão, então um
+    If-None-Match igual recebe 304 antes de qualquer query ou serialização.
+    versao() -> (identificador da versão, instante da última escrita em epoch ou None)
+
+    O Last-Modified tem resolução de segundos: o instante é arredondado para cima e
+    só é enviado depois que esse segundo passou. Assim uma escrita no mesmo segundo
+    de uma resposta anterior nunca é respondida com 304 a um If-Modified-Since.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            tag, ultima_modificacao = versao()
+            etag = etag_do_corpo(f"{request.full_path}|{tag}".encode('utf-8'))
+            if ultima_modificacao is not None:
+                ultima_modificacao = math.ceil(ultima_modificacao)
+
+            if if_none_match_confere(etag) or (
+                not request.if_none_match and ultima_modificacao is not None
+                and request.if_modified_since is not None
+                and request.if_modified_since.timestamp() >= ultima_modificacao
+            ):
+                resposta = Response(status=304)
+            else:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+
+            resposta.set_etag(etag)
+            resposta.vary.add('Accept-Encoding')
+            if ultima_modificacao is not None and ultima_modificacao <= time.time():
+                resposta.last_modified = ultima_modificacao
+            definir_cache_control(resposta, max_age)
+            return resposta
+        return wrapper
+    return decorator
+
+
+def iniciar_invalidacao(redis_client, cache, canal):
+    """
+    Thread que escuta o canal de invalidação (pub/sub do Redis) e limpa o cache
+    a cada aviso dos consumidores. Reconecta sozinha se a conexão cair.
+    """
+    def escutar():
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(canal)
+                print(f"INFO: Cache local escutando invalidações em '{canal}'.")
+                for _ in pubsub.listen():
+                    cache.invalidar()
+            except Exception as e:
+                print(f"ERRO na escuta de invalidação do cache: {e}. Tentando de novo em 5s...")
+                # Sem os avisos, o TTL continua limitando a idade das respostas
+                time.sleep(5)
+
+    thread = threading.Thread(target=escutar, name='cache-invalidacao', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,78 @@
+import gzip
+
+from flask import request
+
+from config import COMPRESSAO
+
+# Brotli é opcional (pip install brotli); sem ele, só gzip
+BROTLI_AVAILABLE = False
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+
+# Tipos que valem a pena comprimir (texto)
+_MIMETYPES_COMPRIMIVEIS = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'}
+
+# ETags de respostas comprimidas levam a codificação no fim (ex: "abc-gzip")
+_SUFIXOS_ETAG = ('-br', '-gzip')
+
+
+def escolher_codificacao(tamanho):
+    """
+    Codificação aceita pelo cliente para um corpo de 'tamanho' bytes
+    ('br', 'gzip' ou None se não compensa/não é aceita).
+    """
+    if not COMPRESSAO['enabled'] or tamanho < COMPRESSAO['min_bytes']:
+        return None
+
+    aceitas = request.accept_encodings
+    if BROTLI_AVAILABLE and aceitas['br']:
+        return 'br'
+    if aceitas['gzip']:
+        return 'gzip'
+    return None
+
+
+def comprimir(corpo, codificacao):
+    if codificacao == 'br':
+        return brotli.compress(corpo, quality=COMPRESSAO['brotli_quality'])
+    # mtime=0: o mesmo corpo gera sempre os mesmos bytes
+    return gzip.compress(corpo, compresslevel=COMPRESSAO['gzip_level'], mtime=0)
+
+
+def etag_sem_codificacao(etag):
+    """ETag da representação sem compressão (para comparar o If-None-Match)"""
+    for sufixo in _SUFIXOS_ETAG:
+        if etag.endswith(sufixo):
+            return etag[:-len(sufixo)]
+    return etag
+
+
+def aplicar_codificacao(resposta, corpo_comprimido, codificacao):
+    """Troca o corpo pelo comprimido e ajusta Content-Encoding e ETag"""
+    resposta.set_data(corpo_comprimido)
+    resposta.headers['Content-Encoding'] = codificacao
+    etag, fraco = resposta.get_etag()
+    if etag:
+        resposta.set_etag(f"{etag}-{codificacao}", fraco)
+
+
+def registrar_compressao(app):
+    """Comprime (after_request) as respostas que ainda não vieram comprimidas do cache"""
+
+    @app.after_request
+    def _comprimir_resposta(resposta):
+        if (resposta.status_code != 200 or resposta.is_streamed or resposta.direct_passthrough
+                or 'Content-Encoding' in resposta.headers
+                or resposta.mimetype not in _MIMETYPES_COMPRIMIVEIS):
+            return resposta
+
+        # A resposta varia conforme o Accept-Encoding (importante para CDNs/proxies)
+        resposta.vary.add('Accept-Encoding')
+        corpo = resposta.get_data()
+        codificacao = escolher_codificacao(len(corpo))
+        if codificacao:
+            aplicar_codificacao(resposta, comprimir(corpo, codificacao), codificacao)
+        return resposta
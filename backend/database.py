@@ -1,31 +1,287 @@
+import base64
+import os
+import queue
 import sqlite3
+import threading
 import time
 from contextlib import contextmanager
-from config import DATABASE, SQLITE_PRAGMAS, DATA_LIMITS, SENSOR_RANGES
+from config import (DATABASE, SQLITE_PRAGMAS, DATA_LIMITS, SENSOR_RANGES, ROLLUP_RESOLUTIONS, RETENCAO,
+                    PARTICIONAMENTO)
+from analysis_logic import RISK_ENGINE, calcular_risco_lote, determinar_niveis_lote
+import particoes
 
+# PRAGMAs que valem para o arquivo inteiro (não precisam ser reaplicados nos leitores)
+_DATABASE_LEVEL_PRAGMAS = {'journal_mode', 'auto_vacuum'}
 
-class Database:
-    """Gerenciador otimizado de banco de dados SQLite para Raspberry Pi"""
+# Colunas de sensores agregadas nas tabelas de rollup
+_SENSOR_COLUMNS = ('temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade')
+
+# Valor de PRAGMA auto_vacuum no modo INCREMENTAL
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# Dispositivo atribuído às leituras que chegam sem device_id
+DEVICE_PADRAO = DATABASE.get('default_device_id', 'default')
+
+# OR IGNORE: uma leitura com message_id já gravado (reenvio) não entra de novo
+_INSERT_READING_SQL = '''
+    INSERT OR IGNORE INTO leituras 
+    (temperatura, umidade_ar, umidade_solo, luminosidade, timestamp, device_id, message_id)
+    VALUES (:temperatura, :umidade_ar, :umidade_solo, :luminosidade, :timestamp, :device_id, :message_id)
+'''
+
+# Nas partições o id vem reservado da sequência do main (ids globais, sem colisão entre arquivos)
+_INSERT_READING_PARTICAO_SQL = '''
+    INSERT OR IGNORE INTO {esquema}.leituras
+    (id, temperatura, umidade_ar, umidade_solo, luminosidade, timestamp, device_id, message_id)
+    VALUES (:id, :temperatura, :umidade_ar, :umidade_solo, :luminosidade, :timestamp, :device_id, :message_id)
+'''
+
+# message_ids por consulta IN (...) na deduplicação (abaixo do limite antigo de 999 parâmetros)
+_MESSAGE_IDS_POR_CONSULTA = 500
+
+# Colunas das leituras devolvidas pela API e pela exportação (nessa ordem)
+COLUNAS_LEITURA = ('id', 'device_id', 'temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade', 'timestamp')
+_LEITURA_COLUNAS = ', '.join(COLUNAS_LEITURA)
+
+
+def _rollup_table(nome):
+    """Nome da tabela de rollup de uma resolução (ex: '15m' -> 'leituras_15m')"""
+    return f'leituras_{nome}'
+
+
+def _filtro_device(device_id, conector='AND', coluna='device_id'):
+    """
+    Trecho de SQL (e parâmetros) que filtra por dispositivo; vazio se device_id for None
+    conector: 'AND' (junta a um WHERE existente) ou 'WHERE' (único filtro da query)
+    """
+    if device_id is None:
+        return '', ()
+    return f' {conector} {coluna} = ?', (device_id,)
+
+
+def _combinar_estatisticas(parciais):
+    """Junta as estatísticas de várias janelas de partições (médias ponderadas pelo total)"""
+    com_dados = [p for p in parciais if p['total_registros']]
+    total = sum(p['total_registros'] for p in com_dados)
+    combinadas = {'total_registros': total}
+    for media in ('temp_media', 'umid_ar_media', 'umid_solo_media', 'lum_media'):
+        combinadas[media] = (
+            sum(p[media] * p['total_registros'] for p in com_dados) / total if total else None
+        )
+    combinadas['primeira_leitura'] = min((p['primeira_leitura'] for p in com_dados), default=None)
+    combinadas['ultima_leitura'] = max((p['ultima_leitura'] for p in com_dados), default=None)
+    return combinadas
+
+
+def codificar_cursor(leitura):
+    """
+    Cursor opaco (next_cursor) da posição logo depois de 'leitura'
+    na ordem das páginas: timestamp DESC, id
+    """
+    bruto = f"{leitura['timestamp']}:{leitura['id']}".encode('ascii')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(timestamp, id) de um cursor gerado por codificar_cursor. Levanta ValueError se inválido"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        timestamp, reading_id = bruto.split(':')
+        return int(timestamp), int(reading_id)
+    except ValueError:
+        raise ValueError(f"cursor inválido: {cursor}")
+
+
+def _rollup_upsert_sql(nome, segundos):
+    """
+    UPSERT incremental de uma leitura no bucket correspondente.
+    Mantém min, max, soma (para a média), total e o último valor de cada sensor.
+    """
+    colunas = ['device_id', 'bucket', 'total', 'ultimo_timestamp']
+    valores = [':device_id', f'(:timestamp / {segundos}) * {segundos}', '1', ':timestamp']
+    updates = [
+        'total = total + 1',
+        'ultimo_timestamp = MAX(ultimo_timestamp, excluded.ultimo_timestamp)'
+    ]
     
-    def __init__(self):
-        self.db_path = DATABASE['path']
-        self._init_database()
+    for sensor in _SENSOR_COLUMNS:
+        colunas += [f'{sensor}_min', f'{sensor}_max', f'{sensor}_soma', f'{sensor}_ultimo']
+        valores += [f':{sensor}'] * 4
+        updates += [
+            f'{sensor}_min = MIN({sensor}_min, excluded.{sensor}_min)',
+            f'{sensor}_max = MAX({sensor}_max, excluded.{sensor}_max)',
+            f'{sensor}_soma = {sensor}_soma + excluded.{sensor}_soma',
+            # Leituras fora de ordem não sobrescrevem o último valor
+            f'{sensor}_ultimo = CASE WHEN excluded.ultimo_timestamp >= ultimo_timestamp '
+            f'THEN excluded.{sensor}_ultimo ELSE {sensor}_ultimo END'
+        ]
     
-    @contextmanager
-    def get_connection(self):
-        """Context manager para conexões - garante fechamento automático"""
+    return f'''
+        INSERT INTO {_rollup_table(nome)} ({', '.join(colunas)})
+        VALUES ({', '.join(valores)})
+        ON CONFLICT(device_id, bucket) DO UPDATE SET {', '.join(updates)}
+    '''
+
+
+class ReadOnlyConnection(sqlite3.Connection):
+    """Conexão SQLite somente leitura, usada pelos endpoints da API"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Qualquer escrita acidental falha em vez de disputar o lock do escritor
+        self.execute('PRAGMA query_only = ON')
+
+
+class ConnectionPool:
+    """
+    Pool thread-safe de conexões SQLite persistentes.
+    As conexões são criadas sob demanda (até 'size') e os PRAGMAs
+    são aplicados uma única vez, na criação de cada conexão.
+    """
+    
+    def __init__(self, db_path, size, pragmas, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.pragmas = pragmas
+        self.factory = factory
+        
+        self._idle = queue.LifoQueue() # LIFO: reusa a conexão mais "quente"
+        self._lock = threading.Lock()
+        self._created = 0
+        
+        # Contadores para diagnóstico
+        self.checkouts = 0
+        self.hits = 0
+        self.waits = 0
+    
+    def _connect(self):
         conn = sqlite3.connect(
             self.db_path,
             timeout=DATABASE['timeout'],
-            check_same_thread=DATABASE['check_same_thread']
+            check_same_thread=False, # A conexão passa entre threads do Flask
+            factory=self.factory
         )
         
         # Aplica PRAGMAs de otimização
-        for pragma, value in SQLITE_PRAGMAS.items():
+        for pragma, value in self.pragmas.items():
             conn.execute(f'PRAGMA {pragma} = {value}')
         
         # Retorna Row objects ao invés de tuplas (facilita acesso por nome)
         conn.row_factory = sqlite3.Row
+        return conn
+    
+    def acquire(self):
+        """Retira uma conexão do pool (cria uma nova ou espera se estiver cheio)"""
+        with self._lock:
+            self.checkouts += 1
+            try:
+                conn = self._idle.get_nowait()
+                self.hits += 1
+                return conn
+            except queue.Empty:
+                pass
+            
+            must_create = self._created < self.size
+            if must_create:
+                self._created += 1
+            else:
+                self.waits += 1
+        
+        if must_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        
+        try:
+            return self._idle.get(timeout=DATABASE['timeout'])
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Pool de conexões esgotado após {DATABASE['timeout']}s"
+            )
+    
+    def release(self, conn):
+        """Devolve a conexão ao pool"""
+        self._idle.put(conn)
+    
+    def close_all(self):
+        """Fecha as conexões ociosas (ex: antes de encerrar o processo)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+    
+    def stats(self):
+        """Retorna os contadores de uso do pool"""
+        with self._lock:
+            return {
+                'tamanho': self.size,
+                'conexoes_abertas': self._created,
+                'checkouts': self.checkouts,
+                'esperas': self.waits,
+                'hit_rate': round(self.hits / self.checkouts, 3) if self.checkouts else 0.0
+            }
+
+
+class Database:
+    """Gerenciador otimizado de banco de dados SQLite para Raspberry Pi"""
+    
+    def __init__(self):
+        self.db_path = DATABASE['path']
+        
+        # Um único escritor (SQLite serializa escritas de qualquer forma)
+        self._writer_pool = ConnectionPool(self.db_path, 1, SQLITE_PRAGMAS)
+        
+        # Leitores somente leitura para a API (WAL permite leituras concorrentes)
+        reader_pragmas = {
+            pragma: value for pragma, value in SQLITE_PRAGMAS.items()
+            if pragma not in _DATABASE_LEVEL_PRAGMAS
+        }
+        self._reader_pool = ConnectionPool(
+            self.db_path, DATABASE['pool_size'], reader_pragmas, factory=ReadOnlyConnection
+        )
+        
+        # SQL de UPSERT de cada resolução, gerado uma única vez
+        self._rollup_upserts = [
+            _rollup_upsert_sql(nome, cfg['seconds'])
+            for nome, cfg in ROLLUP_RESOLUTIONS.items()
+        ]
+        
+        # Último relatório da limpeza de dados antigos (exibido no /api/status)
+        self.ultima_retencao = None
+        
+        # Particionamento por tempo: leituras em um arquivo por período (ver particoes.py)
+        self.particionado = PARTICIONAMENTO['enabled']
+        self.periodo = PARTICIONAMENTO['periodo']
+        self.dir_particoes = PARTICIONAMENTO['diretorio']
+        if self.particionado:
+            particoes.duracao(self.periodo)  # valida o período antes de criar qualquer arquivo
+            os.makedirs(self.dir_particoes, exist_ok=True)
+        
+        # Partições já marcadas como pendentes por este processo (evita uma escrita por lote)
+        self._particoes_marcadas = set()
+        
+        rollups_novos = self._init_database()
+        
+        # Resolução nova: também recebe o histórico que já está nas partições
+        if rollups_novos:
+            self._somar_particoes_aos_rollups(nomes=rollups_novos)
+        
+        # Reconcilia depois da migração: aí o período inteiro já está na partição
+        if self.particionado:
+            self._migrar_para_particoes()
+            self._reconciliar_particoes()
+    
+    @contextmanager
+    def get_connection(self):
+        """Context manager para a conexão de escrita - commit/rollback automático"""
+        conn = self._writer_pool.acquire()
         
         try:
             yield conn
@@ -34,30 +290,400 @@ class Database:
             conn.rollback()
             raise e
         finally:
-            conn.close()
+            self._writer_pool.release(conn)
+    
+    @contextmanager
+    def get_read_connection(self, particoes_anexadas=None):
+        """
+        Context manager para conexões somente leitura do pool
+        particoes_anexadas: (modo particionado) inícios das partições que as queries sem
+        esquema em leituras/riscos/riscos_nivel devem enxergar; None = conexão como está
+        (para queries que só usam o main: rollups e catálogo)
+        """
+        conn = self._reader_pool.acquire()
+        
+        try:
+            if self.particionado and particoes_anexadas is not None:
+                self._preparar_leitura(conn, particoes_anexadas)
+            yield conn
+        finally:
+            self._reader_pool.release(conn)
+    
+    def _preparar_leitura(self, conn, inicios):
+        """Anexa as partições na conexão de leitura e recria as views se o conjunto mudou"""
+        # query_only bloqueia até as views temporárias
+        conn.execute('PRAGMA query_only = OFF')
+        try:
+            mudou, anexadas = particoes.anexar(conn, inicios, self.dir_particoes)
+            if mudou and anexadas:
+                particoes.criar_views(conn, anexadas)
+        finally:
+            conn.execute('PRAGMA query_only = ON')
+    
+    def _preparar_escrita(self, conn, inicios):
+        """
+        Anexa na conexão de escrita as partições (criando arquivo e tabelas das novas).
+        Chamar antes do primeiro comando da transação (ATTACH não roda dentro de uma).
+        """
+        if not self.particionado:
+            return
+        
+        mudou, _ = particoes.anexar(conn, inicios, self.dir_particoes, criar=True)
+        if not mudou:
+            return
+        
+        for inicio in inicios:
+            esquema = particoes.esquema(inicio)
+            conn.execute(f'PRAGMA {esquema}.journal_mode = {SQLITE_PRAGMAS["journal_mode"]}')
+            conn.execute(f'PRAGMA {esquema}.synchronous = {SQLITE_PRAGMAS["synchronous"]}')
+            self._criar_tabelas_leituras(conn.cursor(), esquema)
+    
+    def get_pool_stats(self):
+        """Contadores de uso dos pools de conexão (leitura e escrita)"""
+        return {
+            'leitura': self._reader_pool.stats(),
+            'escrita': self._writer_pool.stats()
+        }
     
     def _init_database(self):
-        """Cria tabela e índices se não existirem"""
+        """
+        Cria tabela e índices se não existirem
+        Retorna: resoluções de rollup criadas agora (já populadas com a tabela bruta do main)
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            # Tabela principal
+            # Leituras brutas e risco por leitura
+            self._criar_tabelas_leituras(cursor)
+            
+            # Catálogo das partições (vazio sem particionamento)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS particoes (
+                    inicio INTEGER PRIMARY KEY,
+                    fim INTEGER NOT NULL,
+                    ultimo_timestamp INTEGER NOT NULL
+                )
+            ''')
+            
+            # Versão dos dados para os validadores HTTP (ETag/Last-Modified): uma linha só,
+            # avançada na mesma transação de cada escrita (inserção, retenção, rollups)
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS leituras (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    temperatura REAL NOT NULL,
-                    umidade_ar REAL NOT NULL,
-                    umidade_solo REAL NOT NULL,
-                    luminosidade REAL NOT NULL,
-                    timestamp INTEGER NOT NULL
+                CREATE TABLE IF NOT EXISTS versao_dados (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    contador INTEGER NOT NULL,
+                    modificado_em_ms INTEGER NOT NULL
                 )
             ''')
+            cursor.execute(
+                'INSERT OR IGNORE INTO versao_dados (id, contador, modificado_em_ms) VALUES (1, 0, ?)',
+                (int(time.time() * 1000),)
+            )
             
-            # Índice para queries por data (DESC = mais recentes primeiro)
+            # Partições que já receberam escrita e podem divergir do main após uma queda
+            # (o commit que cruza os dois arquivos é atômico só por arquivo)
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_timestamp 
-                ON leituras(timestamp DESC)
+                CREATE TABLE IF NOT EXISTS particoes_pendentes (
+                    inicio INTEGER PRIMARY KEY
+                )
             ''')
+            
+            # Tabelas de rollup (uma por resolução, chave = dispositivo + início do bucket)
+            rollups_novos = []
+            for nome in ROLLUP_RESOLUTIONS:
+                tabela = _rollup_table(nome)
+                existe = cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+                ).fetchone()
+                
+                if existe:
+                    colunas = {row[1] for row in cursor.execute(f'PRAGMA table_info({tabela})')}
+                    if 'device_id' not in colunas:
+                        # Rollup antigo (só por bucket): a chave primária muda, então a tabela é recriada
+                        cursor.execute(f'ALTER TABLE {tabela} RENAME TO {tabela}_antigo')
+                
+                colunas_sensores = ',\n'.join(
+                    f'{sensor}_{agregado} REAL NOT NULL'
+                    for sensor in _SENSOR_COLUMNS
+                    for agregado in ('min', 'max', 'soma', 'ultimo')
+                )
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {tabela} (
+                        device_id TEXT NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        total INTEGER NOT NULL,
+                        ultimo_timestamp INTEGER NOT NULL,
+                        {colunas_sensores},
+                        PRIMARY KEY (device_id, bucket)
+                    ) WITHOUT ROWID
+                ''')
+                
+                # Consultas da frota inteira (sem filtro de dispositivo) vão por bucket
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabela}_bucket ON {tabela}(bucket)')
+                
+                if existe and 'device_id' not in colunas:
+                    # Os buckets antigos (que podem ir além da retenção bruta) são preservados
+                    cursor.execute(f'''
+                        INSERT INTO {tabela}
+                        SELECT '{DEVICE_PADRAO}', * FROM {tabela}_antigo
+                    ''')
+                    cursor.execute(f'DROP TABLE {tabela}_antigo')
+                    print(f"INFO: Rollup {tabela} migrado para o formato por dispositivo.")
+                
+                if not existe:
+                    rollups_novos.append(nome)
+            
+            # Banco já tinha histórico: popula só os rollups recém-criados
+            # (os existentes guardam buckets que a tabela bruta já não tem)
+            if rollups_novos:
+                self._rebuild_rollups(cursor, nomes=rollups_novos, limpar=False)
+        
+        return rollups_novos
+    
+    def _criar_tabelas_leituras(self, cursor, esquema='main'):
+        """
+        Cria leituras, riscos e riscos_nivel (e índices) no banco 'esquema':
+        o main ou uma partição anexada. Nas partições o id não é AUTOINCREMENT
+        (vem reservado da sequência do main).
+        """
+        autoincremento = ' AUTOINCREMENT' if esquema == 'main' else ''
+        
+        # Tabela principal
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {esquema}.leituras (
+                id INTEGER PRIMARY KEY{autoincremento},
+                temperatura REAL NOT NULL,
+                umidade_ar REAL NOT NULL,
+                umidade_solo REAL NOT NULL,
+                luminosidade REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                device_id TEXT NOT NULL DEFAULT '{DEVICE_PADRAO}',
+                message_id TEXT
+            )
+        ''')
+        
+        # Migração: bancos anteriores ao multi-dispositivo não têm a coluna
+        colunas = {row[1] for row in cursor.execute(f'PRAGMA {esquema}.table_info(leituras)')}
+        if 'device_id' not in colunas:
+            cursor.execute(
+                f"ALTER TABLE {esquema}.leituras ADD COLUMN device_id TEXT NOT NULL DEFAULT '{DEVICE_PADRAO}'"
+            )
+        if 'message_id' not in colunas:
+            cursor.execute(f'ALTER TABLE {esquema}.leituras ADD COLUMN message_id TEXT')
+        
+        # Id de deduplicação do produtor ('<produtor>-<seq>' da outbox): um reenvio depois de
+        # um commit sem confirmação (timeout HTTP, queda antes do ACK) não vira outra linha.
+        # Parcial: leituras sem id (POST /dados avulso, histórico antigo) não ocupam o índice
+        cursor.execute(f'''
+            CREATE UNIQUE INDEX IF NOT EXISTS {esquema}.idx_leituras_message_id
+            ON leituras(message_id) WHERE message_id IS NOT NULL
+        ''')
+        
+        # Índice para queries por data (DESC = mais recentes primeiro)
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {esquema}.idx_timestamp 
+            ON leituras(timestamp DESC)
+        ''')
+        
+        # Índice composto para as queries por dispositivo (intervalo e "última leitura").
+        # Já cobre a busca da última leitura de cada placa: (device_id, timestamp) + rowid
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {esquema}.idx_leituras_device_timestamp
+            ON leituras(device_id, timestamp DESC)
+        ''')
+        
+        # Risco pré-calculado por leitura (formato longo: uma linha por praga)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {esquema}.riscos (
+                leitura_id INTEGER NOT NULL,
+                praga TEXT NOT NULL,
+                risco REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                PRIMARY KEY (leitura_id, praga)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Índice de cobertura para séries/limiares por praga
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {esquema}.idx_riscos_praga_timestamp
+            ON riscos(praga, timestamp, risco)
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {esquema}.riscos_nivel (
+                leitura_id INTEGER PRIMARY KEY,
+                timestamp INTEGER NOT NULL,
+                nivel_geral TEXT NOT NULL,
+                risco_maximo REAL NOT NULL
+            )
+        ''')
+        
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS {esquema}.idx_riscos_nivel_timestamp
+            ON riscos_nivel(timestamp)
+        ''')
+    
+    def _rebuild_rollups(self, cursor, origens=('main.leituras',), nomes=None, desde=None, limpar=True, ate=None):
+        """
+        Recalcula os rollups a partir das tabelas brutas em 'origens'
+        nomes: resoluções a recalcular (None = todas)
+        desde: só os buckets que começam nesse timestamp ou depois. Os anteriores não
+        têm mais todas as leituras brutas (a retenção bruta é menor que a dos rollups)
+        e ficam como estão; None = todos os buckets
+        limpar: apaga esses buckets antes (False = só acrescenta, para somar partições
+        em passos; os buckets de até 1 dia nunca cruzam a borda de uma partição)
+        ate: só os buckets que começam antes desse timestamp (o fim de uma partição,
+        na reconciliação); None = sem limite
+        """
+        self._registrar_modificacao(cursor)
+        for nome in nomes or ROLLUP_RESOLUTIONS:
+            segundos = ROLLUP_RESOLUTIONS[nome]['seconds']
+            tabela = _rollup_table(nome)
+            
+            # Primeiro bucket inteiro a partir de 'desde'; 'ate' é sempre borda de bucket
+            condicoes_bucket, condicoes_leituras, params = [], [], []
+            if desde is not None:
+                condicoes_bucket.append('bucket >= ?')
+                condicoes_leituras.append('timestamp >= ?')
+                params.append(-(-desde // segundos) * segundos)
+            if ate is not None:
+                condicoes_bucket.append('bucket < ?')
+                condicoes_leituras.append('timestamp < ?')
+                params.append(ate)
+            filtro_bucket = f"WHERE {' AND '.join(condicoes_bucket)}" if condicoes_bucket else ''
+            filtro_leituras = f"WHERE {' AND '.join(condicoes_leituras)}" if condicoes_leituras else ''
+            
+            agregados = ', '.join(
+                f'MIN({sensor}), MAX({sensor}), SUM({sensor}), MAX({sensor}_ultimo)'
+                for sensor in _SENSOR_COLUMNS
+            )
+            # FIRST_VALUE na janela ordenada dá o valor da leitura mais recente do bucket
+            ultimos = ', '.join(
+                f'FIRST_VALUE({sensor}) OVER janela AS {sensor}_ultimo'
+                for sensor in _SENSOR_COLUMNS
+            )
+            
+            if limpar:
+                cursor.execute(f'DELETE FROM {tabela} {filtro_bucket}', params)
+            for origem in origens:
+                cursor.execute(f'''
+                    INSERT INTO {tabela}
+                    SELECT device_id, bucket, COUNT(*), MAX(timestamp), {agregados}
+                    FROM (
+                        SELECT device_id, (timestamp / {segundos}) * {segundos} AS bucket, timestamp,
+                               {', '.join(_SENSOR_COLUMNS)}, {ultimos}
+                        FROM {origem}
+                        {filtro_leituras}
+                        WINDOW janela AS (
+                            PARTITION BY device_id, (timestamp / {segundos}) ORDER BY timestamp DESC, id DESC
+                        )
+                    )
+                    GROUP BY device_id, bucket
+                ''', params)
+    
+    def rebuild_rollups(self):
+        """
+        Reconstrói os rollups (ex: após importar leituras direto na tabela bruta)
+        Só os buckets a partir da leitura bruta mais antiga (main e partições) são
+        refeitos: os anteriores já saíram da retenção bruta e são preservados.
+        """
+        desde = self._leitura_mais_antiga()
+        if desde is None:
+            return
+        
+        with self.get_connection() as conn:
+            self._rebuild_rollups(conn.cursor(), desde=desde)
+        self._somar_particoes_aos_rollups(desde=desde)
+    
+    def _somar_particoes_aos_rollups(self, nomes=None, desde=None):
+        """Acrescenta aos rollups as leituras das partições (até MAX_ANEXADAS por transação)"""
+        for grupo in particoes.em_grupos(self._todas_particoes()):
+            with self.get_connection() as conn:
+                self._preparar_escrita(conn, grupo)
+                self._rebuild_rollups(
+                    conn.cursor(), [f'{particoes.esquema(inicio)}.leituras' for inicio in grupo],
+                    nomes=nomes, desde=desde, limpar=False
+                )
+    
+    def _leitura_mais_antiga(self):
+        """Timestamp da leitura bruta mais antiga (main e partições) ou None"""
+        with self.get_read_connection() as conn:
+            mais_antiga = conn.execute('SELECT MIN(timestamp) FROM main.leituras').fetchone()[0]
+        
+        # A partição mais antiga com dados basta (catálogo em ordem cronológica)
+        for inicio in self._todas_particoes():
+            with self.get_read_connection([inicio]) as conn:
+                candidata = conn.execute(
+                    f'SELECT MIN(timestamp) FROM {particoes.esquema(inicio)}.leituras'
+                ).fetchone()[0]
+            if candidata is not None:
+                return candidata if mais_antiga is None else min(mais_antiga, candidata)
+        
+        return mais_antiga
+    
+    def _update_rollups(self, cursor, registros):
+        """Acumula as leituras recém-inseridas em todas as resoluções (mesma transação)"""
+        for upsert_sql in self._rollup_upserts:
+            cursor.executemany(upsert_sql, registros)
+    
+    def _write_risks(self, cursor, ids, registros, esquema='main'):
+        """Calcula (em lote) e grava o risco das leituras na mesma transação (no banco 'esquema')"""
+        scores = calcular_risco_lote(RISK_ENGINE.to_array(registros, default=0))
+        niveis = determinar_niveis_lote(scores)
+        
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {esquema}.riscos (leitura_id, praga, risco, timestamp) VALUES (?, ?, ?, ?)',
+            [
+                (leitura_id, praga, risco, registro['timestamp'])
+                for leitura_id, registro, linha in zip(ids, registros, scores.tolist())
+                for praga, risco in zip(RISK_ENGINE.pragas, linha)
+            ]
+        )
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {esquema}.riscos_nivel (leitura_id, timestamp, nivel_geral, risco_maximo) '
+            'VALUES (?, ?, ?, ?)',
+            [
+                (leitura_id, registro['timestamp'], str(nivel), max(linha, default=0))
+                for leitura_id, registro, linha, nivel in zip(ids, registros, scores.tolist(), niveis)
+            ]
+        )
+    
+    def backfill_risks(self, chunk_size=5000):
+        """
+        Calcula o risco das leituras que ainda não têm (ex: histórico anterior à tabela)
+        Processa em blocos por ID (no main e em cada partição), então pode ser
+        interrompido e retomado.
+        Gera: quantidade de leituras processadas em cada bloco
+        """
+        bancos = [([], 'main')] + [
+            ([inicio], particoes.esquema(inicio)) for inicio in self._todas_particoes()
+        ]
+        
+        for anexadas, esquema in bancos:
+            ultimo_id = 0
+            
+            while True:
+                with self.get_read_connection(anexadas) as conn:
+                    rows = conn.execute(f'''
+                        SELECT l.id, l.temperatura, l.umidade_ar, l.umidade_solo,
+                               l.luminosidade, l.timestamp
+                        FROM {esquema}.leituras l
+                        LEFT JOIN {esquema}.riscos_nivel n ON n.leitura_id = l.id
+                        WHERE l.id > ? AND n.leitura_id IS NULL
+                        ORDER BY l.id
+                        LIMIT ?
+                    ''', (ultimo_id, chunk_size)).fetchall()
+                
+                if not rows:
+                    break
+                
+                registros = [dict(row) for row in rows]
+                with self.get_connection() as conn:
+                    self._preparar_escrita(conn, anexadas)
+                    self._write_risks(conn.cursor(), [r['id'] for r in registros], registros, esquema)
+                    self._registrar_modificacao(conn)
+                
+                ultimo_id = registros[-1]['id']
+                yield len(registros)
     
     def validate_sensor_data(self, data):
         """
@@ -74,9 +700,10 @@ class Database:
         
         return True, ""
     
-    def insert_reading(self, temperatura, umidade_ar, umidade_solo, luminosidade):
+    def insert_reading(self, temperatura, umidade_ar, umidade_solo, luminosidade, device_id=None):
         """
         Insere uma leitura no banco
+        device_id: placa de origem (DEVICE_PADRAO se ausente)
         Retorna: ID da leitura inserida ou None se falhar
         """
         # Validação
@@ -91,16 +718,329 @@ class Database:
         if not is_valid:
             raise ValueError(f"Dados inválidos: {error_msg}")
         
-        # Inserção
+        data['timestamp'] = int(time.time())
+        data['device_id'] = device_id or DEVICE_PADRAO
+        data['message_id'] = None
+        
+        # Inserção (leitura bruta + rollups na mesma transação)
+        return self._gravar_registros([data])[0]
+
+    def insert_readings_bulk(self, leituras):
+        """
+        Insere várias leituras em uma única transação (executemany)
+        leituras: lista de dicts com temperatura, umidade_ar, umidade_solo, luminosidade
+                  e, opcionalmente, device_id, timestamp (momento da coleta; padrão: agora)
+                  e message_id (id de deduplicação do produtor)
+        Retorna: lista com os IDs inseridos, na mesma ordem da entrada. Uma leitura cujo
+        message_id já está gravado (ou repetido no próprio lote) não é gravada de novo e
+        recebe o id existente: para quem reenvia, conta como entregue.
+        """
+        if not leituras:
+            return []
+
+        # Valida tudo antes de abrir a transação (um item ruim não grava nada)
+        agora = int(time.time())
+        registros = []
+        for indice, leitura in enumerate(leituras):
+            faltando = [campo for campo in SENSOR_RANGES if leitura.get(campo) is None]
+            if faltando:
+                raise ValueError(f"Dados inválidos (item {indice}): campos faltando {faltando}")
+
+            is_valid, error_msg = self.validate_sensor_data(leitura)
+            if not is_valid:
+                raise ValueError(f"Dados inválidos (item {indice}): {error_msg}")
+
+            registro = {campo: leitura[campo] for campo in _SENSOR_COLUMNS}
+            registro['timestamp'] = leitura.get('timestamp') or agora
+            registro['device_id'] = leitura.get('device_id') or DEVICE_PADRAO
+            registro['message_id'] = leitura.get('message_id')
+            registros.append(registro)
+
+        return self._gravar_registros(registros)
+
+    def _gravar_registros(self, registros):
+        """
+        Grava leituras já validadas (com timestamp e device_id), os rollups e o risco
+        Retorna: IDs na mesma ordem de 'registros'
+        """
+        if self.particionado:
+            return self._gravar_particionado(registros)
+
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO leituras 
-                (temperatura, umidade_ar, umidade_solo, luminosidade, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (temperatura, umidade_ar, umidade_solo, luminosidade, int(time.time())))
-            
-            return cursor.lastrowid
+            gravadas = self._ids_gravados(cursor, [r['message_id'] for r in registros])
+            novas = self._novas(registros, range(len(registros)), gravadas)
+
+            ids = [None] * len(registros)
+            if novas:
+                lote = [registros[indice] for indice in novas]
+                self._inserir_leituras(cursor, _INSERT_READING_SQL, lote)
+
+                # executemany não atualiza lastrowid; os IDs são contíguos dentro da transação
+                ultimo_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+                primeiro_id = ultimo_id - len(lote) + 1
+                for deslocamento, indice in enumerate(novas):
+                    ids[indice] = primeiro_id + deslocamento
+
+                self._update_rollups(cursor, lote)
+                self._write_risks(cursor, [ids[indice] for indice in novas], lote)
+                self._registrar_modificacao(cursor)
+
+        return self._completar_ids(ids, registros, gravadas)
+
+    def _registrar_modificacao(self, cursor):
+        """
+        Avança a versão dos dados na transação que os modificou. O instante só anda
+        para frente (mesmo com o relógio voltando), para o Last-Modified nunca recuar
+        """
+        cursor.execute(
+            'UPDATE versao_dados SET contador = contador + 1, '
+            'modificado_em_ms = MAX(modificado_em_ms + 1, ?) WHERE id = 1',
+            (int(time.time() * 1000),)
+        )
+
+    def _ids_gravados(self, cursor, message_ids, esquema='main'):
+        """
+        Leituras já gravadas em 'esquema' com esses message_ids (reenvios da outbox
+        ou requeue do broker depois de um commit sem confirmação)
+        Retorna: {message_id: id}
+        """
+        message_ids = list({message_id for message_id in message_ids if message_id is not None})
+        gravados = {}
+        for inicio in range(0, len(message_ids), _MESSAGE_IDS_POR_CONSULTA):
+            parte = message_ids[inicio:inicio + _MESSAGE_IDS_POR_CONSULTA]
+            marcadores = ', '.join('?' * len(parte))
+            for row in cursor.execute(
+                f'SELECT message_id, id FROM {esquema}.leituras WHERE message_id IN ({marcadores})', parte
+            ):
+                gravados[row[0]] = row[1]
+        return gravados
+
+    def _novas(self, registros, indices, gravadas):
+        """
+        Índices (dentre 'indices') das leituras a gravar: sem as já gravadas e sem
+        repetir um message_id dentro do próprio lote (ex: o reenvio chegou antes de
+        a primeira cópia ser descarregada)
+        """
+        novas, vistas = [], set()
+        for indice in indices:
+            message_id = registros[indice]['message_id']
+            if message_id is not None:
+                if message_id in gravadas or message_id in vistas:
+                    continue
+                vistas.add(message_id)
+            novas.append(indice)
+        return novas
+
+    def _inserir_leituras(self, cursor, sql, lote):
+        """
+        executemany do INSERT OR IGNORE. Os ids são calculados pela quantidade gravada:
+        se outra conexão gravou um dos message_ids entre a consulta e o INSERT, a
+        transação é desfeita e o lote volta para quem chamou (o reenvio o deduplica)
+        """
+        if cursor.executemany(sql, lote).rowcount != len(lote):
+            raise sqlite3.IntegrityError('message_id gravado por outra conexão durante o lote')
+
+    def _completar_ids(self, ids, registros, gravadas):
+        """As leituras não gravadas (duplicadas) recebem o id da cópia que está no banco"""
+        for indice, registro in enumerate(registros):
+            if ids[indice] is not None and registro['message_id'] is not None:
+                gravadas.setdefault(registro['message_id'], ids[indice])
+        for indice, registro in enumerate(registros):
+            if ids[indice] is None:
+                ids[indice] = gravadas[registro['message_id']]
+        return ids
+
+    def _gravar_particionado(self, registros):
+        """
+        Grava cada leitura (e o risco dela) na partição do seu período; rollups e
+        catálogo ficam no main, na mesma transação. No WAL o commit é atômico por
+        arquivo: se ele falhar no meio, o main é reconciliado com as partições (ver
+        _reconciliar_particoes). Um lote que cobre mais de MAX_ANEXADAS partições (ex:
+        atraso de semanas saindo da outbox) é gravado em uma transação por grupo.
+        """
+        por_particao = {}
+        for indice, registro in enumerate(registros):
+            inicio = particoes.inicio_da_particao(registro['timestamp'], self.periodo)
+            por_particao.setdefault(inicio, []).append(indice)
+
+        ids = [None] * len(registros)
+        gravadas = {}
+        for grupo in particoes.em_grupos(sorted(por_particao)):
+            indices = sorted(indice for inicio in grupo for indice in por_particao[inicio])
+            self._marcar_pendentes(grupo)
+
+            try:
+                with self.get_connection() as conn:
+                    self._preparar_escrita(conn, grupo)
+                    cursor = conn.cursor()
+
+                    # Um reenvio tem o mesmo timestamp, então cai na mesma partição da cópia gravada
+                    for inicio in grupo:
+                        gravadas.update(self._ids_gravados(
+                            cursor, [registros[indice]['message_id'] for indice in por_particao[inicio]],
+                            particoes.esquema(inicio)
+                        ))
+                    novas = self._novas(registros, indices, gravadas)
+                    if not novas:
+                        continue
+
+                    primeiro_id = self._reservar_ids(cursor, len(novas))
+                    for deslocamento, indice in enumerate(novas):
+                        ids[indice] = primeiro_id + deslocamento
+
+                    for inicio in grupo:
+                        esquema = particoes.esquema(inicio)
+                        lote = [dict(registros[indice], id=ids[indice])
+                                for indice in por_particao[inicio] if ids[indice] is not None]
+                        if not lote:
+                            continue
+                        self._inserir_leituras(cursor, _INSERT_READING_PARTICAO_SQL.format(esquema=esquema), lote)
+                        self._write_risks(cursor, [r['id'] for r in lote], lote, esquema)
+                        self._registrar_particao(cursor, inicio, max(r['timestamp'] for r in lote))
+
+                    self._update_rollups(cursor, [registros[indice] for indice in novas])
+                    self._registrar_modificacao(cursor)
+                    gravadas.update({
+                        registros[indice]['message_id']: ids[indice]
+                        for indice in novas if registros[indice]['message_id'] is not None
+                    })
+            except sqlite3.Error:
+                # Um arquivo pode ter feito commit e o outro não: o lote volta para quem
+                # chamou (outbox/NACK), então o main precisa refletir só o que ficou gravado
+                try:
+                    self._reconciliar_particoes(grupo)
+                except sqlite3.Error as e:
+                    print(f"ERRO: Reconciliação das partições falhou (fica para a próxima inicialização): {e}")
+                raise
+
+        return self._completar_ids(ids, registros, gravadas)
+
+    def _reservar_ids(self, cursor, quantidade):
+        """
+        Reserva 'quantidade' ids consecutivos na sequência do AUTOINCREMENT de
+        main.leituras (a mesma que o modo sem partições usa)
+        Retorna: o primeiro id reservado
+        """
+        rows = cursor.execute(
+            "UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'leituras' RETURNING seq", (quantidade,)
+        ).fetchall()
+        if rows:
+            ultimo_id = rows[0][0]
+        else:
+            # Nenhuma leitura gravada ainda: a sequência começa aqui
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('leituras', ?)", (quantidade,))
+            ultimo_id = quantidade
+        return ultimo_id - quantidade + 1
+
+    def _marcar_pendentes(self, inicios):
+        """
+        Registra no main (em transação própria, antes dos dados) as partições que
+        vão receber escrita, para a inicialização saber quais reconciliar
+        """
+        novas = [inicio for inicio in inicios if inicio not in self._particoes_marcadas]
+        if not novas:
+            return
+        with self.get_connection() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO particoes_pendentes (inicio) VALUES (?)', [(inicio,) for inicio in novas]
+            )
+        self._particoes_marcadas.update(novas)
+
+    def _reconciliar_particoes(self, inicios=None):
+        """
+        Refaz no main, a partir dos dados brutos de cada partição, o que depende
+        dela: os buckets de rollup do período, a sequência de ids e o catálogo.
+        Corrige o que uma queda entre os commits dos dois arquivos deixou para trás
+        (rollups somados sem a leitura, ou a leitura sem os rollups/id reservado),
+        então o lote pode ser reenviado sem contar em dobro.
+        inicios: partições a reconciliar (None = todas as marcadas como pendentes)
+        """
+        if inicios is None:
+            with self.get_read_connection() as conn:
+                inicios = [row[0] for row in conn.execute('SELECT inicio FROM particoes_pendentes ORDER BY inicio')]
+            if inicios:
+                print(f"INFO: Reconciliando {len(inicios)} partições com o banco principal...")
+
+        segundos = particoes.duracao(self.periodo)
+        for grupo in particoes.em_grupos(inicios):
+            with self.get_connection() as conn:
+                self._preparar_escrita(conn, grupo)
+                cursor = conn.cursor()
+
+                for inicio in grupo:
+                    esquema = particoes.esquema(inicio)
+                    self._rebuild_rollups(cursor, [f'{esquema}.leituras'], desde=inicio, ate=inicio + segundos)
+
+                    ultimo_id, ultimo_timestamp = cursor.execute(
+                        f'SELECT MAX(id), MAX(timestamp) FROM {esquema}.leituras'
+                    ).fetchone()
+                    if ultimo_id is None:
+                        cursor.execute('DELETE FROM particoes WHERE inicio = ?', (inicio,))
+                        continue
+
+                    # Ids já usados na partição nunca voltam a ser reservados
+                    atualizada = cursor.execute(
+                        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'leituras'", (ultimo_id,)
+                    ).rowcount
+                    if not atualizada:
+                        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('leituras', ?)", (ultimo_id,))
+
+                    cursor.execute('''
+                        INSERT INTO particoes (inicio, fim, ultimo_timestamp) VALUES (?, ?, ?)
+                        ON CONFLICT(inicio) DO UPDATE SET ultimo_timestamp = excluded.ultimo_timestamp
+                    ''', (inicio, inicio + segundos, ultimo_timestamp))
+
+    def _registrar_particao(self, cursor, inicio, ultimo_timestamp):
+        """Inclui a partição no catálogo (ou avança o timestamp mais recente dela)"""
+        cursor.execute('''
+            INSERT INTO particoes (inicio, fim, ultimo_timestamp) VALUES (?, ?, ?)
+            ON CONFLICT(inicio) DO UPDATE SET ultimo_timestamp = MAX(ultimo_timestamp, excluded.ultimo_timestamp)
+        ''', (inicio, inicio + particoes.duracao(self.periodo), ultimo_timestamp))
+
+    def _todas_particoes(self):
+        """Inícios de todas as partições do catálogo, em ordem cronológica"""
+        if not self.particionado:
+            return []
+        with self.get_read_connection() as conn:
+            return [row[0] for row in conn.execute('SELECT inicio FROM particoes ORDER BY inicio')]
+
+    def _janelas(self, start_timestamp=None, end_timestamp=None, recentes_primeiro=True):
+        """
+        Divide o intervalo em janelas de leitura. Sem particionamento é uma só, o
+        próprio intervalo. Com particionamento, uma por grupo de até MAX_ANEXADAS
+        partições que cobrem o intervalo; as janelas são contíguas (o main, anexado
+        em todas, não é lido em dobro).
+        Gera: (partições a anexar, início, fim) - início/fim None = sem limite
+        """
+        if not self.particionado:
+            yield [], start_timestamp, end_timestamp
+            return
+
+        condicoes, params = [], []
+        if start_timestamp is not None:
+            condicoes.append('fim > ?')
+            params.append(start_timestamp)
+        if end_timestamp is not None:
+            condicoes.append('inicio <= ?')
+            params.append(end_timestamp)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+        with self.get_read_connection() as conn:
+            inicios = [row[0] for row in conn.execute(
+                f'SELECT inicio FROM particoes {where} ORDER BY inicio', params
+            )]
+
+        grupos = particoes.em_grupos(inicios) or [[]]
+        janelas = []
+        for posicao, grupo in enumerate(grupos):
+            inicio = start_timestamp if posicao == 0 else grupo[0]
+            fim = end_timestamp if posicao == len(grupos) - 1 else grupos[posicao + 1][0] - 1
+            janelas.append((grupo, inicio, fim))
+
+        if recentes_primeiro:
+            janelas.reverse()
+        yield from janelas
 
     def _get_safe_query_limit(self, limit=None):
         """Helper privado para calcular e travar o limite de queries SQL."""
@@ -113,93 +1053,647 @@ class Database:
         # Garante que o limite seja positivo (min 0) e não exceda o teto
         return min(max(0, limit), max_limit)
 
-    def get_recent_readings(self, limit=None):
+    def get_recent_readings(self, limit=None, device_id=None, cursor=None):
         """
         Retorna leituras mais recentes
         limit: quantidade de registros (padrão do config.py)
+        device_id: só as leituras dessa placa (None = todas)
+        cursor: continua a partir do next_cursor de get_readings_page
+        """
+        return self.get_readings_page(limit, cursor, device_id=device_id)[0]
+    
+    def get_readings_page(self, limit=None, cursor=None, start_timestamp=None,
+                          end_timestamp=None, device_id=None):
+        """
+        Uma página de leituras, das mais recentes para as mais antigas (keyset pagination)
+        cursor: next_cursor da página anterior (None = primeira página)
+        start_timestamp/end_timestamp: intervalo opcional (inclusivo)
+        
+        A posição é (timestamp, id), a mesma ordem de idx_timestamp e do índice por
+        dispositivo: a query busca no índice direto a partir do cursor, então uma
+        página funda custa o mesmo que a primeira (sem OFFSET).
+        Retorna: (leituras, next_cursor) - next_cursor é None na última página
         """
         safe_limit = self._get_safe_query_limit(limit)
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'''
-                SELECT id, temperatura, umidade_ar, umidade_solo, 
-                       luminosidade, timestamp
-                FROM leituras
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (safe_limit,))
+        # Uma linha a mais diz se existe próxima página
+        rows = self._buscar_leituras(safe_limit + 1, start_timestamp, end_timestamp, device_id, cursor)
+        
+        leituras = rows[:safe_limit]
+        next_cursor = codificar_cursor(leituras[-1]) if len(rows) > safe_limit and leituras else None
+        return leituras, next_cursor
+    
+    def _buscar_leituras(self, limit, start_timestamp=None, end_timestamp=None, device_id=None, cursor=None):
+        """
+        Até 'limit' leituras, das mais recentes para as mais antigas, a partir do cursor.
+        Com particionamento, percorre as janelas de partições (mais recentes primeiro)
+        até juntar 'limit'; sem, é uma query só.
+        """
+        if cursor is not None:
+            ultimo_timestamp, ultimo_id = decodificar_cursor(cursor)
+            # Partições mais novas que o cursor não precisam ser anexadas
+            if end_timestamp is None or ultimo_timestamp < end_timestamp:
+                end_timestamp = ultimo_timestamp
+        
+        leituras = []
+        for anexadas, inicio, fim in self._janelas(start_timestamp, end_timestamp):
+            condicoes, params = self._condicoes_leituras(inicio, fim, device_id)
+            if cursor is not None:
+                condicao, params_cursor = self._condicao_apos(ultimo_timestamp, ultimo_id)
+                condicoes.append(condicao)
+                params += params_cursor
+            where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
             
-            rows = cursor.fetchall()
+            with self.get_read_connection(anexadas) as conn:
+                rows = conn.execute(f'''
+                    SELECT {_LEITURA_COLUNAS}
+                    FROM leituras
+                    {where}
+                    ORDER BY timestamp DESC, id
+                    LIMIT ?
+                ''', (*params, limit - len(leituras))).fetchall()
             
             # Converte Row objects para dicts
-            return [dict(row) for row in rows]
+            leituras += [dict(row) for row in rows]
+            if len(leituras) >= limit:
+                break
+        
+        return leituras
+    
+    def get_latest_per_device(self):
+        """
+        Última leitura de cada dispositivo, em uma única query.
+        Os dispositivos são enumerados pelo índice (device_id, timestamp) com um
+        "skip scan" recursivo (um salto por placa, sem varrer a tabela), e a última
+        leitura de cada um também sai do índice; só a linha final é buscada pelo id.
+        Com particionamento, a query roda em cada arquivo (sobre a view o skip scan
+        viraria varredura) e fica a leitura mais recente de cada placa.
+        """
+        ultimas = {}
+        for anexadas, _, _ in self._janelas():
+            with self.get_read_connection(anexadas) as conn:
+                for esquema in ['main'] + [particoes.esquema(inicio) for inicio in anexadas]:
+                    for row in conn.execute(self._sql_ultima_por_device(esquema)):
+                        atual = ultimas.get(row['device_id'])
+                        if atual is None or (row['timestamp'], row['id']) > (atual['timestamp'], atual['id']):
+                            ultimas[row['device_id']] = dict(row)
+        
+        return [ultimas[device_id] for device_id in sorted(ultimas)]
     
-    def get_readings_by_timerange(self, start_timestamp, end_timestamp, limit=None):
+    def _sql_ultima_por_device(self, esquema):
+        """Query do skip scan da última leitura por dispositivo em um banco ('main' ou partição)"""
+        return f'''
+            WITH RECURSIVE dispositivos(device_id) AS (
+                SELECT MIN(device_id) FROM {esquema}.leituras
+                UNION ALL
+                SELECT (SELECT MIN(device_id) FROM {esquema}.leituras WHERE device_id > d.device_id)
+                FROM dispositivos d
+                WHERE d.device_id IS NOT NULL
+            )
+            SELECT l.id, l.device_id, l.temperatura, l.umidade_ar, l.umidade_solo,
+                   l.luminosidade, l.timestamp
+            FROM dispositivos d
+            JOIN {esquema}.leituras l ON l.id = (
+                SELECT id FROM {esquema}.leituras
+                WHERE device_id = d.device_id
+                ORDER BY timestamp DESC
+                LIMIT 1
+            )
+            ORDER BY l.device_id
+        '''
+    
+    def _condicoes_leituras(self, start_timestamp, end_timestamp, device_id):
+        """Condições do WHERE (e parâmetros) dos filtros opcionais de intervalo e dispositivo"""
+        condicoes, params = [], []
+        if start_timestamp is not None:
+            condicoes.append('timestamp >= ?')
+            params.append(start_timestamp)
+        if end_timestamp is not None:
+            condicoes.append('timestamp <= ?')
+            params.append(end_timestamp)
+        if device_id is not None:
+            condicoes.append('device_id = ?')
+            params.append(device_id)
+        return condicoes, params
+    
+    def _condicao_apos(self, timestamp, leitura_id, crescente=False):
+        """
+        Condição de keyset (e parâmetros) para continuar depois da posição (timestamp, id):
+        timestamp menor (páginas da API, mais recentes primeiro) ou maior (exportação,
+        ordem cronológica); no mesmo timestamp, id maior
+        """
+        if crescente:
+            return 'timestamp >= ? AND (timestamp > ? OR id > ?)', [timestamp, timestamp, leitura_id]
+        return 'timestamp <= ? AND (timestamp < ? OR id > ?)', [timestamp, timestamp, leitura_id]
+    
+    def iter_readings(self, start_timestamp=None, end_timestamp=None, device_id=None, chunk_size=5000):
+        """
+        Percorre as leituras em ordem cronológica, em blocos de 'chunk_size' linhas,
+        sem montar o resultado em memória: usado na exportação do histórico.
+        Cada bloco é uma query curta com keyset em (timestamp, id), com a conexão de
+        leitura pega e devolvida ao pool: um download lento não prende um leitor da
+        API nem segura o snapshot do WAL (o checkpoint segue durante a exportação).
+        Com particionamento, as janelas de partições são lidas em sequência.
+        Gera: listas de sqlite3.Row com as colunas de COLUNAS_LEITURA
+        """
+        for anexadas, inicio, fim in self._janelas(start_timestamp, end_timestamp, recentes_primeiro=False):
+            ultima = None
+            
+            while True:
+                condicoes, params = self._condicoes_leituras(inicio, fim, device_id)
+                if ultima is not None:
+                    condicao, params_cursor = self._condicao_apos(
+                        ultima['timestamp'], ultima['id'], crescente=True
+                    )
+                    condicoes.append(condicao)
+                    params += params_cursor
+                where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+                
+                with self.get_read_connection(anexadas) as conn:
+                    # Busca no índice de timestamp (ou no por dispositivo) a partir da última
+                    # linha; só leituras do mesmo segundo são ordenadas entre si pelo id
+                    rows = conn.execute(f'''
+                        SELECT {_LEITURA_COLUNAS}
+                        FROM leituras
+                        {where}
+                        ORDER BY timestamp, id
+                        LIMIT ?
+                    ''', (*params, chunk_size)).fetchall()
+                
+                if rows:
+                    yield rows
+                if len(rows) < chunk_size:
+                    break
+                ultima = rows[-1]
+    
+    def get_readings_by_timerange(self, start_timestamp, end_timestamp, limit=None, device_id=None,
+                                  cursor=None):
         """
         Retorna leituras em um intervalo de tempo específico
         Útil para análises do Edu
+        cursor: continua a partir do next_cursor de get_readings_page
         """
-        safe_limit = self._get_safe_query_limit(limit)
+        return self.get_readings_page(
+            limit, cursor, start_timestamp, end_timestamp, device_id=device_id
+        )[0]
+    
+    def _query_timerange(self, start_timestamp, end_timestamp, limit, device_id=None):
+        """Query bruta por intervalo, sem o teto de max_records_query"""
+        return self._buscar_leituras(limit, start_timestamp, end_timestamp, device_id)
+    
+    def _choose_resolution(self, start_timestamp, end_timestamp, points):
+        """
+        Escolhe a resolução mais grossa que ainda gera pelo menos 'points' buckets.
+        Retorna None se nem a mais fina basta (intervalo curto: usar dados brutos).
+        """
+        intervalo = end_timestamp - start_timestamp
         
-        with self.get_connection() as conn:
+        por_tamanho = sorted(
+            ROLLUP_RESOLUTIONS.items(), key=lambda item: item[1]['seconds'], reverse=True
+        )
+        for nome, cfg in por_tamanho:
+            if intervalo // cfg['seconds'] >= points:
+                return nome
+        
+        return None
+    
+    def get_aggregated_readings(self, start_timestamp, end_timestamp, points, device_id=None):
+        """
+        Retorna a série do intervalo já agregada nos rollups
+        Cada ponto traz a média do bucket no nome do sensor (ex: 'temperatura')
+        e também _min, _max, _ultimo e o total de leituras.
+        Sem device_id, os buckets de todos os dispositivos são combinados (frota inteira).
+        Intervalos curtos de uma placa vêm das leituras brutas, se couberem em
+        max_raw_range_query; senão (ou para a frota) vêm da resolução mais fina.
+        Retorna: (resolução usada, lista de dicts) - 'raw' se veio da tabela bruta
+        """
+        points = min(max(1, points), DATA_LIMITS['max_points_query'])
+        resolucao = self._choose_resolution(start_timestamp, end_timestamp, points)
+        
+        if resolucao is None:
+            # Intervalo menor que 'points' minutos: as leituras brutas da placa cabem na resposta.
+            # Uma a mais que o limite indica que não cabem (cortar perderia o começo do intervalo)
+            if device_id is not None:
+                limite = DATA_LIMITS['max_raw_range_query']
+                raw = self._query_timerange(start_timestamp, end_timestamp, limite + 1, device_id)
+                if len(raw) <= limite:
+                    return 'raw', raw
+            
+            # A frota sem filtro intercalaria placas diferentes em uma série só; o rollup
+            # mais fino já combina os dispositivos de cada bucket
+            resolucao = min(ROLLUP_RESOLUTIONS, key=lambda nome: ROLLUP_RESOLUTIONS[nome]['seconds'])
+        
+        # Alinha o início ao bucket que contém start_timestamp
+        segundos = ROLLUP_RESOLUTIONS[resolucao]['seconds']
+        bucket_inicial = (start_timestamp // segundos) * segundos
+        tabela = _rollup_table(resolucao)
+        
+        if device_id is not None:
+            colunas = ', '.join(
+                f'ROUND({sensor}_soma / total, 2) AS {sensor}, '
+                f'{sensor}_min, {sensor}_max, {sensor}_ultimo'
+                for sensor in _SENSOR_COLUMNS
+            )
+            sql = f'''
+                SELECT bucket AS timestamp, total, {colunas}
+                FROM {tabela}
+                WHERE device_id = ? AND bucket BETWEEN ? AND ?
+                ORDER BY bucket DESC
+            '''
+            params = (device_id, bucket_inicial, end_timestamp)
+        else:
+            # Combina os dispositivos de cada bucket; o "último" é o do dispositivo mais recente
+            colunas = ', '.join(
+                f'ROUND(SUM({sensor}_soma) / SUM(total), 2) AS {sensor}, '
+                f'MIN({sensor}_min) AS {sensor}_min, MAX({sensor}_max) AS {sensor}_max, '
+                f'MAX({sensor}_ultimo_frota) AS {sensor}_ultimo'
+                for sensor in _SENSOR_COLUMNS
+            )
+            ultimos = ', '.join(
+                f'FIRST_VALUE({sensor}_ultimo) OVER janela AS {sensor}_ultimo_frota'
+                for sensor in _SENSOR_COLUMNS
+            )
+            sql = f'''
+                SELECT bucket AS timestamp, SUM(total) AS total, {colunas}
+                FROM (
+                    SELECT *, {ultimos}
+                    FROM {tabela}
+                    WHERE bucket BETWEEN ? AND ?
+                    WINDOW janela AS (PARTITION BY bucket ORDER BY ultimo_timestamp DESC)
+                )
+                GROUP BY bucket
+                ORDER BY bucket DESC
+            '''
+            params = (bucket_inicial, end_timestamp)
+        
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, temperatura, umidade_ar, umidade_solo,
-                       luminosidade, timestamp
-                FROM leituras
-                WHERE timestamp BETWEEN ? AND ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (start_timestamp, end_timestamp, safe_limit))
+            cursor.execute(sql, params)
             
             rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return resolucao, [dict(row) for row in rows]
+    
+    def get_risk_history(self, start_timestamp, end_timestamp, praga=None, limit=None, device_id=None):
+        """
+        Série de risco no intervalo (mais recentes primeiro)
+        Com 'praga': risco dessa praga; sem: nível geral e risco máximo de cada leitura
+        Com 'device_id': só as leituras dessa placa
+        """
+        safe_limit = min(max(1, limit or DATA_LIMITS['max_points_query']), DATA_LIMITS['max_raw_range_query'])
+        
+        # O risco herda o timestamp da leitura: o filtro de tempo também vale para
+        # 'leituras', então a busca pode partir do índice (device_id, timestamp)
+        if device_id is not None:
+            juncao = 'JOIN leituras l ON l.id = r.leitura_id AND l.device_id = ? AND l.timestamp BETWEEN ? AND ?'
+        else:
+            juncao = ''
+        
+        serie = []
+        for anexadas, inicio, fim in self._janelas(start_timestamp, end_timestamp):
+            params_juncao = (device_id, inicio, fim) if device_id is not None else ()
+            
+            with self.get_read_connection(anexadas) as conn:
+                cursor = conn.cursor()
+                if praga:
+                    cursor.execute(f'''
+                        SELECT r.timestamp, r.risco
+                        FROM riscos r {juncao}
+                        WHERE r.praga = ? AND r.timestamp BETWEEN ? AND ?
+                        ORDER BY r.timestamp DESC
+                        LIMIT ?
+                    ''', (*params_juncao, praga, inicio, fim, safe_limit - len(serie)))
+                else:
+                    cursor.execute(f'''
+                        SELECT r.timestamp, r.nivel_geral, r.risco_maximo
+                        FROM riscos_nivel r {juncao}
+                        WHERE r.timestamp BETWEEN ? AND ?
+                        ORDER BY r.timestamp DESC
+                        LIMIT ?
+                    ''', (*params_juncao, inicio, fim, safe_limit - len(serie)))
+                
+                serie += [dict(row) for row in cursor.fetchall()]
+            
+            if len(serie) >= safe_limit:
+                break
+        
+        return serie
+    
+    def get_time_above_threshold(self, praga, threshold, start_timestamp, end_timestamp, device_id=None):
+        """
+        Quanto tempo a praga ficou com risco acima de 'threshold' no intervalo.
+        Cada leitura vale até a próxima do mesmo dispositivo; lacunas maiores que
+        risk_max_gap (sensor offline) contam só até esse limite.
+        Sem device_id, soma o tempo de todos os dispositivos.
+        Com particionamento em mais de uma janela (intervalo com mais de MAX_ANEXADAS
+        partições), a última leitura de cada janela conta 0s: no máximo um intervalo
+        entre leituras a menos por dispositivo a cada janela.
+        Retorna: dict com segundos, horas e total de leituras acima do limite
+        """
+        max_gap = DATA_LIMITS['risk_max_gap']
+        filtro, params = _filtro_device(device_id, coluna='l.device_id')
+        
+        leituras, segundos = 0, 0
+        for anexadas, inicio, fim in self._janelas(start_timestamp, end_timestamp):
+            with self.get_read_connection(anexadas) as conn:
+                row = conn.execute(f'''
+                    SELECT COUNT(*) AS leituras,
+                           COALESCE(SUM(MIN(COALESCE(proximo - timestamp, 0), ?)), 0) AS segundos
+                    FROM (
+                        SELECT r.timestamp, r.risco,
+                               LEAD(r.timestamp) OVER (
+                                   PARTITION BY l.device_id ORDER BY r.timestamp
+                               ) AS proximo
+                        FROM riscos r
+                        JOIN leituras l ON l.id = r.leitura_id
+                        WHERE r.praga = ? AND r.timestamp BETWEEN ? AND ?{filtro}
+                    )
+                    WHERE risco > ?
+                ''', (max_gap, praga, inicio, fim, *params, threshold)).fetchone()
+            leituras += row['leituras']
+            segundos += row['segundos']
+        
+        return {
+            'praga': praga,
+            'limite': threshold,
+            'device_id': device_id,
+            'leituras': leituras,
+            'segundos': segundos,
+            'horas': round(segundos / 3600, 2)
+        }
     
-    def get_statistics(self):
+    def get_data_version(self):
+        """
+        Versão barata dos dados (validador HTTP), lida de uma linha do main:
+        avança a cada escrita (inserção, limpeza, retenção de partições, rollups),
+        independente do timestamp das leituras. Uma leitura antiga reenviada pela
+        outbox também muda a versão e o Last-Modified.
+        Retorna: (versão 'contador-instante', instante da última escrita em epoch com fração)
+        """
+        with self.get_read_connection() as conn:
+            row = conn.execute('SELECT contador, modificado_em_ms FROM versao_dados WHERE id = 1').fetchone()
+            return f"{row['contador']}-{row['modificado_em_ms']}", row['modificado_em_ms'] / 1000
+    
+    def get_statistics(self, device_id=None):
         """
         Retorna estatísticas básicas (otimizado - uma query só)
         Útil para endpoint de análise
+        Com particionamento em várias janelas, as médias são combinadas pelo total de cada uma
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_registros,
-                    AVG(temperatura) as temp_media,
-                    AVG(umidade_ar) as umid_ar_media,
-                    AVG(umidade_solo) as umid_solo_media,
-                    AVG(luminosidade) as lum_media,
-                    MIN(timestamp) as primeira_leitura,
-                    MAX(timestamp) as ultima_leitura
-                FROM leituras
-            ''')
-            
-            row = cursor.fetchone()
-            return dict(row) if row else {}
+        filtro, params = _filtro_device(device_id, 'WHERE')
+        
+        parciais = []
+        for anexadas, _, _ in self._janelas():
+            with self.get_read_connection(anexadas) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT 
+                        COUNT(*) as total_registros,
+                        AVG(temperatura) as temp_media,
+                        AVG(umidade_ar) as umid_ar_media,
+                        AVG(umidade_solo) as umid_solo_media,
+                        AVG(luminosidade) as lum_media,
+                        MIN(timestamp) as primeira_leitura,
+                        MAX(timestamp) as ultima_leitura
+                    FROM leituras
+                    {filtro}
+                ''', params)
+                
+                row = cursor.fetchone()
+                if row:
+                    parciais.append(dict(row))
+        
+        if len(parciais) <= 1:
+            return parciais[0] if parciais else {}
+        return _combinar_estatisticas(parciais)
     
     def cleanup_old_data(self):
         """
-        Remove dados antigos (conforme retention_days no config)
+        Remove dados antigos (conforme retention_days no config) sem travar o banco
         Executa automaticamente para economizar espaço
+        
+        Apaga em blocos de RETENCAO['linhas_por_bloco'] (transações curtas, com pausa
+        entre elas para os outros escritores) e devolve o espaço ao disco com
+        incremental_vacuum em passos, em vez de um DELETE único + VACUUM completo.
+        Com particionamento, as partições inteiramente expiradas são só apagadas do disco.
+        Retorna: relatório com as leituras removidas, páginas liberadas e o tempo
+        (máximo e total) segurando o lock de escrita
         """
-        retention_seconds = DATA_LIMITS['retention_days'] * 86400
-        cutoff_timestamp = int(time.time()) - retention_seconds
+        agora = int(time.time())
+        cutoff_timestamp = agora - DATA_LIMITS['retention_days'] * 86400
+        relatorio = {
+            'removidas': 0,
+            'particoes_removidas': 0,
+            'blocos': 0,
+            'paginas_liberadas': 0,
+            'lock_max_ms': 0.0,
+            'lock_total_ms': 0.0
+        }
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                DELETE FROM leituras
-                WHERE timestamp < ?
-            ''', (cutoff_timestamp,))
+        # Histórico de risco acompanha a retenção das leituras brutas: cada bloco
+        # apaga as mesmas leituras das três tabelas (as de leituras por último)
+        mais_antigas = 'SELECT id FROM leituras WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?'
+        removidas_main = self._apagar_em_blocos([
+            f'DELETE FROM riscos WHERE leitura_id IN ({mais_antigas})',
+            f'DELETE FROM riscos_nivel WHERE leitura_id IN ({mais_antigas})',
+            f'DELETE FROM leituras WHERE id IN ({mais_antigas})'
+        ], (cutoff_timestamp,), relatorio)
+        relatorio['removidas'] = removidas_main
+        
+        if self.particionado:
+            relatorio['removidas'] += self._remover_particoes_expiradas(cutoff_timestamp, relatorio)
+        
+        # Rollups têm retenção própria (as resoluções grossas guardam mais tempo)
+        for nome, cfg in ROLLUP_RESOLUTIONS.items():
+            if cfg['retention_days'] is None:
+                continue
+            tabela = _rollup_table(nome)
+            rollup_cutoff = agora - cfg['retention_days'] * 86400
+            self._apagar_em_blocos([f'''
+                DELETE FROM {tabela} WHERE (device_id, bucket) IN (
+                    SELECT device_id, bucket FROM {tabela} WHERE bucket < ? LIMIT ?
+                )
+            '''], (rollup_cutoff,), relatorio)
+        
+        # Libera espaço no disco (importante no SD card); arquivos de partição já saíram inteiros
+        if removidas_main > 0:
+            self._liberar_espaco(relatorio)
+        
+        relatorio['lock_max_ms'] = round(relatorio['lock_max_ms'], 1)
+        relatorio['lock_total_ms'] = round(relatorio['lock_total_ms'], 1)
+        relatorio['timestamp'] = agora
+        self.ultima_retencao = relatorio
+        return relatorio
+    
+    def _remover_particoes_expiradas(self, cutoff_timestamp, relatorio):
+        """
+        Apaga os arquivos das partições cujo período inteiro ficou antes do cutoff.
+        A retenção anda de período em período: uma partição só sai quando a leitura
+        mais nova dela expira (até um período além de retention_days).
+        Retorna: total de leituras removidas
+        """
+        with self.get_read_connection() as conn:
+            expiradas = [row[0] for row in conn.execute(
+                'SELECT inicio FROM particoes WHERE fim <= ? ORDER BY inicio', (cutoff_timestamp,)
+            )]
+        
+        removidas = 0
+        for inicio in expiradas:
+            esquema = particoes.esquema(inicio)
+            with self.get_connection() as conn:
+                self._preparar_escrita(conn, [inicio])
+                removidas += conn.execute(f'SELECT COUNT(*) FROM {esquema}.leituras').fetchone()[0]
+                inicio_lock = time.perf_counter()
+                conn.execute('DELETE FROM particoes WHERE inicio = ?', (inicio,))
+                conn.execute('DELETE FROM particoes_pendentes WHERE inicio = ?', (inicio,))
+                self._registrar_modificacao(conn)
+            self._particoes_marcadas.discard(inicio)
+            self._registrar_lock(relatorio, time.perf_counter() - inicio_lock)
+            
+            # Desanexa do escritor antes de apagar; leitores largam o arquivo na próxima consulta
+            with self.get_connection() as conn:
+                self._preparar_escrita(conn, [])
+            for caminho in particoes.caminhos_do_arquivo(self.dir_particoes, inicio):
+                try:
+                    os.remove(caminho)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"ERRO: Não foi possível apagar {caminho}: {e}")
+            
+            relatorio['particoes_removidas'] += 1
+            print(f"INFO: Partição {particoes.nome_arquivo(inicio)} removida pela retenção.")
+        
+        return removidas
+    
+    def _migrar_para_particoes(self):
+        """
+        Move o histórico do main para as partições (primeira inicialização com o
+        particionamento ativo), um período por vez, do mais antigo ao mais novo.
+        A cópia para a partição faz commit antes de o main apagar as linhas (o commit
+        que cruza os dois arquivos não é atômico): uma queda no meio deixa a leitura
+        nos dois lugares, e a retomada só repete a cópia (INSERT OR IGNORE) e apaga.
+        """
+        # As views não leem o message_id (partições antigas podem não ter a coluna), a cópia sim
+        colunas = dict(particoes.TABELAS_PARTICIONADAS)
+        colunas['leituras'] += ', message_id'
+        segundos = particoes.duracao(self.periodo)
+        do_periodo = 'SELECT id FROM main.leituras WHERE timestamp >= ? AND timestamp < ?'
+        movidas = 0
+        
+        while True:
+            with self.get_connection() as conn:
+                mais_antiga = conn.execute('SELECT MIN(timestamp) FROM main.leituras').fetchone()[0]
+            if mais_antiga is None:
+                break
+            if not movidas:
+                print("INFO: Movendo o histórico do banco principal para as partições...")
+            
+            inicio = particoes.inicio_da_particao(mais_antiga, self.periodo)
+            esquema = particoes.esquema(inicio)
+            intervalo = (inicio, inicio + segundos)
+            
+            with self.get_connection() as conn:
+                self._preparar_escrita(conn, [inicio])
+                cursor = conn.cursor()
+                
+                for tabela in ('riscos', 'riscos_nivel'):
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO {esquema}.{tabela} ({colunas[tabela]})
+                        SELECT {colunas[tabela]} FROM main.{tabela} WHERE leitura_id IN ({do_periodo})
+                    ''', intervalo)
+                quantidade = cursor.execute(f'''
+                    INSERT OR IGNORE INTO {esquema}.leituras ({colunas['leituras']})
+                    SELECT {colunas['leituras']} FROM main.leituras WHERE timestamp >= ? AND timestamp < ?
+                ''', intervalo).rowcount
+                ultimo_timestamp = cursor.execute(
+                    'SELECT MAX(timestamp) FROM main.leituras WHERE timestamp >= ? AND timestamp < ?', intervalo
+                ).fetchone()[0]
             
-            deleted_count = cursor.rowcount
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                for tabela in ('riscos', 'riscos_nivel'):
+                    cursor.execute(f'DELETE FROM main.{tabela} WHERE leitura_id IN ({do_periodo})', intervalo)
+                cursor.execute('DELETE FROM main.leituras WHERE timestamp >= ? AND timestamp < ?', intervalo)
+                
+                self._registrar_particao(cursor, inicio, ultimo_timestamp)
             
-            # VACUUM para liberar espaço no disco (importante no SD card)
-            if deleted_count > 0:
+            movidas += quantidade
+            print(f"INFO: {quantidade} leituras movidas para {particoes.nome_arquivo(inicio)}")
+        
+        if movidas:
+            print(f"INFO: Migração para partições concluída ({movidas} leituras).")
+            self._liberar_espaco({'blocos': 0, 'paginas_liberadas': 0, 'lock_max_ms': 0.0, 'lock_total_ms': 0.0})
+    
+    def _apagar_em_blocos(self, comandos, params, relatorio):
+        """
+        Executa os DELETEs (que terminam em 'LIMIT ?') em transações de até
+        RETENCAO['linhas_por_bloco'] linhas, até o último comando apagar menos que isso
+        Retorna: total de linhas removidas pelo último comando
+        """
+        bloco = RETENCAO['linhas_por_bloco']
+        total = 0
+        
+        while True:
+            with self.get_connection() as conn:
+                inicio = time.perf_counter()
+                alteradas = 0
+                for sql in comandos:
+                    removidas = conn.execute(sql, (*params, bloco)).rowcount
+                    alteradas += removidas
+                if alteradas:
+                    self._registrar_modificacao(conn)
+            # Lock de escrita: do primeiro DELETE até o commit
+            self._registrar_lock(relatorio, time.perf_counter() - inicio)
+            
+            total += removidas
+            if removidas < bloco:
+                return total
+            
+            # Deixa os outros escritores (API, consumidor de persistência) entrarem
+            time.sleep(RETENCAO['pausa_s'])
+    
+    def _liberar_espaco(self, relatorio):
+        """
+        Devolve as páginas livres ao sistema de arquivos com incremental_vacuum,
+        em passos de RETENCAO['paginas_vacuum_por_passo'] com pausa entre eles.
+        Bancos criados sem auto_vacuum=INCREMENTAL (o PRAGMA só vale para arquivos novos)
+        são convertidos uma única vez (VACUUM completo); depois disso a limpeza nunca
+        mais reescreve o arquivo.
+        """
+        with self.get_connection() as conn:
+            modo = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        
+        if modo != _AUTO_VACUUM_INCREMENTAL:
+            print("INFO: Convertendo o banco para auto_vacuum=INCREMENTAL (VACUUM completo, uma única vez)...")
+            with self.get_connection() as conn:
+                inicio = time.perf_counter()
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
                 conn.execute('VACUUM')
+            self._registrar_lock(relatorio, time.perf_counter() - inicio)
+            return
+        
+        passo = RETENCAO['paginas_vacuum_por_passo']
+        while True:
+            with self.get_connection() as conn:
+                livres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not livres:
+                    return
+                inicio = time.perf_counter()
+                # executescript roda o PRAGMA até o fim (execute libera uma página por passo)
+                conn.executescript(f'PRAGMA incremental_vacuum({passo});')
+                restantes = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            self._registrar_lock(relatorio, time.perf_counter() - inicio)
+            relatorio['paginas_liberadas'] += livres - restantes
             
-            return deleted_count
+            if not restantes:
+                return
+            time.sleep(RETENCAO['pausa_s'])
+    
+    def _registrar_lock(self, relatorio, segundos):
+        """Acumula no relatório o tempo de uma transação da limpeza"""
+        relatorio['blocos'] += 1
+        relatorio['lock_max_ms'] = max(relatorio['lock_max_ms'], segundos * 1000)
+        relatorio['lock_total_ms'] += segundos * 1000
 
 
 # Instância global (singleton)
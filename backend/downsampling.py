@@ -0,0 +1,141 @@
+import numpy as np
+
+from config import DATA_LIMITS
+
+# Séries de sensores reduzidas pelo LTTB
+_SENSOR_FIELDS = ('temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade')
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: escolhe 'n_out' pontos que preservam
+    a forma visual da série (picos e vales sobrevivem à redução).
+
+    Args:
+        x: array 1D crescente (ex: timestamps)
+        y: array 1D com os valores
+        n_out: número de pontos desejado
+
+    Retorna:
+        Array com os índices selecionados, em ordem crescente.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        # Nada a reduzir (ou pontos insuficientes para formar triângulos)
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Primeiro e último pontos são sempre mantidos; o miolo é dividido em n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    # Médias de cada bucket (vetorizado), usadas como terceiro vértice do triângulo
+    counts = np.diff(edges)
+    sum_x = np.add.reduceat(x[:n - 1], edges[:-1])
+    sum_y = np.add.reduceat(y[:n - 1], edges[:-1])
+    avg_x = np.append(sum_x / counts, x[-1])
+    avg_y = np.append(sum_y / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        bx, by = x[start:end], y[start:end]
+
+        # Área (x2) do triângulo entre o ponto anterior, cada candidato e a média do próximo bucket
+        areas = np.abs(
+            (x[a] - avg_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def _series(rows, ordem, campos):
+    """
+    Pontos de cada série de sensor para o LTTB, em ordem crescente de timestamp.
+    Linhas de rollup entram com dois pontos por bucket, o _min e o _max: um pico
+    mais curto que o bucket some da média, mas não do extremo, e a seleção fica
+    com o bucket dele. Leituras brutas entram com o próprio valor.
+    Retorna: lista de (x, y, linhas) - linhas[k] é o índice em 'rows' do ponto k
+    """
+    x = np.array([rows[i]['timestamp'] for i in ordem], dtype=float)
+    if f'{campos[0]}_min' not in rows[0]:
+        return [(x, np.array([rows[i][campo] for i in ordem], dtype=float), ordem) for campo in campos]
+
+    x_extremos = np.repeat(x, 2)
+    linhas = np.repeat(ordem, 2)
+    series = []
+    for campo in campos:
+        y = np.empty(len(x_extremos))
+        y[0::2] = [rows[i][f'{campo}_min'] for i in ordem]
+        y[1::2] = [rows[i][f'{campo}_max'] for i in ordem]
+        series.append((x_extremos, y, linhas))
+    return series
+
+
+def downsample_rows(rows, points, campos=_SENSOR_FIELDS):
+    """
+    Aplica o LTTB em cada série de sensor e mantém a união das linhas escolhidas.
+    O resultado tem no máximo 'points' linhas, na ordem original: o orçamento de
+    cada série começa em 'points' e diminui até a união caber (as séries costumam
+    escolher linhas em comum, então cada uma fica com mais que points / len(campos)).
+    Em rollups a escolha é feita sobre os extremos de cada bucket (ver _series);
+    as linhas voltam inteiras, com a média e os campos _min/_max do bucket.
+    """
+    if len(rows) <= points:
+        return rows
+
+    # O LTTB precisa do eixo x crescente; as queries retornam mais recentes primeiro
+    ordem = np.argsort([row['timestamp'] for row in rows], kind='stable')
+    series = _series(rows, ordem, campos)
+
+    por_serie = points
+    while True:
+        escolhidos = set()
+        for x, y, linhas in series:
+            escolhidos.update(linhas[lttb_indices(x, y, por_serie)].tolist())
+        if len(escolhidos) <= points:
+            break
+        if por_serie <= 3:
+            # Orçamento pequeno demais para todas as séries: fica só a primeira
+            x, y, linhas = series[0]
+            escolhidos = set(linhas[lttb_indices(x, y, points)].tolist())
+            break
+        por_serie = max(3, por_serie * points // len(escolhidos))
+
+    return [row for i, row in enumerate(rows) if i in escolhidos]
+
+
+def get_downsampled_readings(database, start_timestamp, end_timestamp, points, device_id=None):
+    """
+    Série do intervalo com tamanho constante para os gráficos.
+    Busca a resolução de rollup que cobre 'points' (ou os dados brutos,
+    em intervalos curtos) e reduz com LTTB até 'points', preservando os
+    extremos de cada bucket.
+    device_id: série de uma placa só (None = frota inteira)
+    Retorna: (resolução de origem, lista de dicts)
+    """
+    points = min(max(3, points), DATA_LIMITS['max_points_query'])
+
+    resolucao, rows = database.get_aggregated_readings(
+        start_timestamp, end_timestamp, points, device_id=device_id
+    )
+    return resolucao, downsample_rows(rows, points)
+
+
+def linhas_em_colunas(rows):
+    """
+    Layout colunar: um array por campo em vez de um objeto por linha
+    ({'timestamp': [...], 'temperatura': [...], ...}).
+    Sem os nomes repetidos a cada linha, o JSON fica menor, comprime melhor
+    e é mais rápido de desserializar no cliente.
+    """
+    if not rows:
+        return {}
+    return {campo: [row.get(campo) for row in rows] for campo in rows[0]}
@@ -0,0 +1,141 @@
+import json
+
+from config import (
+    DATABASE, REDIS_LATEST_DATA_KEY, REDIS_RISK_KEY,
+    REDIS_DEVICE_STATE_KEY, REDIS_RISK_RANKING_KEY, CACHE_LOCAL, STREAM_SSE
+)
+
+# ==========================================================
+# Estado atual de cada dispositivo no Redis
+# ==========================================================
+# Os consumidores de análise gravam; a API lê.
+# As chaves globais (REDIS_LATEST_DATA_KEY/REDIS_RISK_KEY) continuam sendo
+# atualizadas com a análise mais recente, para os clientes antigos.
+
+# Dispositivo atribuído às leituras sem device_id (mesmo padrão do SQLite)
+DEVICE_PADRAO = DATABASE.get('default_device_id', 'default')
+
+
+def device_da_leitura(dados):
+    return dados.get('device_id') or DEVICE_PADRAO
+
+
+def ultimas_por_device(leituras):
+    """
+    Última leitura de cada dispositivo de um lote (o supervisor mistura placas
+    na mesma mensagem). Retorna uma lista na ordem da última aparição de cada um.
+    """
+    ultimas = {}
+    for dados in leituras:
+        device_id = device_da_leitura(dados)
+        ultimas.pop(device_id, None)
+        ultimas[device_id] = dados
+    return list(ultimas.values())
+
+
+# Timestamp da leitura por trás de cada estado gravado (por dispositivo e o da chave global)
+REDIS_DEVICE_TIMESTAMP_KEY = f'{REDIS_DEVICE_STATE_KEY}:timestamps'
+REDIS_LATEST_TIMESTAMP_KEY = f'{REDIS_LATEST_DATA_KEY}:timestamp'
+
+# Grava o estado só se a leitura não for mais antiga que a já gravada: com vários
+# workers/tarefas de análise em paralelo, uma leitura velha que termina depois não
+# sobrescreve o estado, o ranking nem as chaves globais (e não vai para o stream).
+# KEYS: estados (hash), timestamps (hash), ranking (zset), última análise,
+#       nível de risco, timestamp da última análise
+# ARGV: canal do stream SSE ('' = desligado), canal de invalidação ('' = desligado),
+#       e, por resultado: device_id, estado (JSON), timestamp, risco_maximo, nivel_geral
+# Retorna: quantos dispositivos foram atualizados
+_SCRIPT_GRAVAR_ESTADOS = """
+local atualizados = 0
+for i = 3, #ARGV, 5 do
+    local device_id, estado, timestamp = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local gravado = tonumber(redis.call('HGET', KEYS[2], device_id))
+    if not gravado or timestamp >= gravado then
+        redis.call('HSET', KEYS[1], device_id, estado)
+        redis.call('HSET', KEYS[2], device_id, ARGV[i + 2])
+        redis.call('ZADD', KEYS[3], ARGV[i + 3], device_id)
+        if ARGV[1] ~= '' then
+            redis.call('PUBLISH', ARGV[1], estado)
+        end
+        atualizados = atualizados + 1
+
+        local global = tonumber(redis.call('GET', KEYS[6]))
+        if not global or timestamp >= global then
+            redis.call('SET', KEYS[4], estado)
+            redis.call('SET', KEYS[5], ARGV[i + 4])
+            redis.call('SET', KEYS[6], ARGV[i + 2])
+        end
+    end
+end
+if atualizados > 0 and ARGV[2] ~= '' then
+    redis.call('PUBLISH', ARGV[2], '1')
+end
+return atualizados
+"""
+
+
+def enfileirar_estados(pipe, resultados):
+    """
+    Enfileira no pipeline (síncrono ou asyncio) a gravação das análises: um EVAL
+    que atualiza estado, ranking e chaves globais de cada dispositivo só se a
+    leitura for a mais recente já vista, publica os eventos do stream ao vivo e o
+    aviso de invalidação do cache local (se ativos).
+    Quem chama faz o execute().
+    resultados: dicts de formatar_resultado_cache
+    """
+    if not resultados:
+        return
+
+    # Leituras sem device_id ficam no dispositivo padrão (o mesmo do SQLite)
+    argumentos = [
+        STREAM_SSE['canal'] if STREAM_SSE['enabled'] else '',
+        CACHE_LOCAL['canal'] if CACHE_LOCAL['invalidacao_pubsub'] else ''
+    ]
+    for resultado in resultados:
+        device_id = resultado.get('device_id') or DEVICE_PADRAO
+        argumentos += [
+            device_id,
+            json.dumps({**resultado, 'device_id': device_id}),
+            int(resultado['timestamp']),
+            resultado['risco_maximo'],
+            resultado['nivel_geral']
+        ]
+
+    chaves = [
+        REDIS_DEVICE_STATE_KEY, REDIS_DEVICE_TIMESTAMP_KEY, REDIS_RISK_RANKING_KEY,
+        REDIS_LATEST_DATA_KEY, REDIS_RISK_KEY, REDIS_LATEST_TIMESTAMP_KEY
+    ]
+    pipe.eval(_SCRIPT_GRAVAR_ESTADOS, len(chaves), *chaves, *argumentos)
+
+
+def ler_estado(redis_client, device_id=None):
+    """Última análise (dict) de um dispositivo ou, sem device_id, a mais recente de todas. None se não houver."""
+    if device_id:
+        estado = redis_client.hget(REDIS_DEVICE_STATE_KEY, device_id)
+    else:
+        estado = redis_client.get(REDIS_LATEST_DATA_KEY)
+    return json.loads(estado) if estado else None
+
+
+def ler_frota(redis_client, top=None):
+    """
+    Ranking de risco e estado de todos os dispositivos em um único round trip
+    (pipeline sem transação: ZREVRANGE + HGETALL).
+    top: quantos dispositivos no ranking (None = todos)
+    Retorna: (ranking, estados)
+        ranking: lista de {'device_id', 'risco_maximo', 'estado'} do mais arriscado ao menos
+        estados: dict device_id -> última análise
+    """
+    fim = -1 if top is None else max(1, top) - 1
+
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(REDIS_RISK_RANKING_KEY, 0, fim, withscores=True)
+        pipe.hgetall(REDIS_DEVICE_STATE_KEY)
+        mais_arriscados, brutos = pipe.execute()
+
+    estados = {device_id: json.loads(estado) for device_id, estado in brutos.items()}
+    ranking = [
+        {'device_id': device_id, 'risco_maximo': risco, 'estado': estados.get(device_id)}
+        for device_id, risco in mais_arriscados
+    ]
+    return ranking, estados
@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+
+from database import COLUNAS_LEITURA
+
+# Parquet é opcional (pip install pyarrow); NDJSON e CSV não precisam de nada
+PYARROW_AVAILABLE = False
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = pq = None
+
+# formato -> (mimetype, extensão do arquivo)
+FORMATOS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+
+def _gerar_ndjson(blocos):
+    for linhas in blocos:
+        yield ''.join(json.dumps(dict(linha)) + '\n' for linha in linhas).encode('utf-8')
+
+
+def _gerar_csv(blocos):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUNAS_LEITURA)
+
+    for linhas in blocos:
+        writer.writerows(linhas)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Histórico vazio: só o cabeçalho
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _SaidaEmPartes:
+    """Arquivo só de escrita que acumula os bytes até o gerador repassá-los (esvaziar)"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+        self.closed = False
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _gerar_parquet(blocos):
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('device_id', pa.string()),
+        ('temperatura', pa.float64()),
+        ('umidade_ar', pa.float64()),
+        ('umidade_solo', pa.float64()),
+        ('luminosidade', pa.float64()),
+        ('timestamp', pa.int64())
+    ])
+    saida = _SaidaEmPartes()
+
+    # Cada bloco vira um row group, escrito e repassado antes de ler o próximo
+    with pq.ParquetWriter(pa.PythonFile(saida, mode='w'), schema) as writer:
+        for linhas in blocos:
+            colunas = {nome: [linha[i] for linha in linhas] for i, nome in enumerate(COLUNAS_LEITURA)}
+            writer.write_table(pa.Table.from_pydict(colunas, schema=schema))
+            yield saida.esvaziar()
+
+    # Rodapé (metadados) escrito ao fechar
+    yield saida.esvaziar()
+
+
+_GERADORES = {
+    'ndjson': _gerar_ndjson,
+    'csv': _gerar_csv,
+    'parquet': _gerar_parquet
+}
+
+
+def exportar_leituras(db, formato, start_timestamp=None, end_timestamp=None, device_id=None,
+                      chunk_size=5000):
+    """
+    Gerador com o histórico de leituras serializado em 'formato' ('ndjson', 'csv' ou 'parquet'),
+    em pedaços de bytes (um por bloco de 'chunk_size' linhas do SQLite).
+    Levanta ValueError para formato desconhecido e RuntimeError para parquet sem pyarrow.
+    """
+    if formato not in _GERADORES:
+        raise ValueError(f"Formato inválido: {formato} (use {', '.join(FORMATOS)})")
+    if formato == 'parquet' and not PYARROW_AVAILABLE:
+        raise RuntimeError("Exportação em Parquet requer o pacote 'pyarrow'")
+
+    blocos = db.iter_readings(start_timestamp, end_timestamp, device_id, chunk_size=chunk_size)
+    return _GERADORES[formato](blocos)
@@ -0,0 +1,51 @@
+import argparse
+import sys
+import time
+
+# Adiciona a pasta raiz do backend ao path para import
+sys.path.append('.')
+from database import db as database_instance
+from exportacao import exportar_leituras, FORMATOS
+from config import EXPORTACAO
+
+
+def main():
+    """Exporta o histórico de leituras do SQLite para um arquivo (ou stdout), em blocos."""
+    parser = argparse.ArgumentParser(description='Exportação do histórico de leituras do SQLite')
+    parser.add_argument('--formato', choices=list(FORMATOS), default='ndjson', help='Formato (padrão: ndjson)')
+    parser.add_argument('--inicio', type=int, help='Timestamp inicial (epoch)')
+    parser.add_argument('--fim', type=int, help='Timestamp final (epoch)')
+    parser.add_argument('--device', help='Só as leituras desse device_id')
+    parser.add_argument('--saida', help='Arquivo de saída (padrão: stdout)')
+    parser.add_argument('--chunk', type=int, default=EXPORTACAO['chunk_linhas'],
+                        help=f"Linhas por bloco lido do SQLite (padrão: {EXPORTACAO['chunk_linhas']})")
+    args = parser.parse_args()
+
+    try:
+        partes = exportar_leituras(
+            database_instance, args.formato, args.inicio, args.fim, args.device, chunk_size=args.chunk
+        )
+    except RuntimeError as e:
+        print(f"ERRO: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # Com stdout como saída, o progresso vai para o stderr
+    inicio = time.time()
+    total_bytes = 0
+    saida = open(args.saida, 'wb') if args.saida else sys.stdout.buffer
+    try:
+        for parte in partes:
+            saida.write(parte)
+            total_bytes += len(parte)
+    except KeyboardInterrupt:
+        print("\nInterrompido: o arquivo ficou incompleto.", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if args.saida:
+            saida.close()
+
+    print(f"✅ Exportação concluída: {total_bytes / 1024:.1f} KB em {time.time() - inicio:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
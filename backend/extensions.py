@@ -1,6 +1,8 @@
 import redis
-from config import UPSTASH_REDIS_URL
+from config import UPSTASH_REDIS_URL, CACHE_LOCAL, STREAM_SSE, HTTP_CACHE
 from database import db as database_instance 
+from cache_respostas import CacheRespostas
+from stream_leituras import HubEventos
 
 try:
     redis_client = redis.from_url(UPSTASH_REDIS_URL, decode_responses=True)
@@ -10,3 +12,19 @@ except Exception as e:
     print(f"ERRO ao conectar ao redis: {e}")
     redis_client = None
 db = database_instance
+
+# Cache local das respostas de tempo real (compartilhado pelas threads do Flask)
+cache_respostas = CacheRespostas(
+    CACHE_LOCAL['ttl_s'], enabled=CACHE_LOCAL['enabled'], max_entradas=CACHE_LOCAL['max_entradas'],
+    max_age=HTTP_CACHE['max_age_tempo_real']
+)
+
+# Distribuidor dos eventos ao vivo (SSE); a assinatura no Redis sobe na primeira conexão
+hub_eventos = None
+if STREAM_SSE['enabled'] and redis_client:
+    hub_eventos = HubEventos(
+        redis_client, STREAM_SSE['canal'],
+        historico=STREAM_SSE['historico'],
+        max_fila_cliente=STREAM_SSE['max_fila_cliente'],
+        politica=STREAM_SSE['politica_cliente_lento']
+    )
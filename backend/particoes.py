@@ -0,0 +1,104 @@
+import os
+import time
+
+# Duração de cada período de partição (segundos)
+_DURACOES = {
+    'dia': 86400,
+    'semana': 7 * 86400
+}
+
+# 1970-01-05 foi uma segunda-feira: as semanas (UTC) começam na segunda
+_INICIO_SEMANA = 4 * 86400
+
+# Limite de bancos anexados por conexão (SQLITE_MAX_ATTACHED padrão; não dá para subir em runtime)
+MAX_ANEXADAS = 10
+
+# Tabelas por partição: cada arquivo tem as leituras do período e o risco delas
+TABELAS_PARTICIONADAS = {
+    'leituras': 'id, temperatura, umidade_ar, umidade_solo, luminosidade, timestamp, device_id',
+    'riscos': 'leitura_id, praga, risco, timestamp',
+    'riscos_nivel': 'leitura_id, timestamp, nivel_geral, risco_maximo'
+}
+
+
+def duracao(periodo):
+    if periodo not in _DURACOES:
+        raise ValueError(f"Período de partição inválido: {periodo} (use {', '.join(_DURACOES)})")
+    return _DURACOES[periodo]
+
+
+def inicio_da_particao(timestamp, periodo):
+    """Início (epoch, UTC) da partição que guarda uma leitura com esse timestamp"""
+    segundos = duracao(periodo)
+    deslocamento = _INICIO_SEMANA if periodo == 'semana' else 0
+    return (timestamp - deslocamento) // segundos * segundos + deslocamento
+
+
+def nome_arquivo(inicio):
+    """Arquivo da partição (ex: 'leituras_20260118.db', data UTC do início)"""
+    return f"leituras_{time.strftime('%Y%m%d', time.gmtime(inicio))}.db"
+
+
+def esquema(inicio):
+    """Nome com que a partição é anexada (ATTACH ... AS p_<início>)"""
+    return f"p_{inicio}"
+
+
+def em_grupos(particoes, tamanho=MAX_ANEXADAS):
+    """Divide a lista de partições em grupos que cabem em uma conexão"""
+    return [particoes[i:i + tamanho] for i in range(0, len(particoes), tamanho)]
+
+
+def remover_views(conn):
+    """Remove as views temporárias das tabelas particionadas (antes de trocar os anexos)"""
+    for tabela in TABELAS_PARTICIONADAS:
+        conn.execute(f'DROP VIEW IF EXISTS temp.{tabela}')
+
+
+def anexar(conn, particoes, diretorio, criar=False):
+    """
+    Deixa anexadas na conexão exatamente as 'particoes' (lista de inícios),
+    desanexando as que sobraram de consultas anteriores. Precisa estar fora de transação.
+    Sem 'criar', partições cujo arquivo não existe (ex: removidas pela retenção
+    depois da consulta ao catálogo) são ignoradas em vez de criadas vazias.
+    Retorna: (mudou, inícios efetivamente anexados)
+    """
+    if not criar:
+        particoes = [inicio for inicio in particoes
+                     if os.path.exists(os.path.join(diretorio, nome_arquivo(inicio)))]
+    desejados = {esquema(inicio): inicio for inicio in particoes}
+    anexados = {row[1] for row in conn.execute('PRAGMA database_list')} - {'main', 'temp'}
+
+    sobrando = anexados - set(desejados)
+    faltando = set(desejados) - anexados
+    if not sobrando and not faltando:
+        return False, particoes
+
+    # Views antigas apontam para esquemas que podem sair
+    remover_views(conn)
+    for nome in sobrando:
+        conn.execute(f'DETACH DATABASE {nome}')
+    for nome in faltando:
+        caminho = os.path.join(diretorio, nome_arquivo(desejados[nome]))
+        conn.execute('ATTACH DATABASE ? AS ' + nome, (caminho,))
+    return True, particoes
+
+
+def criar_views(conn, particoes):
+    """
+    Views temporárias 'leituras', 'riscos' e 'riscos_nivel' (UNION ALL do main com as
+    partições anexadas). Views temp têm prioridade sobre as tabelas do main, então as
+    queries sem esquema passam a ler só as partições anexadas; com as tabelas de cada
+    ramo ordenadas pelos próprios índices, o SQLite junta os ramos sem reordenar (MERGE).
+    """
+    for tabela, colunas in TABELAS_PARTICIONADAS.items():
+        ramos = [f'SELECT {colunas} FROM main.{tabela}'] + [
+            f'SELECT {colunas} FROM {esquema(inicio)}.{tabela}' for inicio in particoes
+        ]
+        conn.execute(f'CREATE TEMP VIEW {tabela} AS ' + ' UNION ALL '.join(ramos))
+
+
+def caminhos_do_arquivo(diretorio, inicio):
+    """Arquivo da partição e os auxiliares do WAL (removidos juntos na retenção)"""
+    base = os.path.join(diretorio, nome_arquivo(inicio))
+    return [base, f'{base}-wal', f'{base}-shm']
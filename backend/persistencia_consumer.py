@@ -2,14 +2,23 @@ import pika
 import json
 import time
 import sys
+from collections import OrderedDict
 
 # Importa a classe Database do seu módulo de persistência
 sys.path.append('.') # Adiciona a pasta raiz do backend ao path para import
 from database import db as database_instance # Importa a instância global 'db'
-from config import CLOUD_AMQP_URL, RABBITMQ_QUEUE_NAME
+from config import (
+    CLOUD_AMQP_URL, RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE,
+    RABBITMQ_CONSUMER_QUEUES, PERSISTENCIA_BATCH
+)
+from wire_format import decodificar_leituras, ids_do_lote, WireFormatError
 
 # Configurações do RabbitMQ
-QUEUE_NAME = RABBITMQ_QUEUE_NAME
+QUEUE_NAME = RABBITMQ_CONSUMER_QUEUES['persistencia']
+
+# Quantos message_ids recentes são lembrados para descartar reenvios sem ir ao banco
+# (a garantia contra duplicadas é o índice único de message_id no SQLite)
+_DEDUP_JANELA = 10000
 
 def connect_rabbitmq():
     """
@@ -21,7 +30,11 @@ def connect_rabbitmq():
             params = pika.URLParameters(CLOUD_AMQP_URL)
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
+            
+            # Fila própria ligada ao exchange fanout (não disputa mensagens com a análise)
+            channel.exchange_declare(exchange=RABBITMQ_EXCHANGE_NAME, exchange_type=RABBITMQ_EXCHANGE_TYPE, durable=True)
             channel.queue_declare(queue=QUEUE_NAME, durable=True)
+            channel.queue_bind(queue=QUEUE_NAME, exchange=RABBITMQ_EXCHANGE_NAME)
             
             print("INFO: Conexão com CloudAMQP estabelecida.")
             return connection, channel
@@ -29,64 +42,240 @@ def connect_rabbitmq():
             print(f"ERRO: CloudAMQP não disponível. Tentando reconectar em 5s... ({e})")
             time.sleep(5)
 
+def _extrair_leituras(body, content_type=None):
+    """
+    Decodifica a mensagem (JSON ou binário, conforme o content_type) e extrai os campos
+    dos sensores, o dispositivo de origem e o momento da coleta (timestamp): leituras
+    reenviadas pela outbox depois de uma queda do broker mantêm o horário real.
+    Uma mensagem pode trazer uma leitura ou um lote; retorna sempre uma lista.
+    Levanta json.JSONDecodeError/WireFormatError se o corpo for inválido.
+    """
+    return [
+        {
+            'temperatura': data.get('temperatura'),
+            'umidade_ar': data.get('umidade_ar'),
+            'umidade_solo': data.get('umidade_solo'),
+            'luminosidade': data.get('luminosidade'),
+            'device_id': data.get('device_id'),
+            'timestamp': data.get('timestamp')
+        }
+        for data in decodificar_leituras(body, content_type)
+    ]
+
+def _leituras_validas(body, properties):
+    """
+    Leituras da mensagem que devem ser gravadas: descarta (com log) as
+    duplicadas (reenvios da outbox) e as que falham na validação.
+    Retorna: lista de (id de deduplicação, leitura)
+    Levanta json.JSONDecodeError/WireFormatError se o corpo for inválido.
+    """
+    leituras = _extrair_leituras(body, getattr(properties, 'content_type', None))
+    message_ids = ids_do_lote(getattr(properties, 'message_id', None), len(leituras))
+
+    validas = []
+    for message_id, leitura in zip(message_ids, leituras):
+        if ids_persistidos.contem(message_id):
+            print(f"PERSISTÊNCIA: Mensagem {message_id} duplicada (reenvio). Descartando.")
+            continue
+        try:
+            if leitura['timestamp'] is not None:
+                leitura['timestamp'] = int(leitura['timestamp'])
+            is_valid, error_msg = database_instance.validate_sensor_data(leitura)
+        except (TypeError, ValueError) as e:
+            # TypeError p/ o caso de 'None' ser comparado (ex: None <= 10); ValueError p/ timestamp inválido
+            is_valid, error_msg = False, str(e)
+        if not is_valid:
+            print(f"VALIDAÇÃO FALHOU (Não Persistido): Dados inválidos: {error_msg}")
+            continue
+        # Vai junto para o banco: o índice único descarta o que o filtro em memória não pegou
+        leitura['message_id'] = message_id
+        validas.append((message_id, leitura))
+    return validas
+
+class IdsRecentes:
+    """
+    Conjunto limitado (LRU) dos message_ids já persistidos por este processo.
+    O produtor reenvia da outbox o que não teve confirmação, então a mesma
+    leitura pode chegar duas vezes; só ids gravados com sucesso são registrados.
+    É só um atalho (some no reinício e não é compartilhado entre consumidores):
+    quem garante a deduplicação é o INSERT OR IGNORE no índice único de message_id.
+    """
+
+    def __init__(self, limite):
+        self.limite = limite
+        self._ids = OrderedDict()
+
+    def contem(self, message_id):
+        return message_id is not None and message_id in self._ids
+
+    def registrar(self, message_ids):
+        for message_id in message_ids:
+            if message_id is None:
+                continue
+            self._ids[message_id] = None
+            self._ids.move_to_end(message_id)
+        while len(self._ids) > self.limite:
+            self._ids.popitem(last=False)
+
+
+ids_persistidos = IdsRecentes(_DEDUP_JANELA)
+
+
 def callback(ch, method, properties, body):
     """Função chamada quando uma mensagem é recebida para Persistência."""
+    _persistir_mensagem(ch, method.delivery_tag, body, properties)
+
+def _persistir_mensagem(ch, delivery_tag, body, properties=None):
+    """Salva uma única mensagem (uma leitura ou um lote) no SQLite e faz o ACK/reject correspondente."""
     
     try:
-        # 1. Decodificar JSON
-        data = json.loads(body.decode('utf-8'))
+        # 1. Decodificar a mensagem e extrair dados (sem duplicadas e inválidas)
+        validas = _leituras_validas(body, properties)
         
-        # 2. Extrair dados
-        temperatura = data.get('temperatura')
-        umidade_ar = data.get('umidade_ar')
-        umidade_solo = data.get('umidade_solo')
-        luminosidade = data.get('luminosidade')
+        # 2. SALVAMENTO NO SQLITE (insert_readings_bulk grava o timestamp da coleta)
+        if validas:
+            ids = database_instance.insert_readings_bulk([leitura for _, leitura in validas])
+            if len(ids) == 1:
+                print(f"PERSISTÊNCIA: Leitura ID {ids[0]} salva no SQLite.")
+            else:
+                print(f"PERSISTÊNCIA: Lote de {len(ids)} leituras salvo no SQLite (IDs {ids[0]}-{ids[-1]}).")
+        ids_persistidos.registrar([message_id for message_id, _ in validas])
         
-        # 3. SALVAMENTO NO SQLITE
-        reading_id = database_instance.insert_reading(
-            temperatura, umidade_ar, umidade_solo, luminosidade
-        )
+        # 3. Confirmar (ACK)
+        ch.basic_ack(delivery_tag=delivery_tag) 
 
-        print(f"PERSISTÊNCIA: Leitura ID {reading_id} salva no SQLite.")
-        
-        # 4. Confirmar (ACK)
-        ch.basic_ack(delivery_tag=method.delivery_tag) 
-
-    except json.JSONDecodeError as e:
-        # Erro de "Poison Message": JSON mal formatado.
-        print(f" ERRO JSON: {e}. Mensagem não pode ser processada. Descartando (ACK).")
-        ch.basic_ack(delivery_tag=method.delivery_tag) # ACK: não faz sentido reprocessar
+    except (json.JSONDecodeError, WireFormatError) as e:
+        # Erro de "Poison Message": JSON mal formatado ou binário inválido.
+        print(f" ERRO DE DECODIFICAÇÃO: {e}. Mensagem não pode ser processada. Descartando (ACK).")
+        ch.basic_ack(delivery_tag=delivery_tag) # ACK: não faz sentido reprocessar
 
     except (ValueError, TypeError) as e:
         # Se os dados forem inválidos (falha na validação do database.py)
         # TypeError p/ o caso de 'None' ser comparado (ex: None <= 10)
         print(f"VALIDAÇÃO FALHOU (Não Persistido): {e}")
-        ch.basic_ack(delivery_tag=method.delivery_tag) # ACK: não faz sentido reprocessar dados ruins
+        ch.basic_ack(delivery_tag=delivery_tag) # ACK: não faz sentido reprocessar dados ruins
         
     except Exception as e:
         # Qualquer outro erro (ex: problema no SQLite, falha de conexão DB)
         print(f"ERRO NO PROCESSAMENTO: {e}. Rejeitando a mensagem (requeue)...")
         # Rejeita e envia de volta para a fila (requeue=True)
-        ch.basic_reject(delivery_tag=method.delivery_tag, requeue=True) 
+        ch.basic_reject(delivery_tag=delivery_tag, requeue=True) 
+
+
+class LotePersistencia:
+    """
+    Acumula mensagens e grava todas em uma única transação no SQLite.
+    O lote é descarregado ao atingir 'max_messages' ou após 'max_wait_ms'
+    desde a primeira mensagem pendente, o que ocorrer primeiro.
+    """
+
+    def __init__(self, channel, max_messages, max_wait_ms):
+        self.channel = channel
+        self.max_messages = max_messages
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._pendentes = [] # Lista de (delivery_tag, body, properties, [(id, leitura), ...])
+        self._timer = None
+
+    def callback(self, ch, method, properties, body):
+        """Recebe uma mensagem: descarta as inválidas e duplicadas na hora e enfileira as válidas."""
+        try:
+            validas = _leituras_validas(body, properties)
+
+        except (json.JSONDecodeError, WireFormatError) as e:
+            print(f" ERRO DE DECODIFICAÇÃO: {e}. Mensagem não pode ser processada. Descartando (ACK).")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        if not validas:
+            # Nada a gravar (só duplicadas/inválidas): ACK na hora
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        self._pendentes.append((method.delivery_tag, body, properties, validas))
+
+        if len(self._pendentes) >= self.max_messages:
+            self.flush()
+        elif self._timer is None:
+            # Primeira mensagem do lote: agenda o descarregamento por tempo
+            self._timer = ch.connection.call_later(self.max_wait_s, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        self.flush()
+
+    def flush(self):
+        """Grava o lote pendente e confirma todas as mensagens com um único ACK."""
+        if self._timer is not None:
+            self.channel.connection.remove_timeout(self._timer)
+            self._timer = None
+
+        if not self._pendentes:
+            return
+
+        lote, self._pendentes = self._pendentes, []
+        ultima_tag = lote[-1][0]
+
+        try:
+            ids = database_instance.insert_readings_bulk(
+                [leitura for *_, validas in lote for _, leitura in validas]
+            )
+        except Exception as e:
+            # Falha no lote: processa uma a uma para isolar a mensagem problemática
+            print(f"ERRO NO LOTE ({len(lote)} mensagens): {e}. Processando individualmente...")
+            for delivery_tag, body, properties, _ in lote:
+                self._processar_individual(delivery_tag, body, properties)
+            return
+
+        ids_persistidos.registrar([message_id for *_, validas in lote for message_id, _ in validas])
+
+        # ACK múltiplo: confirma todas as tags pendentes até a última do lote
+        self.channel.basic_ack(delivery_tag=ultima_tag, multiple=True)
+        print(f"PERSISTÊNCIA: Lote de {len(ids)} leituras salvo no SQLite (IDs {ids[0]}-{ids[-1]}).")
+
+    def _processar_individual(self, delivery_tag, body, properties=None):
+        """Reaproveita o tratamento unitário para uma mensagem do lote."""
+        _persistir_mensagem(self.channel, delivery_tag, body, properties)
+
 
 def start_persistencia_consumer():
+    # Reconecta em loop (sem recursão) quando o broker derruba a conexão
+    while _consumir_persistencia():
+        print("Conexão fechada pelo broker. Reiniciando...")
+
+
+def _consumir_persistencia():
+    """Uma sessão de consumo. Retorna True se deve reconectar."""
     connection, channel = connect_rabbitmq()
+    lote = None
     
     print('INFO: Consumidor de Persistência esperando mensagens. Pressione CTRL+C para sair.')
     
-    # Define que o consumidor só receberá 1 mensagem por vez
-    channel.basic_qos(prefetch_count=1) 
-    
-    # Inicia o consumo
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
+    if PERSISTENCIA_BATCH['enabled']:
+        max_messages = PERSISTENCIA_BATCH['max_messages']
+        
+        # O prefetch precisa comportar um lote inteiro, senão ele nunca enche
+        prefetch = max(PERSISTENCIA_BATCH['prefetch_count'], max_messages)
+        channel.basic_qos(prefetch_count=prefetch)
+        
+        lote = LotePersistencia(channel, max_messages, PERSISTENCIA_BATCH['max_wait_ms'])
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=lote.callback)
+        print(f"INFO: Modo lote ativo (até {max_messages} mensagens / {PERSISTENCIA_BATCH['max_wait_ms']}ms).")
+    else:
+        # Define que o consumidor só receberá 1 mensagem por vez
+        channel.basic_qos(prefetch_count=1) 
+        
+        # Inicia o consumo
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
     
     try:
         channel.start_consuming()
     except KeyboardInterrupt:
         print("Encerrando Consumidor de Persistência.")
+        if lote and connection.is_open:
+            # Grava o que já foi recebido antes de sair
+            lote.flush()
     except pika.exceptions.ConnectionClosedByBroker:
-        print("Conexão fechada pelo broker. Reiniciando...")
-        start_persistencia_consumer() # Tenta reconectar
+        return True
     except Exception as e:
         print(f"Erro inesperado no consumidor: {e}")
     finally:
@@ -96,6 +285,7 @@ def start_persistencia_consumer():
                 print("INFO: Conexão com RabbitMQ fechada.")
             except Exception as e:
                 print(f"Erro ao fechar conexão: {e}")
+    return False
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Ordem canônica das colunas do array de leituras (N x 4)
+SENSOR_FIELDS = ('temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade')
+
+
+class RiskEngine:
+    """
+    Compila as regras de pragas em matrizes NumPy (min, max, centro)
+    para pontuar muitas leituras de uma vez, sem loops em Python por linha.
+
+    As regras seguem o formato de PRAGAS_SOJA_REGRAS:
+        {"praga": {"temp": (min, max), "umidade": (min, max), ...}}
+    e 'sensor_map' traduz as chaves das regras para os campos dos dados.
+    """
+
+    def __init__(self, regras, sensor_map, campos=SENSOR_FIELDS):
+        self.pragas = list(regras)
+        self.campos = tuple(campos)
+
+        n_pragas = len(self.pragas)
+        n_regras = max((len(cond) for cond in regras.values()), default=0)
+
+        # Matrizes (pragas x regras); regras sem sensor mapeado ficam mascaradas
+        self._coluna = np.zeros((n_pragas, n_regras), dtype=int)
+        self._min = np.zeros((n_pragas, n_regras))
+        self._max = np.zeros((n_pragas, n_regras))
+        self._mascara = np.zeros((n_pragas, n_regras), dtype=bool)
+
+        # O denominador é o total de regras da praga (as não mapeadas contam como 0)
+        self._total_regras = np.array([len(regras[p]) for p in self.pragas], dtype=float)
+
+        for i, praga in enumerate(self.pragas):
+            for j, (regra_key, (min_val, max_val)) in enumerate(regras[praga].items()):
+                sensor_key = sensor_map.get(regra_key)
+                if sensor_key not in self.campos:
+                    continue
+                self._coluna[i, j] = self.campos.index(sensor_key)
+                self._min[i, j] = min_val
+                self._max[i, j] = max_val
+                self._mascara[i, j] = True
+
+        self._centro = (self._min + self._max) / 2
+        self._meia_faixa = (self._max - self._min) / 2
+
+    def to_array(self, leituras, default=np.nan):
+        """
+        Converte uma lista de dicts de leituras em um array N x len(campos).
+        Campos ausentes viram 'default' (NaN = fora de qualquer faixa).
+        Levanta TypeError/ValueError se algum valor não for numérico.
+        """
+        return np.array(
+            [[float(leitura.get(campo, default)) for campo in self.campos] for leitura in leituras],
+            dtype=float
+        ).reshape(-1, len(self.campos))
+
+    def _valores_e_faixa(self, leituras):
+        """Projeta as leituras nas regras: (N, pragas, regras) + máscara de 'dentro da faixa'"""
+        leituras = np.asarray(leituras, dtype=float).reshape(-1, len(self.campos))
+        valores = leituras[:, self._coluna]
+
+        with np.errstate(invalid='ignore'):
+            dentro = (valores >= self._min) & (valores <= self._max) & self._mascara
+        return valores, dentro
+
+    def _media_por_praga(self, pontos):
+        soma = pontos.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            risco = np.where(self._total_regras > 0, soma / self._total_regras * 100, 0.0)
+        return risco
+
+    def score_binary(self, leituras):
+        """
+        Modo binário (analysis_logic/calcGrafico): cada regra atendida vale 1 ponto.
+        Retorna: array N x pragas com o risco percentual.
+        """
+        _, dentro = self._valores_e_faixa(leituras)
+        return self._media_por_praga(dentro.astype(float))
+
+    def score_gradual(self, leituras):
+        """
+        Modo gradual (analysis_routes): dentro da faixa, o fator vale
+        1 - distância_ao_centro / meia_faixa (1.0 no centro, ~0 na borda).
+        Retorna: array N x pragas com a probabilidade percentual.
+        """
+        valores, dentro = self._valores_e_faixa(leituras)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fator = np.where(
+                self._meia_faixa > 0,
+                1.0 - np.abs(valores - self._centro) / self._meia_faixa,
+                # Faixa degenerada (min == max): 100% só se o valor bater exatamente
+                (valores == self._centro).astype(float)
+            )
+        return self._media_por_praga(np.where(dentro, fator, 0.0))
+
+    def to_dicts(self, scores, casas=None):
+        """Converte o array N x pragas em uma lista de dicts {'praga': risco}"""
+        linhas = np.atleast_2d(scores).tolist()
+        if casas is not None:
+            # round() do Python (np.round pode divergir na última casa)
+            linhas = [[round(valor, casas) for valor in linha] for linha in linhas]
+        return [dict(zip(self.pragas, linha)) for linha in linhas]
+
+
+def nivel_geral(scores, limite_alto, limite_moderado):
+    """Classifica cada linha pelo risco máximo: ALTO / MODERADO / BAIXO (vetorizado)"""
+    risco_maximo = np.atleast_2d(scores).max(axis=1, initial=0)
+    return np.select(
+        [risco_maximo >= limite_alto, risco_maximo >= limite_moderado],
+        ['ALTO', 'MODERADO'],
+        default='BAIXO'
+    )
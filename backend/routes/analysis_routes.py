@@ -1,7 +1,8 @@
-import json
-from flask import Blueprint, jsonify
-from extensions import redis_client
-from config import REDIS_LATEST_DATA_KEY
+import time
+from flask import Blueprint, jsonify, request
+from extensions import db, redis_client, cache_respostas
+from estado_dispositivos import ler_estado
+from risk_engine import RiskEngine
 analysis_bp = Blueprint('analysis', __name__)
 
 # (Regras e KEY_MAP não mudam)
@@ -17,6 +18,9 @@ KEY_MAP = {
     "luz": "luminosidade"
 }
 
+# Regras compiladas em matrizes NumPy (ver risk_engine.py)
+_RISK_ENGINE = RiskEngine(PRAGAS_SOJA_REGRAS, KEY_MAP)
+
 
 # ==========================================================
 # === A NOVA LÓGICA DE CÁLCULO (GRADUAL) ===
@@ -26,58 +30,27 @@ def _calculate_pest_probabilities(dados_brutos):
     Calcula uma probabilidade percentual (0-100) para cada praga,
     baseado em quão "ideal" o valor atual está dentro da faixa de risco.
     """
-    probabilidades = {}
     if not dados_brutos:
         return {}
 
-    for praga, regras in PRAGAS_SOJA_REGRAS.items():
-        factor_scores = [] # Lista para guardar os scores (0.0 a 1.0) de cada fator
+    for regra_key, dado_key in KEY_MAP.items():
+        if dado_key not in dados_brutos:
+            print(f"Aviso: Chave '{dado_key}' (para '{regra_key}') não encontrada.")
 
-        for regra_key, (min_val, max_val) in regras.items():
-            dado_key = KEY_MAP.get(regra_key)
-            
-            if not dado_key or dado_key not in dados_brutos:
-                print(f"Aviso: Chave '{dado_key}' (para '{regra_key}') não encontrada.")
-                factor_scores.append(0.0) # Se o sensor falhar, 0% de risco para esse fator
-                continue 
-
-            valor_atual = dados_brutos[dado_key]
-
-            # --- Lógica de Risco Gradual ---
-            factor_score = 0.0 # Risco é 0 se estiver FORA da faixa
-            if min_val <= valor_atual <= max_val:
-                # O valor está na faixa de risco.
-                # Calculamos o quão perto do "ponto ideal" (o centro) ele está.
-                center = (min_val + max_val) / 2
-                max_distance = (max_val - min_val) / 2
-                
-                # Evita divisão por zero se min_val == max_val
-                if max_distance == 0:
-                    # Se min == max e o valor bateu, é 100%
-                    factor_score = 1.0 if valor_atual == center else 0.0
-                else:
-                    current_distance = abs(valor_atual - center)
-                    # (1.0 - (distancia_atual / distancia_maxima))
-                    # Perto do centro -> (1.0 - ~0.0) -> ~1.0 (Risco Alto)
-                    # Perto da borda -> (1.0 - ~1.0) -> ~0.0 (Risco Baixo)
-                    factor_score = 1.0 - (current_distance / max_distance)
-
-            factor_scores.append(factor_score)
-        
-        # A probabilidade final é a MÉDIA dos scores de todos os fatores
-        if factor_scores:
-            probabilidade_total = (sum(factor_scores) / len(factor_scores)) * 100
-            probabilidades[praga] = round(probabilidade_total, 1) # Arredonda
-        else:
-            probabilidades[praga] = 0
-
-    return probabilidades
+    # Sensor ausente vira NaN -> 0% de risco para esse fator
+    leitura = _RISK_ENGINE.to_array([dados_brutos])
+
+    # A probabilidade final é a MÉDIA dos scores de todos os fatores
+    # (centro da faixa -> 1.0, borda -> ~0.0, fora da faixa -> 0.0)
+    probabilidades = _RISK_ENGINE.score_gradual(leitura)
+    return _RISK_ENGINE.to_dicts(probabilidades, casas=1)[0]
 # ==========================================================
 # === FIM DA NOVA LÓGICA ===
 # ==========================================================
 
 
 @analysis_bp.route('/risk', methods=['GET'])
+@cache_respostas.em_cache
 def get_pest_risk_analysis():
     # (O resto desta função está correto e não muda)
     
@@ -85,11 +58,11 @@ def get_pest_risk_analysis():
         return jsonify({'error': 'Redis service unavailable'}), 503
 
     try:
-        data_json = redis_client.get(REDIS_LATEST_DATA_KEY)
-        if not data_json:
+        # device_id opcional: risco de uma placa
+        data = ler_estado(redis_client, request.args.get('device_id'))
+        if not data:
             return jsonify({'success': False, 'message': 'Nenhum dado no cache.'}), 404
         
-        data = json.loads(data_json)
         dados_brutos = data.get('dados_brutos') 
 
         if not dados_brutos:
@@ -119,4 +92,64 @@ def get_pest_risk_analysis():
 
     except Exception as e:
         print(f"Erro em /analysis/risk: {e}")
-        return jsonify({'error': 'Erro interno ao calcular riscos'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Erro interno ao calcular riscos'}), 500
+
+
+def _periodo_da_query(dias_padrao=7):
+    """Lê start/end da query string (padrão: últimos 'dias_padrao' dias)"""
+    end_timestamp = request.args.get('end', default=int(time.time()), type=int)
+    start_timestamp = request.args.get('start', default=end_timestamp - dias_padrao * 86400, type=int)
+    return start_timestamp, end_timestamp
+
+
+@analysis_bp.route('/risk/history', methods=['GET'])
+def get_risk_history():
+    """
+    Histórico de risco pré-calculado (SQLite)
+    Query params: start, end, praga (opcional), limit (opcional), device_id (opcional)
+    """
+    try:
+        start_timestamp, end_timestamp = _periodo_da_query()
+        praga = request.args.get('praga')
+        limit = request.args.get('limit', type=int)
+        device_id = request.args.get('device_id')
+
+        historico = db.get_risk_history(
+            start_timestamp, end_timestamp, praga=praga, limit=limit, device_id=device_id
+        )
+        return jsonify({
+            'success': True,
+            'praga': praga,
+            'device_id': device_id,
+            'total': len(historico),
+            'historico': historico
+        }), 200
+
+    except Exception as e:
+        print(f"Erro em /analysis/risk/history: {e}")
+        return jsonify({'error': 'Erro ao buscar histórico de risco'}), 500
+
+
+@analysis_bp.route('/risk/time-above', methods=['GET'])
+def get_risk_time_above():
+    """
+    Tempo em que uma praga ficou acima de um limite de risco
+    Query params: praga (obrigatório), threshold (padrão 70), start, end, device_id (opcional)
+    """
+    praga = request.args.get('praga')
+    if not praga:
+        return jsonify({'success': False, 'error': 'Parâmetro praga é obrigatório'}), 400
+
+    try:
+        start_timestamp, end_timestamp = _periodo_da_query()
+        threshold = request.args.get('threshold', default=70, type=float)
+
+        resultado = db.get_time_above_threshold(
+            praga, threshold, start_timestamp, end_timestamp,
+            device_id=request.args.get('device_id')
+        )
+        return jsonify({'success': True, **resultado}), 200
+
+    except Exception as e:
+        print(f"Erro em /analysis/risk/time-above: {e}")
+        return jsonify({'error': 'Erro ao calcular tempo acima do limite'}), 500
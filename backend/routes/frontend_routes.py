@@ -1,8 +1,11 @@
 import json
 import time
-from flask import Blueprint, jsonify
-from extensions import db, redis_client
-from config import DATA_LIMITS, REDIS_LATEST_DATA_KEY, REDIS_RISK_KEY
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from extensions import db, redis_client, cache_respostas, hub_eventos
+from downsampling import get_downsampled_readings, linhas_em_colunas
+from estado_dispositivos import ler_estado, ler_frota
+from cache_respostas import condicional_por_versao
+from config import DATA_LIMITS, STREAM_SSE, HTTP_CACHE
 
 frontend_bp = Blueprint('api', __name__)
 
@@ -35,26 +38,32 @@ def get_api_status():
             'Upstash Redis (Cache)': _check_redis_status(),
             'CloudAMQP (Consumidores)': 'Verificar Consumidores',
         },
+        'pool_sqlite': db.get_pool_stats(),
+        'retencao': db.ultima_retencao,
+        'cache_local': cache_respostas.stats(),
+        'stream_ao_vivo': hub_eventos.stats() if hub_eventos else 'offline',
         'timestamp': int(time.time())
     }), 200
 
 
 @frontend_bp.route('/latest', methods=['GET'])
+@cache_respostas.em_cache
 def get_latest_data_and_risk():
     if not redis_client:
         return jsonify({'error': 'Redis service unavailable'}), 503
 
+    device_id = request.args.get('device_id') # Opcional: estado de uma placa
+    
     try:
-        data_json = redis_client.get(REDIS_LATEST_DATA_KEY)
+        data = ler_estado(redis_client, device_id)
         
-        if data_json:
-            data = json.loads(data_json)
+        if data:
             return jsonify({
                 'success': True,
                 'tempo_real': data
             }), 200
 
-        latest_db_reading = db.get_recent_readings(limit=1)
+        latest_db_reading = db.get_recent_readings(limit=1, device_id=device_id)
         
         if latest_db_reading:
             fallback_data = {
@@ -75,16 +84,136 @@ def get_latest_data_and_risk():
         return jsonify({'error': 'Erro ao buscar dados de tempo real'}), 500
 
 
+@frontend_bp.route('/stream', methods=['GET'])
+def stream_live_readings():
+    """
+    Leituras analisadas em tempo real via Server-Sent Events (substitui o polling de /latest).
+    Eventos 'leitura' trazem o mesmo JSON de /latest; ao conectar sem histórico para
+    retomar (primeira conexão ou Last-Event-ID antigo), um evento 'snapshot' traz o
+    estado atual de todos os dispositivos. Comentários periódicos mantêm a conexão viva.
+    Query params: device_id (opcional), last_event_id (alternativa ao header Last-Event-ID)
+    """
+    if not hub_eventos:
+        return jsonify({'error': 'Stream ao vivo indisponível (Redis offline ou desativado)'}), 503
+
+    device_id = request.args.get('device_id')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    cliente, snapshot_id = hub_eventos.conectar(last_event_id, device_id)
+
+    def eventos():
+        try:
+            yield f"retry: {STREAM_SSE['retry_ms']}\n\n"
+
+            if snapshot_id is not None:
+                _, estados = ler_frota(redis_client)
+                if device_id:
+                    estados = {device_id: estados[device_id]} if device_id in estados else {}
+                yield f"id: {snapshot_id}\nevent: snapshot\ndata: {json.dumps(estados)}\n\n"
+
+            while True:
+                frame = cliente.proximo(STREAM_SSE['heartbeat_s'])
+                if frame is not None:
+                    yield frame
+                elif cliente.desconectado:
+                    # Cliente lento: encerra; o EventSource reconecta e retoma pelo Last-Event-ID
+                    return
+                else:
+                    yield ": heartbeat\n\n"
+        finally:
+            hub_eventos.desconectar(cliente)
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@frontend_bp.route('/fleet', methods=['GET'])
+@cache_respostas.em_cache
+def get_fleet_status():
+    """
+    Estado atual da frota (Redis, um round trip): os 'top' dispositivos com
+    maior risco e a última análise de todos.
+    Query params: top (padrão 10)
+    """
+    if not redis_client:
+        return jsonify({'error': 'Redis service unavailable'}), 503
+
+    try:
+        top = request.args.get('top', default=10, type=int)
+        ranking, estados = ler_frota(redis_client, top)
+        return jsonify({
+            'success': True,
+            'total_dispositivos': len(estados),
+            'mais_arriscados': ranking,
+            'dispositivos': estados
+        }), 200
+    except Exception as e:
+        print(f"Erro ao ler do Redis: {e}")
+        return jsonify({'error': 'Erro ao buscar estado da frota'}), 500
+
+
+@frontend_bp.route('/devices/latest', methods=['GET'])
+@condicional_por_versao(db.get_data_version, HTTP_CACHE['max_age_tempo_real'])
+def get_latest_per_device():
+    """Última leitura de cada dispositivo (uma query indexada, independente do tamanho do histórico)"""
+    try:
+        leituras = db.get_latest_per_device()
+        return jsonify({
+            'success': True,
+            'total': len(leituras),
+            'dispositivos': leituras
+        }), 200
+    except Exception as e:
+        print(f"Erro ao ler do SQLite: {e}")
+        return jsonify({'error': 'Erro ao buscar dados do banco'}), 500
+
+
 @frontend_bp.route('/historical/<int:limit>', methods=['GET'])
+@condicional_por_versao(db.get_data_version, HTTP_CACHE['max_age_historico'])
 def get_historical_data(limit):
     try:
+        start_timestamp = request.args.get('start', type=int)
+        end_timestamp = request.args.get('end', type=int)
+        points = request.args.get('points', type=int)
+        device_id = request.args.get('device_id') # Opcional: só uma placa
+        # 'colunar': um array por campo (menor e mais rápido de ler que um objeto por linha)
+        colunar = request.args.get('formato') == 'colunar'
+        # Sem intervalo: 'cursor' (next_cursor da resposta anterior) pagina para trás
+        cursor = request.args.get('cursor')
+        
+        # Com intervalo de tempo, 'limit' é o número de pontos desejado no gráfico
+        if start_timestamp and end_timestamp:
+            if start_timestamp >= end_timestamp:
+                return jsonify({'success': False, 'error': 'start deve ser menor que end'}), 400
+            
+            if points:
+                # Tamanho fixo para o gráfico, preservando picos (LTTB)
+                resolucao, leituras = get_downsampled_readings(
+                    db, start_timestamp, end_timestamp, points, device_id=device_id
+                )
+            else:
+                resolucao, leituras = db.get_aggregated_readings(
+                    start_timestamp, end_timestamp, limit, device_id=device_id
+                )
+            return jsonify({
+                'success': True,
+                'total': len(leituras),
+                'resolucao': resolucao,
+                'historico': linhas_em_colunas(leituras) if colunar else leituras
+            }), 200
+        
         safe_limit = min(max(1, limit), DATA_LIMITS.get('max_historical_limit', 500))
-        leituras = db.get_recent_readings(limit=safe_limit)
+        leituras, next_cursor = db.get_readings_page(limit=safe_limit, cursor=cursor, device_id=device_id)
         return jsonify({
             'success': True,
             'total': len(leituras),
-            'historico': leituras
+            'historico': linhas_em_colunas(leituras) if colunar else leituras,
+            'next_cursor': next_cursor
         }), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"Erro ao ler do SQLite: {e}")
         return jsonify({'error': 'Erro ao buscar dados do banco'}), 500
\ No newline at end of file
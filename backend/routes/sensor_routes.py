@@ -1,5 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from database import db
+from downsampling import get_downsampled_readings, linhas_em_colunas
+from cache_respostas import condicional_por_versao
+from exportacao import exportar_leituras, FORMATOS
+from config import HTTP_CACHE, INGESTAO_HTTP, EXPORTACAO
+import json
 import time
 
 # Blueprint para rotas de sensores
@@ -8,6 +13,78 @@ sensor_bp = Blueprint('sensor', __name__)
 # Constantes de configuração do Blueprint
 _REQUIRED_FIELDS = ['temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade']
 _DEFAULT_LIST_LIMIT = 50
+_NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _validar_leitura(data):
+    """
+    Valida e normaliza uma leitura recebida (campos, tipos, ranges e timestamp opcional)
+    Retorna: (leitura, None) se válida ou (None, mensagem de erro)
+    """
+    if not isinstance(data, dict):
+        return None, 'Leitura deve ser um objeto JSON'
+
+    missing_fields = [field for field in _REQUIRED_FIELDS if field not in data]
+    if missing_fields:
+        return None, f'Campos faltando: {", ".join(missing_fields)}'
+
+    # Converte para float (proteção contra strings ou nulos)
+    try:
+        leitura = {field: float(data[field]) for field in _REQUIRED_FIELDS}
+    except (ValueError, TypeError):
+        return None, 'Todos os valores devem ser numéricos'
+
+    is_valid, error_msg = db.validate_sensor_data(leitura)
+    if not is_valid:
+        return None, f'Dados inválidos: {error_msg}'
+
+    if data.get('device_id') is not None:
+        leitura['device_id'] = str(data['device_id'])
+
+    # Id de deduplicação da outbox do produtor: um lote reenviado não é gravado de novo
+    if data.get('message_id') is not None:
+        leitura['message_id'] = str(data['message_id'])
+
+    # Timestamp da coleta (leituras guardadas enquanto o Pi estava offline)
+    if data.get('timestamp') is not None:
+        try:
+            timestamp = int(data['timestamp'])
+        except (ValueError, TypeError):
+            return None, 'timestamp deve ser um epoch em segundos'
+        if not 0 < timestamp <= time.time() + INGESTAO_HTTP['tolerancia_futuro_s']:
+            return None, f'timestamp fora do intervalo aceito: {timestamp}'
+        leitura['timestamp'] = timestamp
+
+    return leitura, None
+
+
+def _ler_lote():
+    """
+    Leituras do corpo de um POST /dados/batch: array JSON, {"leituras": [...]}
+    ou NDJSON (uma leitura por linha, Content-Type application/x-ndjson).
+    Retorna: lista de (dados, erro) - linhas NDJSON inválidas viram erro do item.
+    Levanta ValueError se o corpo inteiro for inválido.
+    """
+    if request.mimetype == _NDJSON_MIMETYPE:
+        itens = []
+        for linha in request.get_data(as_text=True).splitlines():
+            if not linha.strip():
+                continue
+            try:
+                itens.append((json.loads(linha), None))
+            except json.JSONDecodeError:
+                itens.append((None, 'Linha NDJSON inválida'))
+        return itens
+
+    if not request.is_json:
+        raise ValueError('Content-Type deve ser application/json ou application/x-ndjson')
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('leituras')
+    if not isinstance(data, list):
+        raise ValueError('Esperado um array de leituras (ou {"leituras": [...]})')
+    return [(item, None) for item in data]
 
 
 @sensor_bp.route('/dados', methods=['POST'])
@@ -20,7 +97,8 @@ def receber_dados():
         "temperatura": 29.5,
         "umidade_ar": 75.0,
         "umidade_solo": 40.0,
-        "luminosidade": 800.0
+        "luminosidade": 800.0,
+        "device_id": "arduino-01"   (opcional)
     }
     """
     try:
@@ -59,7 +137,8 @@ def receber_dados():
             temperatura=temperatura,
             umidade_ar=umidade_ar,
             umidade_solo=umidade_solo,
-            luminosidade=luminosidade
+            luminosidade=luminosidade,
+            device_id=data.get('device_id')
         )
         
         return jsonify({
@@ -85,7 +164,79 @@ def receber_dados():
         }), 500
 
 
+@sensor_bp.route('/dados/batch', methods=['POST'])
+def receber_lote():
+    """
+    Recebe várias leituras de uma vez (ex: o atraso de um Pi que ficou offline)
+    
+    Corpo: array JSON de leituras no formato de POST /dados (ou {"leituras": [...]}),
+    ou NDJSON com uma leitura por linha. Cada leitura pode trazer 'timestamp' (epoch)
+    e 'message_id' (id de deduplicação da outbox).
+    
+    Cada item é validado separadamente; os válidos são gravados em uma única
+    transação. 'resultados' traz, na ordem da entrada, o id ou o erro de cada item.
+    Um item com message_id já gravado (reenvio depois de um timeout) não é gravado de
+    novo: volta com o id existente e conta como inserido, para a outbox confirmar.
+    Status: 201 (todos gravados), 207 (parte rejeitada), 400 (nenhum gravado)
+    """
+    try:
+        try:
+            itens = _ler_lote()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if not itens:
+            return jsonify({'success': False, 'error': 'Lote vazio'}), 400
+        
+        if len(itens) > INGESTAO_HTTP['max_leituras_lote']:
+            return jsonify({
+                'success': False,
+                'error': f'Lote maior que o limite de {INGESTAO_HTTP["max_leituras_lote"]} leituras'
+            }), 413
+        
+        # Validação em lote: itens ruins são reportados sem impedir a gravação dos demais
+        resultados = []
+        validas = []
+        for indice, (data, erro) in enumerate(itens):
+            leitura = None
+            if erro is None:
+                leitura, erro = _validar_leitura(data)
+            if erro:
+                resultados.append({'indice': indice, 'error': erro})
+            else:
+                resultados.append({'indice': indice})
+                validas.append((indice, leitura))
+        
+        ids = db.insert_readings_bulk([leitura for _, leitura in validas])
+        for (indice, _), reading_id in zip(validas, ids):
+            resultados[indice]['id'] = reading_id
+        
+        rejeitados = len(itens) - len(ids)
+        if not ids:
+            status = 400
+        elif rejeitados:
+            status = 207
+        else:
+            status = 201
+        
+        return jsonify({
+            'success': bool(ids),
+            'inseridos': len(ids),
+            'rejeitados': rejeitados,
+            'resultados': resultados,
+            'timestamp': int(time.time())
+        }), status
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Erro interno do servidor',
+            'details': str(e)
+        }), 500
+
+
 @sensor_bp.route('/dados', methods=['GET'])
+@condicional_por_versao(db.get_data_version, HTTP_CACHE['max_age_historico'])
 def listar_dados():
     """
     Retorna leituras recentes (para o dashboard do Kaiki)
@@ -94,12 +245,20 @@ def listar_dados():
     - limit: quantidade de registros (padrão: 50)
     - start: timestamp inicial (filtro por período)
     - end: timestamp final (filtro por período)
+    - points: com start/end, retorna a série reduzida (rollups + LTTB) com ~points pontos
+    - device_id: só as leituras dessa placa
+    - formato: 'colunar' para um array por campo em 'data' (menor e comprime melhor)
+    - cursor: 'next_cursor' da resposta anterior, para a página seguinte (mais antiga)
     """
     try:
         # Parâmetros opcionais
         limit = request.args.get('limit', default=_DEFAULT_LIST_LIMIT, type=int)
         start_timestamp = request.args.get('start', type=int)
         end_timestamp = request.args.get('end', type=int)
+        points = request.args.get('points', type=int)
+        device_id = request.args.get('device_id')
+        colunar = request.args.get('formato') == 'colunar'
+        cursor = request.args.get('cursor')
         
         # Se tiver range de tempo
         if start_timestamp and end_timestamp:
@@ -109,21 +268,42 @@ def listar_dados():
                     'error': 'start deve ser menor que end'
                 }), 400
             
-            readings = db.get_readings_by_timerange(
+            if points:
+                resolucao, readings = get_downsampled_readings(
+                    db, start_timestamp, end_timestamp, points, device_id=device_id
+                )
+                return jsonify({
+                    'success': True,
+                    'count': len(readings),
+                    'resolucao': resolucao,
+                    'data': linhas_em_colunas(readings) if colunar else readings
+                }), 200
+            
+            readings, next_cursor = db.get_readings_page(
+                limit=limit,
+                cursor=cursor,
                 start_timestamp=start_timestamp,
                 end_timestamp=end_timestamp,
-                limit=limit
+                device_id=device_id
             )
         else:
             # Apenas leituras recentes
-            readings = db.get_recent_readings(limit=limit)
+            readings, next_cursor = db.get_readings_page(limit=limit, cursor=cursor, device_id=device_id)
         
         return jsonify({
             'success': True,
             'count': len(readings),
-            'data': readings
+            'data': linhas_em_colunas(readings) if colunar else readings,
+            'next_cursor': next_cursor
         }), 200
     
+    except ValueError as e:
+        # Cursor inválido
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -132,14 +312,51 @@ def listar_dados():
         }), 500
 
 
+@sensor_bp.route('/dados/export', methods=['GET'])
+def exportar_dados():
+    """
+    Exporta o histórico completo (sem o teto de max_records_query) como download
+    
+    Query params opcionais:
+    - formato: 'ndjson' (padrão), 'csv' ou 'parquet' (requer pyarrow)
+    - start / end: intervalo de tempo (epoch)
+    - device_id: só as leituras dessa placa
+    
+    A resposta é gerada em blocos direto do SQLite (memória constante).
+    """
+    formato = request.args.get('formato', 'ndjson')
+    start_timestamp = request.args.get('start', type=int)
+    end_timestamp = request.args.get('end', type=int)
+    device_id = request.args.get('device_id')
+    
+    try:
+        gerador = exportar_leituras(
+            db, formato, start_timestamp, end_timestamp, device_id,
+            chunk_size=EXPORTACAO['chunk_linhas']
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 501
+    
+    mimetype, extensao = FORMATOS[formato]
+    return Response(
+        stream_with_context(gerador),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=leituras_{int(time.time())}.{extensao}'}
+    )
+
+
 @sensor_bp.route('/dados/latest', methods=['GET'])
+@condicional_por_versao(db.get_data_version, HTTP_CACHE['max_age_tempo_real'])
 def ultima_leitura():
     """
     Retorna apenas a última leitura (otimizado para dashboards em tempo real)
     Mais rápido que /dados?limit=1
+    Query param opcional: device_id (última leitura dessa placa)
     """
     try:
-        readings = db.get_recent_readings(limit=1)
+        readings = db.get_recent_readings(limit=1, device_id=request.args.get('device_id'))
         
         if not readings:
             return jsonify({
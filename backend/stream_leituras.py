@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class ClienteStream:
+    """
+    Fila de eventos de uma conexão SSE.
+    O hub entrega (thread do pub/sub) e a thread da requisição consome.
+    """
+
+    def __init__(self, max_fila, politica, device_id=None):
+        self.max_fila = max_fila
+        self.politica = politica
+        self.device_id = device_id
+
+        self._eventos = deque()
+        self._cond = threading.Condition()
+        self.desconectado = False
+        self.descartados = 0
+
+    def entregar(self, frame):
+        """Enfileira um evento. Retorna False se o cliente foi desconectado por estar lento."""
+        with self._cond:
+            if self.desconectado:
+                return False
+            if len(self._eventos) >= self.max_fila:
+                if self.politica == 'desconectar':
+                    self.desconectado = True
+                    self._cond.notify()
+                    return False
+                self._eventos.popleft()
+                self.descartados += 1
+            self._eventos.append(frame)
+            self._cond.notify()
+            return True
+
+    def proximo(self, timeout):
+        """Próximo evento (bytes), None no timeout ou quando o cliente foi desconectado"""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while not self._eventos and not self.desconectado:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return None
+                self._cond.wait(restante)
+            if self.desconectado:
+                return None
+            return self._eventos.popleft()
+
+
+class HubEventos:
+    """
+    Distribui as análises publicadas pelos consumidores (pub/sub do Redis)
+    para todos os clientes SSE do processo.
+
+    Uma única assinatura por processo: cada evento é lido e formatado uma vez
+    e o mesmo frame vai para a fila de cada cliente.
+
+    Ids dos eventos: '<instância>-<seq>'. Um cliente que reconecta com o
+    Last-Event-ID desta instância e ainda coberto pelo histórico recebe o que
+    perdeu; caso contrário (API reiniciada, histórico estourado) precisa de um
+    snapshot do estado atual.
+    """
+
+    def __init__(self, redis_client, canal, historico=500, max_fila_cliente=100,
+                 politica='desconectar'):
+        self.redis_client = redis_client
+        self.canal = canal
+        self.max_fila_cliente = max_fila_cliente
+        self.politica = politica
+
+        self.instancia = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._historico = deque(maxlen=historico)  # (seq, device_id, frame)
+        self._clientes = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # Contadores para diagnóstico
+        self.eventos = 0
+        self.desconectados_por_lentidao = 0
+
+    def id_atual(self):
+        return f"{self.instancia}-{self._seq}"
+
+    def iniciar(self):
+        """Sobe a thread de assinatura (uma vez, na primeira conexão)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._escutar, name='stream-pubsub', daemon=True)
+                self._thread.start()
+
+    def _escutar(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.canal)
+                print(f"INFO: Stream ao vivo assinando '{self.canal}'.")
+                for mensagem in pubsub.listen():
+                    self.publicar(mensagem['data'])
+            except Exception as e:
+                print(f"ERRO na assinatura do stream ao vivo: {e}. Tentando de novo em 5s...")
+                time.sleep(5)
+
+    def publicar(self, dados_json):
+        """Formata o evento uma vez e entrega a todos os clientes conectados"""
+        try:
+            device_id = json.loads(dados_json).get('device_id')
+        except (ValueError, AttributeError):
+            print(f"ERRO: Evento inválido no canal do stream: {dados_json!r}")
+            return
+
+        with self._lock:
+            self._seq += 1
+            frame = f"id: {self.id_atual()}\nevent: leitura\ndata: {dados_json}\n\n".encode('utf-8')
+            self._historico.append((self._seq, device_id, frame))
+            self.eventos += 1
+
+            for cliente in list(self._clientes):
+                if cliente.device_id is not None and cliente.device_id != device_id:
+                    continue
+                if not cliente.entregar(frame):
+                    self._clientes.discard(cliente)
+                    self.desconectados_por_lentidao += 1
+
+    def conectar(self, last_event_id=None, device_id=None):
+        """
+        Registra um cliente, já com os eventos perdidos desde 'last_event_id'.
+        Retorna: (cliente, id do snapshot) - o id é None se a retomada pelo histórico
+        bastou; senão, quem chama envia o estado atual com esse id antes dos eventos.
+        """
+        self.iniciar()
+        cliente = ClienteStream(self.max_fila_cliente, self.politica, device_id)
+
+        with self._lock:
+            ultimo_seq = self._seq_de(last_event_id)
+            primeiro_guardado = self._historico[0][0] if self._historico else self._seq + 1
+
+            # Retoma pelo histórico se ele cobre a lacuna e ela cabe na fila do cliente
+            if (ultimo_seq is not None and ultimo_seq >= primeiro_guardado - 1
+                    and self._seq - ultimo_seq <= self.max_fila_cliente):
+                for seq, device, frame in self._historico:
+                    if seq > ultimo_seq and (device_id is None or device == device_id):
+                        cliente.entregar(frame)
+                snapshot_id = None
+            else:
+                snapshot_id = self.id_atual()
+
+            self._clientes.add(cliente)
+        return cliente, snapshot_id
+
+    def _seq_de(self, last_event_id):
+        """Seq do Last-Event-ID se ele for desta instância (e não do futuro), senão None"""
+        if not last_event_id:
+            return None
+        instancia, _, seq = last_event_id.rpartition('-')
+        if instancia != self.instancia or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        return int(seq)
+
+    def desconectar(self, cliente):
+        with self._lock:
+            self._clientes.discard(cliente)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clientes': len(self._clientes),
+                'eventos': self.eventos,
+                'ultimo_id': self.id_atual(),
+                'desconectados_por_lentidao': self.desconectados_por_lentidao
+            }
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Os módulos do backend se importam pelo nome (como quando rodam de dentro de backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py abre o SQLite no diretório atual ao ser importado: os testes usam um banco descartável
+os.chdir(tempfile.mkdtemp(prefix='agtech_testes_'))
@@ -0,0 +1,39 @@
+import asyncio
+import json
+import time
+
+from async_consumers import Metricas, _gravar_lote
+
+
+class MensagemFalsa:
+    """Entrega do aio-pika só com o que a persistência usa (corpo, propriedades e ACK)"""
+
+    def __init__(self, leituras, message_id):
+        self.body = json.dumps(leituras if len(leituras) > 1 else leituras[0]).encode()
+        self.content_type = None
+        self.message_id = message_id
+        self.acks = []
+
+    async def ack(self, multiple=False):
+        self.acks.append(multiple)
+
+
+def _leitura(device_id, timestamp):
+    return {
+        'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+        'device_id': device_id, 'timestamp': timestamp
+    }
+
+
+def test_metricas_contam_mensagens_e_leituras_separadamente():
+    agora = int(time.time())
+    lote = [
+        MensagemFalsa([_leitura('placa-async', agora - i) for i in range(3)], 'produtor-async-1'),
+        MensagemFalsa([_leitura('placa-async', agora - 3)], 'produtor-async-4'),
+    ]
+    metricas = Metricas('persistencia')
+
+    asyncio.run(_gravar_lote(lote, metricas))
+
+    assert (metricas.mensagens, metricas.leituras) == (2, 4)
+    assert lote[-1].acks == [True]
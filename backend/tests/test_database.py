@@ -0,0 +1,148 @@
+import time
+
+from database import db
+
+
+def _inserir(device_id, timestamps):
+    return db.insert_readings_bulk([
+        {'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+         'device_id': device_id, 'timestamp': timestamp}
+        for timestamp in timestamps
+    ])
+
+
+def _conexoes_de_leitura_em_uso():
+    pool = db._reader_pool
+    return pool._created - pool._idle.qsize()
+
+
+def test_iter_readings_percorre_tudo_em_ordem_cronologica():
+    agora = int(time.time())
+    # Vários no mesmo segundo: a posição do keyset precisa desempatar pelo id
+    timestamps = [agora - 500 + i // 4 for i in range(103)]
+    ids = _inserir('placa-export', timestamps)
+
+    blocos = list(db.iter_readings(device_id='placa-export', chunk_size=10))
+
+    assert [len(bloco) for bloco in blocos] == [10] * 10 + [3]
+    lidas = [(row['timestamp'], row['id']) for bloco in blocos for row in bloco]
+    assert lidas == sorted(zip(timestamps, ids))
+
+
+def test_iter_readings_devolve_a_conexao_entre_blocos():
+    agora = int(time.time())
+    _inserir('placa-lenta', [agora - 100 + i for i in range(30)])
+
+    blocos = db.iter_readings(device_id='placa-lenta', chunk_size=10)
+    next(blocos)
+
+    # Cliente lento parado no meio do download: nenhum leitor do pool fica preso
+    assert _conexoes_de_leitura_em_uso() == 0
+    assert sum(len(bloco) for bloco in blocos) == 20
+
+
+def _banco_particionado(monkeypatch, tmp_path):
+    import database
+    monkeypatch.setitem(database.DATABASE, 'path', str(tmp_path / 'principal.db'))
+    monkeypatch.setitem(database.PARTICIONAMENTO, 'enabled', True)
+    monkeypatch.setitem(database.PARTICIONAMENTO, 'diretorio', str(tmp_path / 'particoes'))
+    return database.Database()
+
+
+def test_reinicio_reconcilia_o_main_com_as_particoes(monkeypatch, tmp_path):
+    banco = _banco_particionado(monkeypatch, tmp_path)
+    agora = int(time.time())
+    ids = banco.insert_readings_bulk([
+        {'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+         'device_id': 'placa-part', 'timestamp': agora - 300 + i}
+        for i in range(50)
+    ])
+
+    # Queda entre os commits: rollups de um lote que não chegou à partição, e a
+    # reserva de ids perdida
+    with banco.get_connection() as conn:
+        conn.execute('UPDATE leituras_1m SET total = total * 2')
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'leituras'")
+
+    banco = _banco_particionado(monkeypatch, tmp_path)
+    with banco.get_read_connection() as conn:
+        assert conn.execute('SELECT SUM(total) FROM leituras_1m').fetchone()[0] == 50
+
+    novo_id, = banco.insert_readings_bulk([
+        {'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+         'device_id': 'placa-part', 'timestamp': agora}
+    ])
+    assert novo_id > max(ids)
+
+
+def _com_message_id(device_id, timestamp, message_id):
+    return {'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+            'device_id': device_id, 'timestamp': timestamp, 'message_id': message_id}
+
+
+def _verificar_reenvio_sem_duplicar(banco, device_id):
+    agora = int(time.time())
+    primeiros = banco.insert_readings_bulk([
+        _com_message_id(device_id, agora - 20, 'produtor-1'),
+        _com_message_id(device_id, agora - 10, 'produtor-2'),
+    ])
+
+    # Reenvio do lote (commit sem confirmação), uma leitura nova e uma repetida no próprio lote
+    ids = banco.insert_readings_bulk([
+        _com_message_id(device_id, agora - 20, 'produtor-1'),
+        _com_message_id(device_id, agora - 10, 'produtor-2'),
+        _com_message_id(device_id, agora, 'produtor-3'),
+        _com_message_id(device_id, agora, 'produtor-3'),
+    ])
+
+    assert ids[:2] == primeiros
+    assert ids[2] == ids[3] and ids[2] not in primeiros
+    leituras, _ = banco.get_readings_page(device_id=device_id)
+    assert sorted(leitura['id'] for leitura in leituras) == sorted(primeiros + ids[2:3])
+
+
+def test_reenvio_com_message_id_nao_duplica_leituras():
+    _verificar_reenvio_sem_duplicar(db, 'placa-reenvio')
+
+
+def test_reenvio_com_message_id_nao_duplica_leituras_particionado(monkeypatch, tmp_path):
+    _verificar_reenvio_sem_duplicar(_banco_particionado(monkeypatch, tmp_path), 'placa-reenvio-part')
+
+
+def _leituras_alternadas(inicio, quantidade):
+    # Duas placas com níveis diferentes, uma leitura a cada 10s alternando entre elas
+    return [
+        {'temperatura': 20.0 if i % 2 else 30.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0,
+         'luminosidade': 400.0, 'device_id': 'placa-frota-b' if i % 2 else 'placa-frota-a',
+         'timestamp': inicio + i * 10}
+        for i in range(quantidade)
+    ]
+
+
+def test_intervalo_curto_da_frota_nao_intercala_placas():
+    inicio = (int(time.time()) // 86400 - 45) * 86400
+    db.insert_readings_bulk(_leituras_alternadas(inicio, 180))
+
+    resolucao, rows = db.get_aggregated_readings(inicio, inicio + 1800, 100)
+
+    # Uma linha por minuto com a média das duas placas, em vez de um serrote 20/30
+    assert resolucao == '1m'
+    assert len(rows) == 30
+    assert {row['temperatura'] for row in rows} == {25.0}
+
+    resolucao, rows = db.get_aggregated_readings(inicio, inicio + 1800, 100, device_id='placa-frota-a')
+    assert resolucao == 'raw'
+    assert len(rows) == 90 and {row['temperatura'] for row in rows} == {30.0}
+
+
+def test_intervalo_curto_com_brutas_demais_nao_perde_o_comeco(monkeypatch):
+    import database
+    inicio = (int(time.time()) // 86400 - 46) * 86400
+    db.insert_readings_bulk(_leituras_alternadas(inicio, 180))
+    monkeypatch.setitem(database.DATA_LIMITS, 'max_raw_range_query', 50)
+
+    resolucao, rows = db.get_aggregated_readings(inicio, inicio + 1800, 100, device_id='placa-frota-a')
+
+    assert resolucao == '1m'
+    assert min(row['timestamp'] for row in rows) == inicio
+    assert sum(row['total'] for row in rows) == 90
@@ -0,0 +1,74 @@
+import math
+import time
+
+from downsampling import downsample_rows
+
+
+def _serie(n):
+    # Sensores com formas diferentes: o LTTB de cada um escolhe linhas diferentes
+    return [
+        {
+            'timestamp': 1_700_000_000 + i * 60,
+            'temperatura': 20 + 5 * math.sin(i / 7),
+            'umidade_ar': 60 + 10 * math.cos(i / 3),
+            'umidade_solo': 500 + (i % 17) * 3,
+            'luminosidade': 800 if i % 50 < 25 else 200
+        }
+        for i in range(n)
+    ]
+
+
+def test_resultado_nao_passa_de_points():
+    rows = _serie(5000)
+    for points in (3, 4, 10, 100, 500):
+        resultado = downsample_rows(rows, points)
+        assert len(resultado) <= points
+
+
+def test_mantem_ordem_original_e_extremos():
+    rows = list(reversed(_serie(2000)))  # como as queries: mais recentes primeiro
+    resultado = downsample_rows(rows, 200)
+
+    assert resultado == [row for row in rows if row in resultado]
+    assert rows[0] in resultado and rows[-1] in resultado
+
+
+def test_serie_curta_volta_inteira():
+    rows = _serie(50)
+    assert downsample_rows(rows, 100) == rows
+
+
+def _pico_sobrevive(device_id, horas, intervalo_s, ciclo_s, points, resolucao_esperada):
+    from database import db
+    from downsampling import get_downsampled_readings
+
+    fim = (int(time.time()) // 86400 - 1) * 86400
+    inicio = fim - horas * 3600
+    timestamps = list(range(inicio, fim, intervalo_s))
+    # Na subida do ciclo: a média do bucket do pico não é vale nem crista da série
+    pico = timestamps[int(len(timestamps) * 0.4)]
+    db.insert_readings_bulk([
+        {
+            'temperatura': 39.5 if ts == pico else 22 + 6 * math.sin(2 * math.pi * (ts - inicio) / ciclo_s),
+            'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+            'device_id': device_id, 'timestamp': ts
+        }
+        for ts in timestamps
+    ])
+
+    resolucao, rows = get_downsampled_readings(db, inicio, fim, points, device_id=device_id)
+
+    assert resolucao == resolucao_esperada
+    assert len(rows) <= points
+    # Uma leitura só, diluída na média do bucket, continua no _max da série reduzida
+    assert max(row['temperatura_max'] for row in rows) == 39.5
+
+
+def test_pico_de_uma_leitura_sobrevive_no_rollup_1h():
+    _pico_sobrevive('placa-pico-1h', horas=48, intervalo_s=60, ciclo_s=12 * 3600,
+                    points=10, resolucao_esperada='1h')
+
+
+def test_pico_de_uma_leitura_sobrevive_no_rollup_1d():
+    _pico_sobrevive('placa-pico-1d', horas=30 * 24, intervalo_s=600, ciclo_s=7 * 86400,
+                    points=10, resolucao_esperada='1d')
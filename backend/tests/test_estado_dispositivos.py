@@ -0,0 +1,63 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')  # Lua do fakeredis (EVAL)
+
+from config import REDIS_LATEST_DATA_KEY, REDIS_RISK_KEY
+from estado_dispositivos import enfileirar_estados, ler_estado, ler_frota
+
+
+def _resultado(device_id, timestamp, risco_maximo, nivel_geral):
+    return {
+        'timestamp': timestamp,
+        'device_id': device_id,
+        'dados_brutos': {'temperatura': 25.0},
+        'riscos_detalhados': {},
+        'risco_maximo': risco_maximo,
+        'nivel_geral': nivel_geral
+    }
+
+
+def _gravar(redis_client, resultados):
+    with redis_client.pipeline() as pipe:
+        enfileirar_estados(pipe, resultados)
+        return pipe.execute()[0]
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_leitura_antiga_que_termina_depois_nao_sobrescreve(redis_client):
+    nova = _resultado('placa-1', 1_700_000_100, 80.0, 'ALTO')
+    antiga = _resultado('placa-1', 1_700_000_000, 10.0, 'BAIXO')
+
+    # Dois workers: o da leitura mais nova grava primeiro
+    assert _gravar(redis_client, [nova]) == 1
+    assert _gravar(redis_client, [antiga]) == 0
+
+    assert ler_estado(redis_client, 'placa-1')['timestamp'] == nova['timestamp']
+    assert ler_estado(redis_client)['timestamp'] == nova['timestamp']
+    assert redis_client.get(REDIS_RISK_KEY) == 'ALTO'
+
+    ranking, _ = ler_frota(redis_client)
+    assert ranking[0]['risco_maximo'] == 80.0
+
+
+def test_chave_global_fica_com_a_leitura_mais_recente_da_frota(redis_client):
+    _gravar(redis_client, [_resultado('placa-1', 1_700_000_100, 80.0, 'ALTO')])
+    _gravar(redis_client, [_resultado('placa-2', 1_700_000_050, 20.0, 'BAIXO')])
+
+    # O estado da placa-2 é gravado, mas a chave global continua na leitura mais nova
+    assert ler_estado(redis_client, 'placa-2')['risco_maximo'] == 20.0
+    assert ler_estado(redis_client)['device_id'] == 'placa-1'
+    assert redis_client.get(REDIS_RISK_KEY) == 'ALTO'
+
+
+def test_leitura_mais_nova_atualiza(redis_client):
+    _gravar(redis_client, [_resultado('placa-1', 1_700_000_000, 10.0, 'BAIXO')])
+    _gravar(redis_client, [_resultado('placa-1', 1_700_000_100, 60.0, 'MODERADO')])
+
+    assert ler_estado(redis_client, 'placa-1')['nivel_geral'] == 'MODERADO'
+    assert redis_client.exists(REDIS_LATEST_DATA_KEY)
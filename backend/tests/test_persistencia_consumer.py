@@ -0,0 +1,106 @@
+import json
+import time
+from types import SimpleNamespace
+
+from persistencia_consumer import LotePersistencia, _persistir_mensagem, ids_persistidos
+from database import db
+
+
+class CanalFalso:
+    """Canal do pika só com o que o consumidor usa (ACK/reject e timers)"""
+
+    def __init__(self):
+        self.acks = []
+        self.rejeitadas = []
+        self.connection = SimpleNamespace(
+            call_later=lambda atraso, funcao: object(),
+            remove_timeout=lambda timer: None
+        )
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+
+    def basic_reject(self, delivery_tag, requeue):
+        self.rejeitadas.append(delivery_tag)
+
+
+def _leitura(device_id, timestamp):
+    return {
+        'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+        'device_id': device_id, 'timestamp': timestamp
+    }
+
+
+def _timestamps_gravados(device_id):
+    return [leitura['timestamp'] for leitura in db.get_readings_page(device_id=device_id)[0]]
+
+
+def test_mensagem_atrasada_mantem_o_timestamp_da_coleta():
+    # Leitura de 3 dias atrás reenviada pela outbox depois de uma queda do broker
+    coletada_em = int(time.time()) - 3 * 86400
+    canal = CanalFalso()
+
+    _persistir_mensagem(canal, 1, json.dumps(_leitura('placa-atrasada', coletada_em)).encode())
+
+    assert canal.acks == [1]
+    assert _timestamps_gravados('placa-atrasada') == [coletada_em]
+
+
+def test_lote_mantem_o_timestamp_de_cada_leitura():
+    agora = int(time.time())
+    coletadas = [agora - 7200, agora - 3600]
+    canal = CanalFalso()
+    lote = LotePersistencia(canal, max_messages=1, max_wait_ms=1000)
+
+    corpo = json.dumps([_leitura('placa-lote', ts) for ts in coletadas]).encode()
+    lote.callback(canal, SimpleNamespace(delivery_tag=7), None, corpo)
+
+    assert canal.acks == [7]
+    assert sorted(_timestamps_gravados('placa-lote')) == coletadas
+
+
+def test_sem_timestamp_usa_o_horario_de_chegada():
+    antes = int(time.time())
+    _persistir_mensagem(CanalFalso(), 1, json.dumps(_leitura('placa-sem-ts', None)).encode())
+
+    assert _timestamps_gravados('placa-sem-ts')[0] >= antes
+
+
+def test_timestamp_invalido_e_descartado():
+    canal = CanalFalso()
+    _persistir_mensagem(canal, 3, json.dumps(_leitura('placa-ts-invalido', 'ontem')).encode())
+
+    assert canal.acks == [3]
+    assert _timestamps_gravados('placa-ts-invalido') == []
+
+
+def _propriedades(message_id):
+    return SimpleNamespace(message_id=message_id, content_type=None)
+
+
+def test_reenvio_depois_de_reiniciar_nao_duplica():
+    agora = int(time.time())
+    corpo = json.dumps(_leitura('placa-requeue', agora)).encode()
+    canal = CanalFalso()
+
+    _persistir_mensagem(canal, 1, corpo, _propriedades('produtor-a-10'))
+    # Queda entre o commit e o ACK: o processo volta sem o filtro em memória
+    ids_persistidos._ids.clear()
+    _persistir_mensagem(canal, 2, corpo, _propriedades('produtor-a-10'))
+
+    assert canal.acks == [1, 2]
+    assert _timestamps_gravados('placa-requeue') == [agora]
+
+
+def test_reenvio_pendente_no_mesmo_lote_nao_duplica():
+    agora = int(time.time())
+    corpo = json.dumps(_leitura('placa-pendente', agora)).encode()
+    canal = CanalFalso()
+    lote = LotePersistencia(canal, max_messages=2, max_wait_ms=1000)
+
+    # A cópia reenviada chega antes de a primeira ser descarregada
+    lote.callback(canal, SimpleNamespace(delivery_tag=1), _propriedades('produtor-b-4'), corpo)
+    lote.callback(canal, SimpleNamespace(delivery_tag=2), _propriedades('produtor-b-4'), corpo)
+
+    assert canal.acks == [2]
+    assert _timestamps_gravados('placa-pendente') == [agora]
@@ -0,0 +1,47 @@
+import time
+
+from app import app
+from database import db
+
+
+def _lote(device_id, timestamps, produtor):
+    return [
+        {'temperatura': 25.0, 'umidade_ar': 60.0, 'umidade_solo': 500.0, 'luminosidade': 400.0,
+         'device_id': device_id, 'timestamp': timestamp, 'message_id': f'{produtor}-{seq}'}
+        for seq, timestamp in enumerate(timestamps, start=1)
+    ]
+
+
+def test_lote_reenviado_apos_timeout_nao_duplica():
+    cliente = app.test_client()
+    agora = int(time.time())
+    lote = _lote('placa-http', [agora - 20, agora - 10], 'uploader')
+
+    primeira = cliente.post('/dados/batch', json=lote)
+    # A resposta se perdeu (timeout do cliente): a outbox manda o mesmo lote de novo
+    segunda = cliente.post('/dados/batch', json=lote)
+
+    assert primeira.status_code == segunda.status_code == 201
+    assert segunda.get_json()['inseridos'] == 2
+    ids = [resultado['id'] for resultado in primeira.get_json()['resultados']]
+    assert [resultado['id'] for resultado in segunda.get_json()['resultados']] == ids
+    assert len(db.get_readings_page(device_id='placa-http')[0]) == 2
+
+
+def test_leitura_antiga_reenviada_invalida_o_if_modified_since():
+    cliente = app.test_client()
+    agora = int(time.time())
+    cliente.post('/dados/batch', json=_lote('placa-lm', [agora], 'lm'))
+    # O Last-Modified só sai depois que o segundo da última escrita passou
+    time.sleep(1.1)
+
+    primeira = cliente.get('/dados?device_id=placa-lm')
+    ultima_modificacao = primeira.headers['Last-Modified']
+    assert cliente.get('/dados?device_id=placa-lm', headers={'If-Modified-Since': ultima_modificacao}).status_code == 304
+
+    # Reenvio da outbox: leitura coletada antes da última já gravada
+    cliente.post('/dados/batch', json=_lote('placa-lm', [agora - 3600], 'lm-atrasada'))
+
+    segunda = cliente.get('/dados?device_id=placa-lm', headers={'If-Modified-Since': ultima_modificacao})
+    assert segunda.status_code == 200
+    assert any(leitura['timestamp'] == agora - 3600 for leitura in segunda.get_json()['data'])
@@ -0,0 +1,196 @@
+import json
+import struct
+
+# ==========================================================
+# Formato das mensagens de leitura (produtores -> consumidores)
+# ==========================================================
+# O formato é negociado pelo 'content_type' da mensagem AMQP.
+# Mensagens sem content_type (produtores antigos) são tratadas como JSON.
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_BINARIO = 'application/x-agtech-leitura'
+CONTENT_TYPE_BINARIO_LOTE = 'application/x-agtech-lote'
+
+# Versão 1 (little-endian, 18 bytes):
+#   B  versão do layout
+#   B  flags (bit 0: leitura_id presente)
+#   I  timestamp (epoch, segundos)
+#   h  temperatura x 100 (°C)
+#   H  umidade_ar x 100 (%)
+#   H  umidade_solo (ADC)
+#   H  luminosidade (ADC)
+#   I  leitura_id (0 se ausente)
+#
+# Versão 2 (leituras com device_id): o registro v1 (com versão = 2)
+# seguido de B tamanho + device_id em UTF-8 (até 255 bytes).
+VERSAO_BINARIO = 1
+VERSAO_BINARIO_DEVICE = 2
+_LAYOUT_V1 = struct.Struct('<BBIhHHHI')
+_FLAG_LEITURA_ID = 0x01
+
+# Campos que cabem no layout; leituras com qualquer outro campo vão em JSON (nada se perde)
+_CAMPOS_BINARIO = {
+    'leitura_id', 'timestamp', 'temperatura', 'umidade_ar', 'umidade_solo', 'luminosidade', 'device_id'
+}
+
+# Lote (várias leituras em uma mensagem): cabeçalho B versão + H quantidade,
+# seguido de 'quantidade' registros (v1 ou v2).
+# Em JSON, o lote é uma lista de leituras.
+_CABECALHO_LOTE = struct.Struct('<BH')
+MAX_LEITURAS_LOTE = 0xFFFF
+
+
+class WireFormatError(ValueError):
+    """Mensagem binária inválida (tratada como 'poison message' pelos consumidores)."""
+
+
+def codificar_leitura(dados, formato='binary'):
+    """
+    Serializa uma leitura para publicação.
+    Com formato 'binary', cai para JSON se algum campo não couber no layout
+    (ex: valor fora da faixa ou campo ausente).
+    Retorna: (body, content_type)
+    """
+    if formato == 'binary' and _CAMPOS_BINARIO.issuperset(dados):
+        try:
+            leitura_id = dados.get('leitura_id')
+            device_id = dados.get('device_id')
+            device_bytes = device_id.encode('utf-8') if device_id is not None else b''
+            if len(device_bytes) > 0xFF:
+                raise ValueError("device_id longo demais para o layout binário")
+
+            body = _LAYOUT_V1.pack(
+                VERSAO_BINARIO_DEVICE if device_id is not None else VERSAO_BINARIO,
+                _FLAG_LEITURA_ID if leitura_id is not None else 0,
+                int(dados['timestamp']),
+                round(float(dados['temperatura']) * 100),
+                round(float(dados['umidade_ar']) * 100),
+                round(float(dados['umidade_solo'])),
+                round(float(dados['luminosidade'])),
+                int(leitura_id or 0)
+            )
+            if device_id is not None:
+                body += bytes([len(device_bytes)]) + device_bytes
+            return body, CONTENT_TYPE_BINARIO
+        except (KeyError, TypeError, ValueError, AttributeError, struct.error):
+            pass
+
+    return json.dumps(dados).encode('utf-8'), CONTENT_TYPE_JSON
+
+
+def codificar_lote(leituras, formato='binary'):
+    """
+    Serializa várias leituras em uma única mensagem (uma confirmação do broker por lote).
+    Com uma leitura só, usa o formato de leitura individual.
+    Retorna: (body, content_type)
+    """
+    if len(leituras) == 1:
+        return codificar_leitura(leituras[0], formato)
+    if len(leituras) > MAX_LEITURAS_LOTE:
+        raise ValueError(f"Lote com {len(leituras)} leituras (máximo {MAX_LEITURAS_LOTE})")
+
+    if formato == 'binary':
+        registros = [codificar_leitura(dados, formato) for dados in leituras]
+        if all(content_type == CONTENT_TYPE_BINARIO for _, content_type in registros):
+            cabecalho = _CABECALHO_LOTE.pack(VERSAO_BINARIO, len(registros))
+            return cabecalho + b''.join(body for body, _ in registros), CONTENT_TYPE_BINARIO_LOTE
+
+    return json.dumps(list(leituras)).encode('utf-8'), CONTENT_TYPE_JSON
+
+
+def decodificar_leitura(body, content_type=None):
+    """
+    Converte o corpo da mensagem de volta para o dict da leitura.
+    Levanta json.JSONDecodeError (JSON) ou WireFormatError (binário) se o corpo for inválido.
+    """
+    if content_type != CONTENT_TYPE_BINARIO:
+        return json.loads(body.decode('utf-8') if isinstance(body, bytes) else body)
+
+    dados, fim = _ler_registro(body, 0)
+    if fim != len(body):
+        raise WireFormatError(f"Mensagem binária inválida ({len(body)} bytes, {len(body) - fim} sobrando)")
+    return dados
+
+
+def decodificar_leituras(body, content_type=None):
+    """
+    Como decodificar_leitura, mas sempre retorna uma lista
+    (1 item para mensagens individuais, N para lotes).
+    """
+    if content_type == CONTENT_TYPE_BINARIO_LOTE:
+        if len(body) < _CABECALHO_LOTE.size:
+            raise WireFormatError(f"Lote binário inválido ({len(body)} bytes)")
+        versao, quantidade = _CABECALHO_LOTE.unpack_from(body)
+        if versao != VERSAO_BINARIO:
+            raise WireFormatError(f"Lote binário inválido (versão {versao})")
+
+        # Registros têm tamanho variável (v2 traz o device_id): lidos em sequência
+        leituras = []
+        posicao = _CABECALHO_LOTE.size
+        for _ in range(quantidade):
+            dados, posicao = _ler_registro(body, posicao)
+            leituras.append(dados)
+        if posicao != len(body):
+            raise WireFormatError(
+                f"Lote binário inválido ({len(body)} bytes, {quantidade} leituras, {len(body) - posicao} sobrando)"
+            )
+        return leituras
+
+    dados = decodificar_leitura(body, content_type)
+    return dados if isinstance(dados, list) else [dados]
+
+
+def ids_do_lote(message_id, quantidade):
+    """
+    Ids de deduplicação de cada leitura de um lote.
+    O message_id de um lote é o da primeira leitura ('<produtor>-<seq>') e as
+    seguintes têm seqs consecutivos (a outbox só junta seqs contíguos).
+    """
+    if message_id is None:
+        return [None] * quantidade
+    if quantidade == 1:
+        return [message_id]
+
+    produtor, _, seq = message_id.rpartition('-')
+    if not produtor or not seq.isdigit():
+        return [None] * quantidade
+    return [f"{produtor}-{int(seq) + i}" for i in range(quantidade)]
+
+
+def _ler_registro(body, posicao):
+    """Lê um registro (v1 ou v2) a partir de 'posicao'. Retorna: (dados, posição seguinte)"""
+    fim = posicao + _LAYOUT_V1.size
+    if len(body) < fim:
+        raise WireFormatError(f"Registro binário truncado ({len(body) - posicao} bytes)")
+
+    versao = body[posicao]
+    if versao not in (VERSAO_BINARIO, VERSAO_BINARIO_DEVICE):
+        raise WireFormatError(f"Mensagem binária inválida (versão {versao})")
+
+    dados = _registro_para_dict(body[posicao:fim])
+    if versao == VERSAO_BINARIO_DEVICE:
+        if len(body) <= fim:
+            raise WireFormatError("Registro binário truncado (sem device_id)")
+        tamanho = body[fim]
+        device_bytes = bytes(body[fim + 1:fim + 1 + tamanho])
+        if len(device_bytes) != tamanho:
+            raise WireFormatError("Registro binário truncado (device_id incompleto)")
+        dados['device_id'] = device_bytes.decode('utf-8', errors='replace')
+        fim += 1 + tamanho
+    return dados, fim
+
+
+def _registro_para_dict(registro):
+    _, flags, timestamp, temp, umid_ar, umid_solo, luz, leitura_id = _LAYOUT_V1.unpack(registro)
+
+    dados = {}
+    if flags & _FLAG_LEITURA_ID:
+        dados['leitura_id'] = leitura_id
+    dados.update({
+        'timestamp': timestamp,
+        'temperatura': temp / 100,
+        'umidade_ar': umid_ar / 100,
+        'umidade_solo': umid_solo,
+        'luminosidade': luz,
+    })
+    return dados
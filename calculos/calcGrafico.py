@@ -1,5 +1,11 @@
+import os
+import sys
 import time
 
+# Adiciona a pasta raiz ao path para importar o motor de risco do backend
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend.risk_engine import RiskEngine
+
 # Regras de Risco para a cultura de Soja (baseado no seu calcGrafico.py)
 PRAGAS_SOJA_REGRAS = {
     "Lagarta-da-soja": {"temp": (22, 34), "umidade": (60, 90), "solo": (300, 700), "luz": (0, 600)},
@@ -16,6 +22,9 @@ _SENSOR_RULE_MAP = {
     "luz": "luminosidade"
 }
 
+# Regras compiladas em matrizes NumPy (uma vez só)
+_RISK_ENGINE = RiskEngine(PRAGAS_SOJA_REGRAS, _SENSOR_RULE_MAP)
+
 # Constantes para os níveis de risco
 _RISK_HIGH_THRESHOLD = 75
 _RISK_MODERATE_THRESHOLD = 40
@@ -46,36 +55,9 @@ def calcular_risco(dados: dict) -> dict:
         # Falha na conversão (ex: float(None) ou float("abc"))
         return {"error": "Dados de sensor inválidos para cálculo"}
 
-    riscos = {}
-    
-    for nome, cond in PRAGAS_SOJA_REGRAS.items():
-        pontos = 0
-        total_regras = len(cond)
-        
-        if total_regras == 0:
-            riscos[nome] = 0.0
-            continue
-            
-        # Itera sobre as regras (ex: "temp", "umidade")
-        for regra_key, (min_val, max_val) in cond.items():
-            
-            # Encontra a chave de dados correspondente (ex: "temperatura")
-            sensor_key = _SENSOR_RULE_MAP.get(regra_key)
-            
-            # Se a regra não tiver mapeamento, pula
-            if not sensor_key:
-                continue
-                
-            # Obtém o valor já validado
-            valor_sensor = dados_limpos[sensor_key]
-            
-            if min_val <= valor_sensor <= max_val:
-                pontos += 1
-        
-        # Risco é a média de pontos (ex: 3/4 = 75%)
-        riscos[nome] = round((pontos / total_regras) * 100, 1)
-        
-    return riscos
+    # Risco é a média de pontos (ex: 3/4 = 75%), calculado pelo motor vetorizado
+    leitura = _RISK_ENGINE.to_array([dados_limpos])
+    return _RISK_ENGINE.to_dicts(_RISK_ENGINE.score_binary(leitura), casas=1)[0]
 
 def determinar_nivel_geral(riscos: dict) -> str:
     """Determina o nível de risco geral com base no risco máximo."""
@@ -1,6 +1,6 @@
 "use client"
 
-import { fetchSensorData } from "@/lib/api" 
+import { fetchSensorData, subscribeSensorData } from "@/lib/api" 
 import { SensorData } from "@/lib/api"
 import { useEffect, useState } from "react"
 import SensorDataCard from "@/components/sensor-data-card"
@@ -29,6 +29,9 @@ export default function SensorsSidebar() {
     }
 
     loadSensorData()
+
+    // Atualizações seguintes chegam por push (SSE), sem polling
+    return subscribeSensorData(setData)
   }, []) 
 
   return (
@@ -46,11 +46,45 @@ export async function fetchSensorData(): Promise<SensorData> {
   }
 }
 
+// Recebe as leituras em tempo real via SSE (/api/stream) em vez de fazer polling.
+// O EventSource reconecta sozinho e retoma do último evento (Last-Event-ID).
+// Retorna a função que encerra a assinatura.
+export function subscribeSensorData(
+  onData: (data: SensorData) => void
+): () => void {
+  const source = new EventSource(`${API_BASE_URL}/stream`);
+
+  source.addEventListener("leitura", (event) => {
+    const data = JSON.parse((event as MessageEvent).data);
+    onData(data.dados_brutos);
+  });
+
+  // Snapshot (ao conectar): estado atual de cada dispositivo
+  source.addEventListener("snapshot", (event) => {
+    const estados = Object.values(JSON.parse((event as MessageEvent).data)) as any[];
+    if (estados.length === 0) return;
+    const maisRecente = estados.reduce((a, b) => (b.timestamp > a.timestamp ? b : a));
+    onData(maisRecente.dados_brutos);
+  });
+
+  source.onerror = (error) => {
+    console.error("Erro no stream (subscribeSensorData):", error);
+  };
+
+  return () => source.close();
+}
+
 export async function fetchHistoricalData(
-  hours = 24
+  hours = 24,
+  points = 200
 ): Promise<HistoricalData[]> {
   try {
-    const response = await fetch(`${API_BASE_URL}/historical/${hours}`);
+    // O backend reduz a série (rollups + LTTB) para ~points pontos, qualquer que seja o período
+    const end = Math.floor(Date.now() / 1000);
+    const start = end - hours * 3600;
+    const response = await fetch(
+      `${API_BASE_URL}/historical/${points}?start=${start}&end=${end}&points=${points}`
+    );
     if (!response.ok) throw new Error("Erro ao buscar dados históricos");
     const data = await response.json();
 
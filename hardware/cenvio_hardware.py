@@ -4,11 +4,24 @@ import sys
 import json
 import serial
 
+from outbox import outbox_padrao
+
 # Configurações
-API_URL = 'http://localhost:5000/dados'
+API_URL = 'http://localhost:5000/dados/batch'
 INTERVALO_LEITURA = 10  # mesmo intervalo do Arduino
 _REQUEST_TIMEOUT = 5
 
+# Outbox local: leituras ficam guardadas enquanto o Flask estiver fora do ar
+OUTBOX_ARQUIVO = 'outbox_http.db'
+OUTBOX_MAX_ITENS = 100000
+INTERVALO_REENVIO = 5  # segundos entre tentativas com o backend offline
+
+# Envio em lote (POST /dados/batch): junta até LOTE_MAX_LEITURAS por requisição e
+# espera encher o lote ou a leitura mais antiga passar de LOTE_MAX_ESPERA_S segundos.
+# Depois de um período offline, o atraso sai em poucas requisições cheias.
+LOTE_MAX_LEITURAS = 200
+LOTE_MAX_ESPERA_S = 30
+
 # Ajuste a porta conforme necessário:
 # Arduino Uno -> /dev/ttyACM0
 # Arduino Nano / CH340 -> /dev/ttyUSB0
@@ -19,6 +32,9 @@ BAUD_RATE = 9600
 # Sessão de requests para reuso de conexão (mais eficiente)
 session = requests.Session()
 
+outbox = outbox_padrao(OUTBOX_ARQUIVO, max_itens=OUTBOX_MAX_ITENS)
+_proxima_tentativa = 0
+
 # ========= Conectar Arduino ==========
 def conectar_arduino():
     """Tenta conectar ao Arduino em loop até ter sucesso."""
@@ -34,14 +50,25 @@ def conectar_arduino():
             print("🔁 Tentando novamente em 5 segundos...")
             time.sleep(5)
 
-# ========= Enviar leitura ==========
-def enviar_leitura(dados):
-    """Envia os dados (payload JSON) para o backend Flask."""
+# ========= Enviar lote ==========
+def enviar_lote(leituras):
+    """
+    Envia um lote de leituras (array JSON) para o backend Flask.
+    Retorna True se o backend processou o lote: leituras rejeitadas na validação
+    (resposta 207/400 com 'resultados') não vão passar num reenvio e são descartadas.
+    """
     try:
-        response = session.post(API_URL, json=dados, timeout=_REQUEST_TIMEOUT)
-
-        if response.status_code == 201:
-            print(f"📡 Enviado! ID: {response.json()['id']}")
+        response = session.post(API_URL, json=leituras, timeout=_REQUEST_TIMEOUT)
+
+        if response.status_code in (201, 207, 400):
+            corpo = response.json()
+            if 'resultados' not in corpo:
+                print(f"❌ Erro no envio: {response.status_code} | {response.text}")
+                return False
+            for resultado in corpo['resultados']:
+                if 'error' in resultado:
+                    print(f"⚠ Leitura rejeitada: {resultado['error']} | {leituras[resultado['indice']]}")
+            print(f"📡 Lote enviado: {corpo['inseridos']} leituras gravadas, {corpo['rejeitados']} rejeitadas")
             return True
         else:
             print(f"❌ Erro no envio: {response.status_code} | {response.text}")
@@ -57,6 +84,30 @@ def enviar_leitura(dados):
         print(f"❌ Erro inesperado: {e}")
         return False
 
+def drenar_outbox():
+    """
+    Envia as leituras pendentes em ordem, em lotes de até LOTE_MAX_LEITURAS,
+    e remove da outbox os lotes confirmados.
+    Espera encher o lote ou a mais antiga passar de LOTE_MAX_ESPERA_S.
+    Na primeira falha, espera INTERVALO_REENVIO segundos antes de tentar de novo.
+    """
+    global _proxima_tentativa
+    if not len(outbox) or time.time() < _proxima_tentativa:
+        return
+    if len(outbox) < LOTE_MAX_LEITURAS and outbox.idade_pendentes() < LOTE_MAX_ESPERA_S:
+        return
+
+    while len(outbox):
+        pendentes = outbox.pendentes(LOTE_MAX_LEITURAS)
+        # O id da outbox vai em cada leitura: se o POST gravou mas a resposta não chegou
+        # (timeout), o reenvio é reconhecido pelo backend e não vira linha duplicada
+        lote = [dict(dados, message_id=outbox.id_mensagem(seq)) for seq, dados in pendentes]
+        if not enviar_lote(lote):
+            _proxima_tentativa = time.time() + INTERVALO_REENVIO
+            print(f"📦 {len(outbox)} leituras aguardando na outbox.")
+            return
+        outbox.confirmar(pendentes[-1][0])
+
 # ========= Helper de Processamento ==========
 def _processar_linha_arduino(linha):
     """Helper privado que trata a lógica de uma linha recebida."""
@@ -76,8 +127,13 @@ def _processar_linha_arduino(linha):
         print(f"⚠ Erro do Arduino: {dados['erro']}")
         return
 
-    # Enviar para o backend
-    enviar_leitura(dados)
+    # Momento da coleta: leituras enviadas com atraso mantêm o horário real
+    dados.setdefault('timestamp', int(time.time()))
+
+    # Grava na outbox antes de enviar: nada se perde com o backend fora do ar
+    if outbox.adicionar(dados) is None:
+        print("⚠ Outbox cheia, leitura descartada")
+    drenar_outbox()
 
 # ========= Loop principal ==========
 def main_loop():
@@ -92,6 +148,10 @@ def main_loop():
             # Processa a linha lida
             _processar_linha_arduino(linha)
 
+            # Sem leitura nova (timeout da serial): aproveita para reenviar o atraso
+            if not linha:
+                drenar_outbox()
+
         except serial.SerialException:
             print("❌ Conexão com Arduino perdida! Tentando reconectar...")
             ser.close() # Fecha a conexão antiga/quebrada
@@ -100,6 +160,7 @@ def main_loop():
         except KeyboardInterrupt:
             print("\n🛑 Finalizado pelo usuário.")
             ser.close()
+            outbox.fechar()
             sys.exit(0)
 
 # ========= Execução ==========
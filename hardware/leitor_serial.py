@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+
+
+class BufferLinhas:
+    """
+    Buffer circular limitado entre as threads de leitura serial e a publicação.
+    Com o buffer cheio, a linha mais antiga é descartada (e contada).
+    Itens: (horário de chegada, linha, device_id)
+    """
+
+    def __init__(self, capacidade=256):
+        self._linhas = deque(maxlen=capacidade)
+        self._cond = threading.Condition()
+        self.descartadas = 0
+
+    def guardar(self, item):
+        with self._cond:
+            if len(self._linhas) == self._linhas.maxlen:
+                self.descartadas += 1
+            self._linhas.append(item)
+            self._cond.notify()
+
+    def acordar(self):
+        """Acorda quem está esperando em proxima() (ex: uma leitura parou)."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def proxima(self, timeout=None, ativo=None):
+        """
+        Retorna o item mais antigo, esperando até 'timeout' segundos.
+        Retorna None no timeout ou quando 'ativo()' deixar de ser verdadeiro.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._linhas:
+                if ativo is not None and not ativo():
+                    return None
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return None
+                self._cond.wait(restante)
+            return self._linhas.popleft()
+
+
+class LeitorSerial(threading.Thread):
+    """
+    Thread dedicada à porta serial: bloqueia no read() (sem busy-polling),
+    separa as linhas pelo '\n' e as guarda em um buffer circular limitado,
+    junto com o horário de chegada (a leitura é datada quando chega, não quando é publicada).
+
+    Quem consome (publicação) roda em outra thread e pega as linhas com
+    proxima_linha(); se ele atrasar (ex: broker lento), a serial continua
+    sendo esvaziada e, com o buffer cheio, as linhas mais antigas são descartadas.
+
+    Vários leitores podem compartilhar o mesmo 'buffer' (uma placa por porta);
+    cada linha sai marcada com o 'device_id' do leitor.
+    """
+
+    def __init__(self, serial_conn, buffer=None, device_id=None, capacidade=256, max_linha=512):
+        super().__init__(name=f'serial-{serial_conn.port}', daemon=True)
+        self.serial_conn = serial_conn
+        self.device_id = device_id
+        self.max_linha = max_linha
+        self.buffer = buffer if buffer is not None else BufferLinhas(capacidade)
+
+        self._parar = threading.Event()
+
+        self.erro = None          # Exceção que encerrou a leitura (ex: SerialException)
+        self.linhas_lidas = 0
+
+    @property
+    def descartadas(self):
+        """Linhas perdidas por buffer cheio"""
+        return self.buffer.descartadas
+
+    def run(self):
+        pedaco = b''
+        try:
+            while not self._parar.is_set():
+                # Bloqueia até chegar 1 byte (ou estourar o timeout da porta) e pega o resto disponível
+                dados = self.serial_conn.read(max(1, self.serial_conn.in_waiting))
+                if not dados:
+                    continue
+
+                pedaco += dados
+                *linhas, pedaco = pedaco.split(b'\n')
+                if len(pedaco) > self.max_linha:
+                    # Ruído sem quebra de linha: descarta para não crescer sem limite
+                    pedaco = b''
+
+                recebida_em = time.time()
+                for linha in linhas:
+                    linha = linha.decode('utf-8', errors='ignore').strip()
+                    if linha:
+                        self.buffer.guardar((recebida_em, linha, self.device_id))
+                        self.linhas_lidas += 1
+
+        except Exception as e:
+            if not self._parar.is_set():
+                self.erro = e
+        finally:
+            self.buffer.acordar()
+
+    def proxima_linha(self, timeout=None):
+        """
+        Retorna (horário de chegada, linha, device_id) da linha mais antiga do buffer,
+        esperando até 'timeout' segundos.
+        Retorna None no timeout ou se a leitura parou (veja 'erro').
+        """
+        return self.buffer.proxima(timeout, ativo=lambda: self.erro is None and self.is_alive())
+
+    def parar(self):
+        """Pede o fim da leitura (a thread sai no próximo timeout da porta)."""
+        self._parar.set()
@@ -13,7 +13,11 @@ sys.path.append(ROOT_DIR)
 
 # Tenta importar as configurações do backend
 try:
-    from backend.config import CLOUD_AMQP_URL, RABBITMQ_QUEUE_NAME
+    from backend.config import (
+        CLOUD_AMQP_URL, RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE, RABBITMQ_CONSUMER_QUEUES,
+        WIRE_FORMAT, PUBLICADOR
+    )
+    from backend.wire_format import codificar_leitura
 except ImportError:
     print("❌ ERRO FATAL: Não foi possível encontrar 'backend.config'.")
     print("Verifique se a estrutura de pastas está correta (ex: hardware/ e backend/ na mesma raiz).")
@@ -23,7 +27,7 @@ except ImportError:
 PORTA_SERIAL_PREFERIDA = '/dev/ttyUSB0'  # Porta comum para Arduino Nano/CH340
 BAUD_RATE = 9600
 TIMEOUT_SERIAL = 2
-QUEUE_NAME = RABBITMQ_QUEUE_NAME
+EXCHANGE_NAME = RABBITMQ_EXCHANGE_NAME
 
 # --- Conexão RabbitMQ ---
 
@@ -34,7 +38,15 @@ def connect_rabbitmq():
             params = pika.URLParameters(CLOUD_AMQP_URL)
             connection = pika.BlockingConnection(params)
             channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME, durable=True)
+            
+            # Exchange fanout + uma fila durável por consumidor (análise e persistência)
+            channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=RABBITMQ_EXCHANGE_TYPE, durable=True)
+            for fila in RABBITMQ_CONSUMER_QUEUES.values():
+                channel.queue_declare(queue=fila, durable=True)
+                channel.queue_bind(queue=fila, exchange=EXCHANGE_NAME)
+            if PUBLICADOR['confirms']:
+                # Modo confirm: cada publicação espera o ACK do broker (sem perda silenciosa)
+                channel.confirm_delivery()
             print("✅ Conexão com RabbitMQ (CloudAMQP) estabelecida.")
             return connection, channel
         except pika.exceptions.AMQPConnectionError as e:
@@ -129,23 +141,29 @@ def processar_linha(linha):
 # --- Publicação ---
 
 def publish_to_rabbitmq(channel, dados):
-    """Envia dados para a fila do RabbitMQ."""
+    """Envia dados para o exchange do RabbitMQ (chega em todas as filas ligadas)."""
     try:
         # Adiciona timestamp
         dados['timestamp'] = int(time.time())
-        message = json.dumps(dados)
+        message, content_type = codificar_leitura(dados, WIRE_FORMAT['producer_encoding'])
         
         channel.basic_publish(
-            exchange='',
-            routing_key=QUEUE_NAME,
+            exchange=EXCHANGE_NAME,
+            routing_key='', # Ignorada pelo fanout
             body=message,
             properties=pika.BasicProperties(
+                content_type=content_type,
                 delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
-            )
+            ),
+            mandatory=True
         )
         return True, "Publicado"
+    
+    except (pika.exceptions.NackError, pika.exceptions.UnroutableError) as e:
+        print(f"❌ Broker recusou a mensagem: {e}")
+        return False, str(e)
         
-    except (pika.exceptions.ConnectionClosedByPeer, pika.exceptions.StreamLostError) as e:
+    except (pika.exceptions.ConnectionClosedByBroker, pika.exceptions.StreamLostError) as e:
         print(f"❌ ERRO RabbitMQ: {e}")
         # Levanta a exceção para ser capturada pelo loop 'main' e forçar a reconexão
         raise e
@@ -163,7 +181,7 @@ def loop_principal(arduino, channel):
     print("\n" + "=" * 60)
     print("🌾 SISTEMA DE MONITORAMENTO AGRÍCOLA (PRODUTOR)")
     print(f"📡 Arduino: {arduino.port}")
-    print(f"📦 RabbitMQ Fila: {QUEUE_NAME}")
+    print(f"📦 RabbitMQ Exchange: {EXCHANGE_NAME} ({RABBITMQ_EXCHANGE_TYPE})")
     print("=" * 60)
     print("\n🚀 Iniciando monitoramento...\n")
     
@@ -223,7 +241,7 @@ def loop_principal(arduino, channel):
         
         except Exception as e:
             # Se for um erro de Pika, levanta para o 'main' reconectar
-            if isinstance(e, (pika.exceptions.ConnectionClosedByPeer, pika.exceptions.StreamLostError)):
+            if isinstance(e, (pika.exceptions.ConnectionClosedByBroker, pika.exceptions.StreamLostError)):
                 raise e
             
             print(f"❌ Erro inesperado no loop: {e}")
@@ -250,7 +268,7 @@ def main():
                 # Inicia o loop de leitura (que roda até uma falha de conexão)
                 loop_principal(arduino, channel)
                 
-            except (pika.exceptions.ConnectionClosedByPeer, pika.exceptions.StreamLostError, pika.exceptions.AMQPConnectionError):
+            except (pika.exceptions.ConnectionClosedByBroker, pika.exceptions.StreamLostError, pika.exceptions.AMQPConnectionError):
                 print("\n🔄 CONEXÃO RABBITMQ PERDIDA! Tentando reconectar em 5 segundos...\n")
                 if connection and connection.is_open:
                     connection.close()
@@ -4,6 +4,9 @@ import json
 import os
 import random
 import sys
+import threading
+from collections import OrderedDict
+from functools import partial
 
 # ==========================================================
 # Configurações
@@ -11,11 +14,20 @@ import sys
 
 # Adiciona a pasta raiz do backend ao path para import
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from backend.config import CLOUD_AMQP_URL, RABBITMQ_QUEUE_NAME
+from backend.config import (
+    CLOUD_AMQP_URL, RABBITMQ_EXCHANGE_NAME, RABBITMQ_EXCHANGE_TYPE, RABBITMQ_CONSUMER_QUEUES,
+    WIRE_FORMAT, OUTBOX, PUBLICADOR
+)
+from backend.wire_format import codificar_lote
+from outbox import outbox_padrao
+from leitor_serial import LeitorSerial, BufferLinhas
 
 # Modo de Simulação: Ativado se a variável de ambiente SIMULATE_DATA for 'true' usei pra testes sem os sensores
 SIMULATE_MODE = os.environ.get('SIMULATE_DATA', 'false').lower() == 'true'
 
+# Modo Supervisor: uma thread de leitura por placa em todas as portas 'tty', com hot-plug
+MULTI_ARDUINO = os.environ.get('MULTI_ARDUINO', 'false').lower() == 'true'
+
 # Tenta importar pyserial, com tratamento caso nao de.
 SERIAL_AVAILABLE = False
 try:
@@ -32,48 +44,9 @@ except ImportError:
 PORTA_SERIAL_PREFERIDA = '/dev/ttyUSB0' # Porta do Script 1, mantida para prioridade
 BAUD_RATE = 9600
 TIMEOUT_SERIAL = 2 # 2s (do Script 1) é mais seguro que 1s (do Script 2)
-
-# ==========================================================
-# Funções de Conexão e Publicação (Lógica do Script 2)
-# ==========================================================
-
-def connect_rabbitmq():
-    """Tenta conectar ao CloudAMQP (RabbitMQ) e retorna o canal."""
-    try:
-        params = pika.URLParameters(CLOUD_AMQP_URL)
-        connection = pika.BlockingConnection(params)
-        channel = connection.channel()
-        channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True)
-        print("✅ Conexão com RabbitMQ (CloudAMQP) estabelecida.")
-        return connection, channel
-    except pika.exceptions.AMQPConnectionError as e:
-        print(f"❌ ERRO: Falha ao conectar ao CloudAMQP: {e}")
-        return None, None
-
-def publish_message(channel, data):
-    """Publica a mensagem JSON na fila."""
-    if channel is None:
-        return False
-        
-    try:
-        # Serializa o dicionário Python para string JSON
-        message = json.dumps(data) 
-        
-        # Publica a mensagem
-        channel.basic_publish(
-            exchange='', 
-            routing_key=RABBITMQ_QUEUE_NAME, 
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
-            ))
-        return True
-    except pika.exceptions.ConnectionClosedByPeer:
-        print("❌ Conexão RabbitMQ fechada pelo peer.")
-        return False
-    except Exception as e:
-        print(f"❌ ERRO ao publicar: {e}")
-        return False
+SERIAL_BUFFER_LINHAS = 256 # Buffer circular entre a thread da serial e a publicação
+INTERVALO_VARREDURA_PORTAS = 5 # Modo supervisor: busca placas conectadas/desconectadas a cada N s
+ESPERA_JANELA_S = 1.0 # Janela de confirms cheia: espera no máximo isso por um ACK antes de voltar à leitura
 
 # ==========================================================
 # Funções de Leitura (Simulação vs. Hardware)
@@ -111,15 +84,86 @@ def encontrar_porta_arduino():
     return None
 
 def conectar_arduino():
-    """Conecta na porta serial do Arduino (Lógica do Script 1, mais robusta)."""
+    """
+    Conecta na porta serial do Arduino (Lógica do Script 1, mais robusta).
+    Retorna: conexão serial ou None se nenhum Arduino for encontrado
+    """
     print("Procurando Arduino...")
     ser = encontrar_porta_arduino()
     
     if ser is None:
         print("Arduino não encontrado!")
-        sys.exit(1)
     return ser
 
+def listar_portas_arduino():
+    """Portas seriais candidatas (mesmo filtro 'tty' da busca automática)."""
+    return [p for p in serial.tools.list_ports.comports() if 'tty' in p.device]
+
+def identificar_dispositivo(porta_info):
+    """
+    Id estável da placa: número de série USB. Sem ele (clones CH340),
+    usa VID:PID + posição no hub USB, que não muda enquanto a placa ficar na mesma porta física.
+    """
+    if porta_info.serial_number:
+        return porta_info.serial_number
+    if porta_info.vid is not None:
+        return f"{porta_info.vid:04x}-{porta_info.pid:04x}-{porta_info.location or os.path.basename(porta_info.device)}"
+    return os.path.basename(porta_info.device)
+
+def id_da_porta(porta):
+    """device_id da placa aberta em 'porta' (modo de uma placa só)."""
+    for porta_info in listar_portas_arduino():
+        if porta_info.device == porta:
+            return identificar_dispositivo(porta_info)
+    return os.path.basename(porta)
+
+
+class SupervisorArduinos:
+    """
+    Mantém uma LeitorSerial por placa conectada, todas escrevendo no mesmo buffer.
+    varrer() abre as placas novas e encerra as que sumiram ou falharam (hot-plug).
+    """
+
+    def __init__(self, capacidade_buffer):
+        self.buffer = BufferLinhas(capacidade_buffer)
+        self.leitores = {} # device_id -> LeitorSerial
+
+    def varrer(self):
+        portas = {identificar_dispositivo(p): p for p in listar_portas_arduino()}
+
+        for device_id, leitor in list(self.leitores.items()):
+            if device_id in portas and leitor.is_alive() and leitor.erro is None:
+                continue
+            motivo = leitor.erro or "placa desconectada"
+            print(f"🔌 Arduino {device_id} removido ({motivo}).")
+            self._fechar(device_id)
+
+        for device_id, porta_info in portas.items():
+            if device_id in self.leitores:
+                continue
+            try:
+                ser = serial.Serial(porta_info.device, BAUD_RATE, timeout=TIMEOUT_SERIAL)
+            except (serial.SerialException, OSError):
+                continue # Porta ocupada ou que não é um Arduino: tenta de novo na próxima varredura
+
+            # Sem sleep de reset: a thread descarta o banner do boot como linha não-JSON
+            leitor = LeitorSerial(ser, buffer=self.buffer, device_id=device_id)
+            leitor.start()
+            self.leitores[device_id] = leitor
+            print(f"🔌 Arduino {device_id} conectado em {porta_info.device}.")
+
+    def _fechar(self, device_id):
+        leitor = self.leitores.pop(device_id)
+        leitor.parar()
+        try:
+            leitor.serial_conn.close()
+        except Exception:
+            pass
+
+    def parar(self):
+        for device_id in list(self.leitores):
+            self._fechar(device_id)
+
 # ==========================================================
 # Funções de Processamento (Lógica do Script 1)
 # ==========================================================
@@ -159,11 +203,424 @@ def processar_linha(linha):
     except json.JSONDecodeError as e:
         return None, f"JSON inválido: {e}"
 
+# ==========================================================
+# Envio (Store-and-Forward)
+# ==========================================================
+
+class LinkRabbitMQ:
+    """
+    Conexão assíncrona com o broker (SelectConnection do pika) rodando em uma thread de I/O própria.
+    Com PUBLICADOR['confirms'], o canal fica em modo confirm e até 'janela' mensagens
+    ficam publicadas esperando o ACK ao mesmo tempo (pipelining), em vez de um round trip por mensagem.
+
+    A thread principal publica e recolhe as entregas confirmadas em ordem;
+    a thread de I/O só fala com o broker. Enquanto o link estiver fora, as leituras
+    continuam sendo lidas e guardadas na outbox. Uma falha (nack, mensagem sem fila,
+    queda da conexão) descarta as mensagens em voo: elas continuam na outbox e são
+    reenviadas com o mesmo message_id (o consumidor descarta as duplicadas).
+    """
+
+    def __init__(self, intervalo_reconexao, janela=None):
+        self.intervalo_reconexao = intervalo_reconexao
+        self.janela = max(1, janela or PUBLICADOR['janela_confirms'])
+        self.connection = None
+        self.channel = None
+        self._thread = None
+        self._proxima_tentativa = 0
+        self._cond = threading.Condition()
+        # Prefixo confirmado, ainda não recolhido pela thread principal (sobrevive a uma queda do link)
+        self._confirmadas = []
+        self._zerar_estado()
+
+    def _zerar_estado(self):
+        self._pronto = False
+        self._falha = None
+        self._tag = 0 # delivery tag da última publicação (sequencial por canal)
+        self._reservadas = [] # entregas passadas à thread de I/O, ainda sem delivery tag
+        self._em_voo = OrderedDict() # delivery tag -> entrega, na ordem de publicação
+        self.ultimo_seq_enviado = 0 # cursor: a próxima publicação começa depois dele
+
+    @property
+    def leituras_em_voo(self):
+        with self._cond:
+            return sum(entrega['leituras'] for entrega in [*self._em_voo.values(), *self._reservadas])
+
+    # ---------------- Thread principal ----------------
+
+    def disponivel(self):
+        """True se o canal está pronto para publicar (tenta reconectar no máximo a cada 'intervalo_reconexao' s)."""
+        with self._cond:
+            if self._pronto and self._falha is None:
+                return True
+            falha = self._falha if self.connection is not None else None
+
+        if falha is not None:
+            print(f"❌ Link com o broker caiu: {falha}. "
+                  f"{self.leituras_em_voo} leituras em voo voltam a ser enviadas da outbox.")
+            self.falhou()
+            return False
+        if time.time() < self._proxima_tentativa:
+            return False
+        return self._conectar()
+
+    def _conectar(self):
+        self.fechar()
+        try:
+            self.connection = pika.SelectConnection(
+                pika.URLParameters(CLOUD_AMQP_URL),
+                on_open_callback=self._ao_abrir_conexao,
+                on_open_error_callback=self._ao_falhar_conexao,
+                on_close_callback=self._ao_fechar_conexao,
+            )
+        except Exception as e:
+            print(f"❌ ERRO: Falha ao conectar ao CloudAMQP: {e}")
+            self.connection = None
+            self._proxima_tentativa = time.time() + self.intervalo_reconexao
+            return False
+
+        self._thread = threading.Thread(target=self.connection.ioloop.start, name='amqp-io', daemon=True)
+        self._thread.start()
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._pronto or self._falha is not None, PUBLICADOR['timeout_conexao_s'])
+            pronto, falha = self._pronto, self._falha
+
+        if not pronto:
+            print(f"❌ ERRO: Falha ao conectar ao CloudAMQP: {falha or 'tempo esgotado'}")
+            self.falhou()
+            return False
+        print(f"✅ Conexão com RabbitMQ (CloudAMQP) estabelecida (janela de {self.janela} confirms).")
+        return True
+
+    def esperar_vaga(self, timeout):
+        """Espera (até 'timeout' s) a janela ter vaga. False se continuar cheia ou se o link caiu."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._falha is not None or self._ocupacao() < self.janela, timeout)
+            return self._falha is None and self._ocupacao() < self.janela
+
+    def esperar_confirmacoes(self, timeout):
+        """Espera (até 'timeout' s) o broker confirmar tudo o que está em voo (usado ao encerrar)."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._falha is not None or not self._ocupacao(), timeout
+            )
+
+    def publicar(self, pendentes, message_id):
+        """
+        Publica um lote da outbox (lista de (seq, dados) consecutivos) sem esperar o ACK.
+        A confirmação chega depois, por recolher_confirmadas().
+        """
+        leituras = [dados for _, dados in pendentes]
+        # Serializa no formato configurado (binário compacto, com JSON como fallback)
+        body, content_type = codificar_lote(leituras, WIRE_FORMAT['producer_encoding'])
+        propriedades = pika.BasicProperties(
+            content_type=content_type,
+            message_id=message_id, # Id da outbox: permite descartar reenvios duplicados
+            delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE
+        )
+        entrega = {
+            'ultimo_seq': pendentes[-1][0],
+            'leituras': len(leituras),
+            'mais_antiga': min(dados.get('timestamp', time.time()) for dados in leituras),
+            'publicada_em': time.monotonic(),
+            'confirmada_em': None,
+        }
+
+        with self._cond:
+            self._reservadas.append(entrega)
+            self.ultimo_seq_enviado = entrega['ultimo_seq']
+        try:
+            self.connection.ioloop.add_callback_threadsafe(partial(self._publicar_no_loop, body, propriedades, entrega))
+        except Exception as e:
+            with self._cond:
+                self._falha = self._falha or f"loop de I/O indisponível: {e}"
+
+    def recolher_confirmadas(self):
+        """Entregas confirmadas pelo broker desde a última chamada, em ordem de publicação."""
+        with self._cond:
+            confirmadas, self._confirmadas = self._confirmadas, []
+        return confirmadas
+
+    def em_voo(self):
+        """Mensagens publicadas (ou a caminho da thread de I/O) ainda sem ACK."""
+        with self._cond:
+            return self._ocupacao()
+
+    def _ocupacao(self):
+        return len(self._em_voo) + len(self._reservadas)
+
+    def falhou(self):
+        """Descarta a conexão atual (e o que estava em voo) e agenda a próxima tentativa."""
+        self.fechar()
+        self._proxima_tentativa = time.time() + self.intervalo_reconexao
+
+    def fechar(self):
+        if self.connection is not None:
+            try:
+                self.connection.ioloop.add_callback_threadsafe(partial(self._encerrar, self.connection))
+            except Exception:
+                pass
+            self._thread.join(timeout=5)
+            print("Conexão RabbitMQ fechada.")
+        self.connection, self.channel, self._thread = None, None, None
+        with self._cond:
+            self._zerar_estado()
+
+    # ---------------- Thread de I/O (callbacks do pika) ----------------
+
+    def _obsoleto(self):
+        """True em callbacks de uma conexão já descartada (a thread de I/O antiga ainda terminando)."""
+        return threading.current_thread() is not self._thread
+
+    def _sinalizar_falha(self, motivo):
+        if self._obsoleto():
+            return
+        with self._cond:
+            if self._falha is None:
+                self._falha = motivo
+            self._cond.notify_all()
+
+    @staticmethod
+    def _encerrar(connection):
+        if connection.is_open:
+            connection.close() # O on_close_callback para o loop de I/O
+        elif not connection.is_closing:
+            connection.ioloop.stop()
+
+    def _ao_abrir_conexao(self, connection):
+        connection.channel(on_open_callback=self._ao_abrir_canal)
+
+    def _ao_falhar_conexao(self, connection, erro):
+        self._sinalizar_falha(f"falha ao abrir a conexão: {erro}")
+        connection.ioloop.stop()
+
+    def _ao_fechar_conexao(self, connection, motivo):
+        self._sinalizar_falha(f"conexão fechada: {motivo}")
+        connection.ioloop.stop()
+
+    def _ao_fechar_canal(self, channel, motivo):
+        self._sinalizar_falha(f"canal fechado: {motivo}")
+        self._encerrar(channel.connection)
+
+    def _ao_abrir_canal(self, channel):
+        if self._obsoleto():
+            channel.connection.close()
+            return
+        self.channel = channel
+        channel.add_on_close_callback(self._ao_fechar_canal)
+        channel.add_on_return_callback(self._ao_devolver)
+
+        # Declara o exchange fanout e as filas de todos os consumidores, em sequência.
+        # Assim nenhuma leitura se perde, mesmo antes de um consumidor subir pela primeira vez.
+        etapas = [partial(channel.exchange_declare, exchange=RABBITMQ_EXCHANGE_NAME,
+                          exchange_type=RABBITMQ_EXCHANGE_TYPE, durable=True)]
+        for fila in RABBITMQ_CONSUMER_QUEUES.values():
+            etapas.append(partial(channel.queue_declare, queue=fila, durable=True))
+            etapas.append(partial(channel.queue_bind, queue=fila, exchange=RABBITMQ_EXCHANGE_NAME))
+        self._executar_em_sequencia(etapas, self._ativar_confirms)
+
+    def _executar_em_sequencia(self, etapas, ao_terminar):
+        """Cada declaração só começa no callback (OK do broker) da anterior."""
+        if not etapas:
+            ao_terminar()
+            return
+        etapas[0](callback=lambda _frame: self._executar_em_sequencia(etapas[1:], ao_terminar))
+
+    def _ativar_confirms(self):
+        if PUBLICADOR['confirms']:
+            self.channel.confirm_delivery(ack_nack_callback=self._ao_confirmar, callback=self._ao_pronto)
+        else:
+            self._ao_pronto(None)
+
+    def _ao_pronto(self, _frame):
+        if self._obsoleto():
+            return
+        with self._cond:
+            self._pronto = True
+            self._cond.notify_all()
+
+    def _publicar_no_loop(self, body, propriedades, entrega):
+        if self._obsoleto():
+            return
+        with self._cond:
+            if self._falha is not None:
+                self._reservadas.remove(entrega)
+                self._cond.notify_all()
+                return # O lote continua na outbox e é reenviado após reconectar
+
+        self.channel.basic_publish(
+            exchange=RABBITMQ_EXCHANGE_NAME,
+            routing_key='', # Ignorada pelo fanout
+            body=body,
+            properties=propriedades,
+            mandatory=True) # Sem fila ligada ao exchange = mensagem devolvida, não perda silenciosa
+
+        with self._cond:
+            # Sai das reservadas e entra em voo no mesmo passo: a janela nunca fica com uma vaga falsa
+            self._reservadas.remove(entrega)
+            self._tag += 1
+            self._em_voo[self._tag] = entrega
+            if not PUBLICADOR['confirms']:
+                self._marcar_confirmadas(self._tag, multiple=False)
+            self._cond.notify_all()
+
+    def _ao_devolver(self, channel, method, properties, body):
+        # O broker devolve (basic.return) antes de confirmar: o ACK que vem depois não vale
+        self._sinalizar_falha(f"mensagem {properties.message_id} sem fila ligada ({method.reply_text})")
+        self._encerrar(channel.connection)
+
+    def _ao_confirmar(self, frame):
+        if self._obsoleto():
+            return
+        method = frame.method
+        if not isinstance(method, pika.spec.Basic.Ack):
+            self._sinalizar_falha(f"broker recusou a mensagem (nack da delivery tag {method.delivery_tag})")
+            self._encerrar(self.connection)
+            return
+
+        with self._cond:
+            if self._falha is None:
+                self._marcar_confirmadas(method.delivery_tag, method.multiple)
+            self._cond.notify_all()
+
+    def _marcar_confirmadas(self, tag, multiple):
+        """ACK de 'tag' (e das anteriores, se 'multiple'); libera o prefixo já confirmado. Chamar com o lock."""
+        agora = time.monotonic()
+        for tag_em_voo, entrega in self._em_voo.items():
+            if tag_em_voo > tag:
+                break
+            if (multiple or tag_em_voo == tag) and entrega['confirmada_em'] is None:
+                entrega['confirmada_em'] = agora
+
+        # A outbox só remove prefixos: uma entrega confirmada fora de ordem espera as anteriores
+        while self._em_voo:
+            tag_em_voo, entrega = next(iter(self._em_voo.items()))
+            if entrega['confirmada_em'] is None:
+                break
+            self._em_voo.popitem(last=False)
+            self._confirmadas.append(entrega)
+
+
+class MetricasPublicacao:
+    """
+    Latência de publicação (publish -> confirm do broker), atraso de
+    confirmação (leitura mais antiga do lote -> confirm) e ocupação da
+    janela de confirms, com relatório periódico.
+    """
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._zerar()
+        self._proximo_relatorio = time.monotonic() + intervalo
+
+    def _zerar(self):
+        self.mensagens = 0
+        self.leituras = 0
+        self.latencia_total = 0.0
+        self.latencia_max = 0.0
+        self.atraso_max = 0.0
+        self.em_voo_max = 0
+
+    def registrar(self, latencia, atraso, leituras):
+        self.mensagens += 1
+        self.leituras += leituras
+        self.latencia_total += latencia
+        self.latencia_max = max(self.latencia_max, latencia)
+        self.atraso_max = max(self.atraso_max, atraso)
+
+    def registrar_em_voo(self, em_voo):
+        self.em_voo_max = max(self.em_voo_max, em_voo)
+
+    def relatorio(self, outbox):
+        """Imprime o resumo do período (se já passou 'intervalo' segundos)."""
+        if time.monotonic() < self._proximo_relatorio:
+            return
+        self._proximo_relatorio = time.monotonic() + self.intervalo
+        if self.mensagens:
+            print(f"   📊 Publicação: {self.leituras} leituras em {self.mensagens} mensagens | "
+                  f"latência média {self.latencia_total / self.mensagens * 1000:.0f}ms "
+                  f"(máx {self.latencia_max * 1000:.0f}ms) | atraso máx {self.atraso_max:.1f}s | "
+                  f"máx {self.em_voo_max} em voo | {len(outbox)} na outbox")
+        self._zerar()
+
+
+def _aplicar_confirmacoes(link, outbox, metricas):
+    """Remove da outbox o que o broker já confirmou. Retorna: quantidade de leituras entregues."""
+    confirmadas = link.recolher_confirmadas()
+    if not confirmadas:
+        return 0
+
+    agora_monotonic, agora = time.monotonic(), time.time()
+    for entrega in confirmadas:
+        latencia = entrega['confirmada_em'] - entrega['publicada_em']
+        # Atraso até o ACK: o horário de parede do ACK é reconstruído a partir do relógio monotônico
+        atraso = agora - (agora_monotonic - entrega['confirmada_em']) - entrega['mais_antiga']
+        metricas.registrar(latencia, atraso, entrega['leituras'])
+    return outbox.confirmar(confirmadas[-1]['ultimo_seq'])
+
+
+def drenar_outbox(link, outbox, metricas):
+    """
+    Publica as leituras pendentes em ordem, juntando até PUBLICADOR['max_leituras_lote']
+    por mensagem. Espera encher o lote ou a mais antiga passar de PUBLICADOR['max_espera_s'].
+    Não espera o ACK de cada mensagem: publica enquanto houver vaga na janela de confirms
+    e remove da outbox o prefixo já confirmado. Com a janela cheia por mais de
+    ESPERA_JANELA_S, volta para a leitura (o restante sai na próxima chamada).
+    Retorna: quantidade de leituras entregues (confirmadas) nesta chamada.
+    """
+    max_leituras = PUBLICADOR['max_leituras_lote']
+    entregues = _aplicar_confirmacoes(link, outbox, metricas)
+
+    nao_enviadas = len(outbox) - link.leituras_em_voo
+    if nao_enviadas <= 0 or (nao_enviadas < max_leituras and outbox.idade_pendentes() < PUBLICADOR['max_espera_s']):
+        metricas.relatorio(outbox)
+        return entregues
+
+    sem_link = False
+    while True:
+        if not link.disponivel():
+            sem_link = True
+            break
+        pendentes = outbox.pendentes(max_leituras, apos_seq=link.ultimo_seq_enviado)
+        if not pendentes:
+            break
+        if not link.esperar_vaga(ESPERA_JANELA_S):
+            entregues += _aplicar_confirmacoes(link, outbox, metricas)
+            break
+
+        # O id do lote é o da primeira leitura; as demais têm seqs consecutivos
+        link.publicar(pendentes, message_id=outbox.id_mensagem(pendentes[0][0]))
+        metricas.registrar_em_voo(link.em_voo())
+        entregues += _aplicar_confirmacoes(link, outbox, metricas)
+
+    if sem_link:
+        print(f"❌ Sem link com o broker. {len(outbox)} leituras aguardando na outbox.")
+
+    if entregues > 1:
+        print(f"   📤 {entregues} leituras publicadas da outbox.")
+    metricas.relatorio(outbox)
+    return entregues
+
+
+def _abrir_outbox():
+    outbox = outbox_padrao(
+        OUTBOX['arquivo'], max_itens=OUTBOX['max_itens'], drop_policy=OUTBOX['drop_policy']
+    )
+    if len(outbox):
+        print(f"📦 Outbox: {len(outbox)} leituras pendentes de execuções anteriores.")
+    return outbox
+
+
+def _guardar(outbox, dados):
+    """Toda leitura validada passa pela outbox antes de ir para o broker."""
+    if outbox.adicionar(dados) is None:
+        print(f"⚠️ Outbox cheia ({outbox.max_itens}): leitura descartada.")
+
 # ==========================================================
 # Loops de Execução
 # ==========================================================
 
-def _run_simulation_loop(channel):
+def _run_simulation_loop(link, outbox, metricas):
     """Loop principal para dados simulados."""
     print("🚀 Iniciando monitoramento... (Modo Simulação)")
     leitura_id = 1
@@ -171,132 +628,175 @@ def _run_simulation_loop(channel):
         data = generate_simulated_data(leitura_id)
         
         print(f"\n📊 Leitura #{leitura_id} (Simulada) [{time.strftime('%H:%M:%S')}]")
-        print(f"   🌡️  Temperatura: {data['temperatura']:.1f}°C")
-        print(f"   💧 Umidade Ar: {data['umidade_ar']:.1f}%")
+        print(f"   🌡️  Temperatura: {data['temperatura']:.1f}°C")
+        print(f"   💧 Umidade Ar: {data['umidade_ar']:.1f}%")
         
-        if not publish_message(channel, data):
-            print("❌ Publicação falhou. Sinalizando para reconectar...")
-            return False # Sinaliza falha
+        _guardar(outbox, data)
+        drenar_outbox(link, outbox, metricas)
             
         leitura_id += 1
         time.sleep(5) # Intervalo do modo simulação (do Script 2)
 
-def _run_hardware_loop(channel, arduino):
+def _iniciar_leitor(arduino, device_id):
+    """Thread da serial: lê e separa as linhas enquanto o loop principal publica."""
+    arduino.reset_input_buffer()
+    leitor = LeitorSerial(arduino, capacidade=SERIAL_BUFFER_LINHAS, device_id=device_id)
+    leitor.start()
+    return leitor
+
+def _tratar_linha(item, link, outbox, metricas, contadores):
+    """Valida uma linha recebida da serial, grava na outbox e tenta publicar."""
+    recebida_em, linha, device_id = item
+    origem = f" [{device_id}]" if device_id else ""
+    
+    if not linha.startswith('{'):
+        print(f"📋 Arduino{origem}: {linha}")
+        return
+    
+    dados, erro = processar_linha(linha)
+    
+    if erro:
+        print(f"⚠️ {erro}{origem}: {linha}")
+        contadores['erros'] += 1
+        return
+    
+    valido, msg_validacao = validar_dados(dados)
+    
+    if not valido:
+        print(f"❌ Validação falhou{origem}: {msg_validacao}")
+        contadores['erros'] += 1
+        return
+    
+    # Datada na chegada pela serial, não na publicação
+    dados['timestamp'] = int(recebida_em)
+    if device_id:
+        dados['device_id'] = device_id
+
+    contadores['leituras'] += 1
+    print(f"\n📊 Leitura #{contadores['leituras']}{origem} [{time.strftime('%H:%M:%S')}]")
+    print(f"   🌡️  Temperatura: {dados['temperatura']:.1f}°C")
+    print(f"   💧 Umidade Ar: {dados['umidade_ar']:.1f}%")
+    print(f"   🌱 Umidade Solo: {dados['umidade_solo']} (ADC)")
+    print(f"   ☀️  Luminosidade: {dados['luminosidade']} (ADC)")
+    
+    # Grava primeiro na outbox; o envio não bloqueia a leitura serial se o broker cair
+    _guardar(outbox, dados)
+    if drenar_outbox(link, outbox, metricas):
+        print("   ✅ Publicado no CloudAMQP!")
+    
+    print(f"   📈 Total: {contadores['leituras']} leituras | {contadores['erros']} erros | "
+          f"{len(outbox)} na outbox")
+
+def _run_hardware_loop(link, outbox, metricas, arduino):
     """Loop principal para leitura do hardware (Lógica do Script 1)."""
     print("🚀 Iniciando monitoramento... (Modo Hardware)")
     print(f" Arduino: {arduino.port}")
     print(f"Intervalo: 10 segundos (configurado no Arduino)")
     
-    arduino.reset_input_buffer()
-    contador_leituras = 0
-    contador_erros = 0
+    leitor = _iniciar_leitor(arduino, id_da_porta(arduino.port))
+    contadores = {'leituras': 0, 'erros': 0}
     
-    while True:
-        try:
-            if arduino.in_waiting > 0:
-                linha = arduino.readline().decode('utf-8', errors='ignore').strip()
-                
-                if not linha: continue
-                
-                if not linha.startswith('{'):
-                    print(f"📋 Arduino: {linha}")
-                    continue
-                
-                dados, erro = processar_linha(linha)
-                
-                if erro:
-                    print(f"⚠️ {erro}: {linha}")
-                    contador_erros += 1
-                    continue
-                
-                valido, msg_validacao = validar_dados(dados)
-                
-                if not valido:
-                    print(f"❌ Validação falhou: {msg_validacao}")
-                    contador_erros += 1
-                    continue
-                
-                dados['timestamp'] = int(time.time())
-
-                contador_leituras += 1
-                print(f"\n📊 Leitura #{contador_leituras} [{time.strftime('%H:%M:%S')}]")
-                print(f"   🌡️  Temperatura: {dados['temperatura']:.1f}°C")
-                print(f"   💧 Umidade Ar: {dados['umidade_ar']:.1f}%")
-                print(f"   🌱 Umidade Solo: {dados['umidade_solo']} (ADC)")
-                print(f"   ☀️  Luminosidade: {dados['luminosidade']} (ADC)")
-                
-                if publish_message(channel, dados):
-                    print("   ✅ Publicado no CloudAMQP!")
-                else:
-                    print("   ❌ Erro ao publicar. Sinalizando para reconectar...")
-                    return False # Sinaliza falha
-                
-                print(f"   📈 Total: {contador_leituras} leituras | {contador_erros} erros")
-        
-        except serial.SerialException as e:
-            print(f"\n❌ Erro na comunicação serial: {e}")
-            print("Tentando reconectar...")
-            arduino.close()
-            arduino = conectar_arduino()
-            if arduino is None:
-                return True # Encerra loop (limpamente)
-            arduino.reset_input_buffer()
-        
-        except Exception as e:
-            print(f"Erro inesperado no loop hardware: {e}")
-            contador_erros += 1
-            time.sleep(1)
+    try:
+        while True:
+            # Bloqueia (sem consumir CPU) até chegar uma linha ou passar 1s
+            item = leitor.proxima_linha(timeout=1.0)
+            
+            if item is None:
+                if leitor.erro is not None:
+                    print(f"\n❌ Erro na comunicação serial: {leitor.erro}")
+                    print("Tentando reconectar...")
+                    arduino.close()
+                    arduino = conectar_arduino()
+                    if arduino is None:
+                        return # Encerra loop (limpamente): main fecha o link e a outbox
+                    leitor = _iniciar_leitor(arduino, id_da_porta(arduino.port))
+                elif len(outbox):
+                    # Sem leitura nova: envia o lote que atingiu 'max_espera_s' ou o atraso de uma queda
+                    drenar_outbox(link, outbox, metricas)
+                continue
+            
+            try:
+                _tratar_linha(item, link, outbox, metricas, contadores)
+            except Exception as e:
+                print(f"Erro inesperado no loop hardware: {e}")
+                contadores['erros'] += 1
+    finally:
+        leitor.parar()
+
+def _run_supervisor_loop(link, outbox, metricas):
+    """
+    Modo supervisor: várias placas no mesmo Raspberry Pi, uma thread de leitura
+    por porta e tudo publicado por uma única conexão AMQP (cada leitura leva o device_id).
+    """
+    print("🚀 Iniciando monitoramento... (Modo Supervisor, várias placas)")
+    
+    supervisor = SupervisorArduinos(SERIAL_BUFFER_LINHAS)
+    contadores = {'leituras': 0, 'erros': 0}
+    proxima_varredura = 0
+    
+    try:
+        while True:
+            if time.monotonic() >= proxima_varredura:
+                supervisor.varrer()
+                proxima_varredura = time.monotonic() + INTERVALO_VARREDURA_PORTAS
+                if not supervisor.leitores:
+                    print("Nenhum Arduino conectado. Aguardando...")
+            
+            item = supervisor.buffer.proxima(timeout=1.0)
+            
+            if item is None:
+                if len(outbox):
+                    drenar_outbox(link, outbox, metricas)
+                continue
+            
+            try:
+                _tratar_linha(item, link, outbox, metricas, contadores)
+            except Exception as e:
+                print(f"Erro inesperado no loop supervisor: {e}")
+                contadores['erros'] += 1
+    finally:
+        supervisor.parar()
 
 # ==========================================================
 # Loop Principal
 # ==========================================================
 
 def main():
-    """Gerencia as conexões e seleciona o modo de execução."""
+    """Abre a outbox e o link com o broker e seleciona o modo de execução."""
     print("=" * 60)
     print("🌾 INTEGRAÇÃO ARDUINO → CLOUDAMQP (PRODUTOR)")
     print("=" * 60)
     
-    # Loop de reconexão do RabbitMQ
-    while True:
-        connection, channel = connect_rabbitmq()
-        if connection is None:
-            print("Tentando reconectar em 5s...")
-            time.sleep(5)
-            continue
-
-        reconnect_needed = True # Default para reconectar
-        arduino_conn = None
-        
-        try:
-            if SIMULATE_MODE:
-                reconnect_needed = not _run_simulation_loop(channel)
-            else:
-                arduino_conn = conectar_arduino()
-                if arduino_conn:
-                    reconnect_needed = not _run_hardware_loop(channel, arduino_conn)
-                else:
-                    break # Falha ao conectar no Arduino, encerra
-                    
-        except KeyboardInterrupt:
-            print("\n Encerrando Produtor.")
-            reconnect_needed = False
-            break
-        except Exception as e:
-            print(f"❌ ERRO FATAL no loop principal: {e}")
-            break
-        finally:
-            if arduino_conn and arduino_conn.is_open:
-                arduino_conn.close()
-            if connection and connection.is_open:
-                connection.close()
-                print("Conexão RabbitMQ fechada.")
-        
-        if reconnect_needed:
-            print("🔄 Conexão RabbitMQ perdida. Tentando reconectar em 5s...")
-            time.sleep(5)
+    outbox = _abrir_outbox()
+    link = LinkRabbitMQ(OUTBOX['reconnect_interval'])
+    metricas = MetricasPublicacao(PUBLICADOR['report_interval'])
+    arduino_conn = None
+    
+    try:
+        if SIMULATE_MODE:
+            _run_simulation_loop(link, outbox, metricas)
+        elif MULTI_ARDUINO:
+            _run_supervisor_loop(link, outbox, metricas)
         else:
-            break # Saída limpa (KeyboardInterrupt ou falha HW)
+            arduino_conn = conectar_arduino()
+            if arduino_conn is None:
+                sys.exit(1)
+            _run_hardware_loop(link, outbox, metricas, arduino_conn)
+                
+    except KeyboardInterrupt:
+        print("\n Encerrando Produtor.")
+    except Exception as e:
+        print(f"❌ ERRO FATAL no loop principal: {e}")
+    finally:
+        if arduino_conn and arduino_conn.is_open:
+            arduino_conn.close()
+        # Dá um tempo para os ACKs do que já está em voo antes de fechar o link
+        if link.em_voo() and link.esperar_confirmacoes(5):
+            _aplicar_confirmacoes(link, outbox, metricas)
+        link.fechar()
+        if len(outbox):
+            print(f"📦 {len(outbox)} leituras ficaram na outbox (serão enviadas na próxima execução).")
+        outbox.fechar()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
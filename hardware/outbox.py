@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+
+class Outbox:
+    """
+    Fila local (store-and-forward) em SQLite para as leituras do Arduino.
+    Toda leitura validada entra aqui primeiro; o envio lê em ordem,
+    e só remove o que foi confirmado, então uma queda do link não perde dados.
+
+    Cada item recebe um id de deduplicação estável ('<produtor>-<seq>'):
+    o AUTOINCREMENT garante que um seq nunca é reutilizado, mesmo após remoções.
+
+    drop_policy (quando 'max_itens' é atingido):
+        'oldest' - descarta a leitura mais antiga (mantém as mais recentes)
+        'newest' - recusa a leitura nova (mantém o histórico mais antigo)
+    """
+
+    def __init__(self, path, max_itens=100000, drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError(f"drop_policy inválida: {drop_policy}")
+
+        self.path = path
+        self.max_itens = max_itens
+        self.drop_policy = drop_policy
+        self.descartadas = 0
+
+        self._conn = sqlite3.connect(path)
+        # WAL + synchronous=NORMAL: uma escrita por leitura sem fsync a cada commit
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+
+        # Identificador do produtor, persistido para os ids continuarem únicos após reinícios
+        row = self._conn.execute("SELECT valor FROM meta WHERE chave = 'produtor'").fetchone()
+        if row is None:
+            self.produtor = uuid.uuid4().hex[:12]
+            self._conn.execute("INSERT INTO meta VALUES ('produtor', ?)", (self.produtor,))
+        else:
+            self.produtor = row[0]
+        self._conn.commit()
+
+        self._tamanho = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        # Pendências de execuções anteriores contam como "antigas" (saem no primeiro envio)
+        self._pendente_desde = 0 if self._tamanho else None
+
+    def __len__(self):
+        return self._tamanho
+
+    def idade_pendentes(self):
+        """Segundos desde que a fila deixou de estar vazia (0 se vazia)."""
+        if self._pendente_desde is None:
+            return 0
+        return time.monotonic() - self._pendente_desde
+
+    def id_mensagem(self, seq):
+        """Id de deduplicação enviado junto com a leitura"""
+        return f"{self.produtor}-{seq}"
+
+    def adicionar(self, dados):
+        """
+        Grava a leitura na fila. Retorna o seq atribuído, ou None se
+        a fila estiver cheia e a política for 'newest'.
+        """
+        with self._conn:
+            if self._tamanho >= self.max_itens:
+                if self.drop_policy == 'newest':
+                    self.descartadas += 1
+                    return None
+
+                excesso = self._tamanho - self.max_itens + 1
+                self._conn.execute(
+                    "DELETE FROM outbox WHERE seq IN (SELECT seq FROM outbox ORDER BY seq LIMIT ?)",
+                    (excesso,)
+                )
+                self._tamanho -= excesso
+                self.descartadas += excesso
+
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (payload) VALUES (?)", (json.dumps(dados),)
+            )
+            if self._pendente_desde is None:
+                self._pendente_desde = time.monotonic()
+            self._tamanho += 1
+            return cursor.lastrowid
+
+    def pendentes(self, limite, apos_seq=0):
+        """
+        Retorna até 'limite' leituras mais antigas com seq > 'apos_seq': lista de (seq, dados).
+        'apos_seq' pula o que já foi publicado e ainda espera confirmação.
+        Os seqs retornados são sempre consecutivos (um lote pode ser
+        identificado pelo id da primeira leitura).
+        """
+        rows = self._conn.execute(
+            "SELECT seq, payload FROM outbox WHERE seq > ? ORDER BY seq LIMIT ?", (apos_seq, limite)
+        ).fetchall()
+
+        pendentes = []
+        for seq, payload in rows:
+            if pendentes and seq != pendentes[-1][0] + 1:
+                break
+            pendentes.append((seq, json.loads(payload)))
+        return pendentes
+
+    def confirmar(self, ate_seq):
+        """Remove da fila todas as leituras com seq <= ate_seq (já entregues)"""
+        with self._conn:
+            removidas = self._conn.execute("DELETE FROM outbox WHERE seq <= ?", (ate_seq,)).rowcount
+        self._tamanho -= removidas
+        if not self._tamanho:
+            self._pendente_desde = None
+        return removidas
+
+    def fechar(self):
+        self._conn.close()
+
+
+def outbox_padrao(nome_arquivo, **kwargs):
+    """Abre a outbox ao lado dos scripts de hardware (ex: hardware/outbox_producer.db)"""
+    return Outbox(os.path.join(os.path.dirname(os.path.abspath(__file__)), nome_arquivo), **kwargs)